@@ -0,0 +1,174 @@
+"""Named accounts, each with its own equity and option books.
+
+The default account is the original pair of books next to src/. Every
+other account keeps the same set of files (JSON and binary snapshots,
+journals, and the SQLite database once migrated) in a directory of its own
+beside the account index, accounts/accounts.json. The index lists the
+accounts, the one last used, and each account's totals per book (trades,
+open positions, realized and unrealized P/L) as of the last time its books
+were saved, so a summary across accounts reads one small file instead of
+opening every book.
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+
+from journal import write_atomic
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ACCOUNT = "Main"
+INDEX_VERSION = 1
+BOOKS = ("equity", "option")
+
+# The files of one book, and of an account's two books plus the database they move into once migrated
+BookFiles = namedtuple("BookFiles", ["save", "snapshot", "journal"])
+AccountFiles = namedtuple("AccountFiles", ["equity", "option", "database"])
+
+# One book's totals, as a PLRollup Bucket had them; unrealized_pl is None until a position was marked
+BookTotals = namedtuple("BookTotals", ["trades", "open", "realized_pl", "unrealized_pl"])
+# An account's totals per book and when they were taken (None if its books were never opened)
+AccountSummary = namedtuple("AccountSummary", ["name", "books", "updated"])
+
+
+def account_files(directory):
+    """The files of an account kept in `directory`, named as the default account's are."""
+    path = lambda name: os.path.join(directory, name)
+    return AccountFiles(
+        BookFiles(path(".etrades.json"), path(".etrades.bin"), path(".etrades.journal")),
+        BookFiles(path(".otrades.json"), path(".otrades.bin"), path(".otrades.journal")),
+        path(".trades.db"),
+    )
+
+
+def book_totals(bucket):
+    return BookTotals(bucket.trades, bucket.open, bucket.realized_pl, bucket.unrealized)
+
+
+def add_totals(totals):
+    """Sum BookTotals; the unrealized sum is None if none of them has one."""
+    unrealized = [item.unrealized_pl for item in totals if item.unrealized_pl is not None]
+    return BookTotals(
+        sum(item.trades for item in totals), sum(item.open for item in totals),
+        sum(item.realized_pl for item in totals), sum(unrealized) if unrealized else None,
+    )
+
+
+def describe(summaries, by_book, total):
+    """Text lines of a cross-account summary: a row per account, then per book and overall."""
+    amount = lambda value: "-" if value is None else f"{value:,.2f}"
+    row = lambda name, totals, note="": (
+        f"{name[:20]:<20} {totals.trades:>10,} {totals.open:>8,} {amount(totals.realized_pl):>14} "
+        f"{amount(totals.unrealized_pl):>14}  {note}"
+    ).rstrip()
+    lines = [f"{'Account':<20} {'Trades':>10} {'Open':>8} {'Realized':>14} {'Unrealized':>14}  As of"]
+    for summary in summaries:
+        if summary.books is None:
+            lines.append(f"{summary.name[:20]:<20} {'not summarized yet':>34}")
+        else:
+            lines.append(row(summary.name, add_totals(list(summary.books.values())), summary.updated or "open"))
+    lines.append("")
+    lines += [row(f"All {book}", totals) for book, totals in by_book.items()]
+    lines.append(row("All accounts", total))
+    return lines
+
+
+class AccountIndex:
+    """The accounts and their saved totals, read from and written back to the index at `path`.
+
+    `default_files` are the default account's AccountFiles; the other
+    accounts' directories sit next to the index.
+    """
+
+    def __init__(self, path, default_files):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.default_files = default_files
+        self.current = DEFAULT_ACCOUNT
+        # name -> {"dir": directory name or None, "books": {book: BookTotals fields}, "updated": time}
+        self.accounts = {DEFAULT_ACCOUNT: {"dir": None, "books": None, "updated": None}}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                if data.get("version") != INDEX_VERSION:
+                    raise ValueError(f"unsupported account index version {data.get('version')}")
+                self.accounts.update(data["accounts"])
+                if data.get("current") in self.accounts:
+                    self.current = data["current"]
+            except (OSError, ValueError, KeyError) as e:
+                log.error("Can't read the account index %s (%s); only %s is available.", path, e, DEFAULT_ACCOUNT)
+
+    def __contains__(self, name):
+        return name in self.accounts
+
+    def names(self):
+        """Account names, the default first and the rest alphabetically."""
+        return [DEFAULT_ACCOUNT] + sorted(name for name in self.accounts if name != DEFAULT_ACCOUNT)
+
+    def files(self, name):
+        if name == DEFAULT_ACCOUNT:
+            return self.default_files
+        return account_files(os.path.join(self.root, self.accounts[name]["dir"]))
+
+    def create(self, name):
+        """Add an empty account and return its files; ValueError if the name is blank or taken."""
+        name = " ".join(name.split())
+        if not name:
+            raise ValueError("Account name cannot be empty")
+        if name.lower() in (existing.lower() for existing in self.accounts):
+            raise ValueError(f"There is already an account called {name}")
+        slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "account"
+        taken = {entry["dir"] for entry in self.accounts.values()}
+        directory, n = slug, 1
+        while directory in taken or os.path.exists(os.path.join(self.root, directory)):
+            n += 1
+            directory = f"{slug}-{n}"
+        os.makedirs(os.path.join(self.root, directory))
+        self.accounts[name] = {"dir": directory, "books": None, "updated": None}
+        self.save()
+        return self.files(name)
+
+    def select(self, name):
+        """Remember `name` as the account to open on the next start."""
+        if name != self.current:
+            self.current = name
+            self.save()
+
+    def record(self, name, rollup, save=True):
+        """Keep an account's totals per book from its PLRollup, and save the index unless `save` is False."""
+        entry = self.accounts[name]
+        entry["books"] = {book: book_totals(bucket)._asdict() for book, bucket in rollup.by_book.items()}
+        entry["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        if save:
+            self.save()
+
+    def summary(self, name, rollup=None):
+        """An account's AccountSummary: live from `rollup` if it is open, else as last recorded."""
+        if rollup is not None:
+            books = {book: book_totals(bucket) for book, bucket in rollup.by_book.items()}
+            return AccountSummary(name, books, None)
+        entry = self.accounts[name]
+        if entry["books"] is None:
+            return AccountSummary(name, None, None)
+        return AccountSummary(name, {book: BookTotals(**totals) for book, totals in entry["books"].items()}, entry["updated"])
+
+    def summaries(self, rollups=None):
+        """Every account's AccountSummary and the BookTotals across all of them, per book and overall.
+
+        `rollups` (name -> PLRollup) gives the open accounts, whose live totals are used.
+        """
+        rollups = rollups or {}
+        summaries = [self.summary(name, rollups.get(name)) for name in self.names()]
+        known = [summary.books for summary in summaries if summary.books is not None]
+        by_book = {book: add_totals([books[book] for books in known]) for book in BOOKS}
+        return summaries, by_book, add_totals(list(by_book.values()))
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        write_atomic(self.path, json.dumps(
+            {"version": INDEX_VERSION, "current": self.current, "accounts": self.accounts}, indent=1
+        ))
@@ -0,0 +1,143 @@
+"""Debounced background snapshots of a TradeStore.
+
+Autosave listens to a store and keeps an immutable tuple per trade, rebuilt
+only for the trade an add or close touched. Taking a snapshot is then just
+copying those tuples into one more tuple, cheap enough for the UI thread.
+A MappedTradeStore already keeps its trades as columns, so for one the
+snapshot is a copy of the live columns instead. Encoding, the atomic write of
+the binary snapshot and folding the journal into it all happen on a worker
+thread, which also fsyncs the journal, so the caller never waits on the disk.
+
+Saves are debounced: one is due once the store has been quiet for `delay`
+seconds, or `max_delay` seconds after the first unsaved change if edits keep
+coming (a bulk import, say), so a burst of changes costs one or two writes.
+A save that fails is reported through `on_saved` and tried again on a
+later poll, since the journal still holds every change.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from mapstore import encode_records, write_columns
+
+log = logging.getLogger(__name__)
+
+SaveResult = namedtuple("SaveResult", ["path", "trades", "seq", "seconds", "error"])
+
+
+class Autosave:
+    """Background saver for one store's snapshot file; call poll() from the UI thread."""
+    # Books save one at a time, so concurrent saves don't take turns starving the UI thread of the GIL
+    write_lock = threading.Lock()
+
+    def __init__(self, store, snapshot_path, delay=1.0, max_delay=10.0, sync_interval=1.0, on_saved=None):
+        self.store = store
+        self.snapshot_path = snapshot_path
+        self.delay = delay
+        self.max_delay = max_delay
+        self.sync_interval = sync_interval
+        self.on_saved = on_saved
+        self.fields = store.trade_class.__slots__
+        # A paged store snapshots its own columns, so no records are kept for it
+        self.records = None if store.paged else {trade.id: self.record(trade) for trade in store}
+        store.listeners.append(self)
+
+        self.first_change = None
+        self.last_change = None
+        self.saving = False
+        # Set by the worker when a save failed, so the next poll() marks the store dirty again
+        self.retry = False
+        self.last_result = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+
+    def record(self, trade):
+        return tuple(getattr(trade, field) for field in self.fields)
+
+    def trade_added(self, trade):
+        if self.records is not None:
+            self.records[trade.id] = self.record(trade)
+        self.mark_dirty()
+
+    trade_closed = trade_added
+
+    def trade_removed(self, trade):
+        if self.records is not None:
+            self.records.pop(trade.id, None)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        self.last_change = time.monotonic()
+        if self.first_change is None:
+            self.first_change = self.last_change
+
+    @property
+    def dirty(self):
+        return self.first_change is not None
+
+    def poll(self):
+        """Start a save if one is due; call regularly from the thread that changes the store."""
+        if self.retry and not self.saving:
+            self.retry = False
+            self.mark_dirty()
+        if not self.dirty or self.saving:
+            return False
+        now = time.monotonic()
+        if now - self.last_change < self.delay and now - self.first_change < self.max_delay:
+            return False
+        self.save()
+        return True
+
+    def save(self):
+        """Snapshot the store now and queue it for writing."""
+        journal = self.store.journal
+        seq = journal.seq if journal is not None else 0
+        self.first_change = self.last_change = None
+        self.saving = True
+        snapshot = self.store.snapshot_columns() if self.records is None else tuple(self.records.values())
+        self.queue.put((seq, self.store.next_id, snapshot))
+
+    def run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                job = ()
+            if job is None:
+                return
+            journal = self.store.journal
+            if job:
+                self.write(journal, *job)
+            elif journal is not None:
+                journal.sync()
+
+    def write(self, journal, seq, next_id, snapshot):
+        error = None
+        trades = len(snapshot) if self.records is not None else len(snapshot[0]["id"])
+        start = time.perf_counter()
+        try:
+            with Autosave.write_lock:
+                start = time.perf_counter()
+                trade_class = self.store.trade_class
+                columns, strings = encode_records(trade_class, snapshot) if self.records is not None else snapshot
+                write_columns(self.snapshot_path, trade_class, columns, strings, seq, next_id)
+                if journal is not None:
+                    journal.truncate_through(seq)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            log.exception("Autosave of %s failed", self.snapshot_path)
+            # The journal still holds the changes; the UI thread tries again on its next poll
+            self.retry = True
+        finally:
+            self.last_result = SaveResult(self.snapshot_path, trades, seq, time.perf_counter() - start, error)
+            self.saving = False
+        if self.on_saved is not None:
+            self.on_saved(self.last_result)
+
+    def stop(self):
+        """Let any save in progress finish, then stop the worker."""
+        self.queue.put(None)
+        self.thread.join()
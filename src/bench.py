@@ -0,0 +1,372 @@
+"""Synthetic-data benchmarks for the trade tables and their persistence.
+
+    python src/bench.py [--sizes 1000,10000,100000,1000000] [--format binary|json] [--output bench.json]
+
+For each size, a seeded equity book and option book of that many trades are
+written to a scratch directory, as binary snapshots or (with --format json)
+as the JSON snapshots the app imports, and opened by a real MainWindow under an
+offscreen window with the mock GL backend, so no display is needed. The
+timings are:
+
+- load: from creating the window until both books are in and on screen,
+- scroll: each frame of scrolling down the table a screen at a time, and
+  row_create_ms, building one row's widgets,
+- add / close / delete: add_trade(), close_position() and delete_trade()
+  plus the frame that shows them,
+- save: taking the autosave snapshot on the UI thread, and writing it on
+  the worker.
+
+The books are written by the parent and each size runs in a fresh process,
+so its peak RSS is the app's own. It also reports how many distinct cell
+texts were rendered into textures and how often one was reused. The results,
+with the commit they were measured at, are written as JSON for comparing
+runs; see compare() for diffing two of them.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+from journal import write_snapshot_records
+from mapstore import write_trades
+from store import EquityTrade, OptionTrade
+
+SIZES = (1000, 10000, 100000, 1000000)
+# Adds and closes timed per book
+OPERATIONS = 200
+# Screens scrolled per book, and rows built to time row creation
+SCROLL_SCREENS = 100
+ROWS_CREATED = 20
+SEED = 20240101
+FORMATS = ("binary", "json")
+
+FIRST_DAY = date(2015, 1, 2).toordinal()
+LAST_DAY = date(2025, 12, 31).toordinal()
+CLOSED_FRACTION = 0.7
+
+
+def symbol_pool(rng, count):
+    """Made-up tickers with a few very active names and a long tail, like a real book."""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    symbols = set()
+    while len(symbols) < count:
+        symbols.add("".join(rng.choice(letters) for _ in range(rng.randint(2, 4))))
+    symbols = sorted(symbols)
+    weights = [1.0 / (rank + 1) for rank in range(count)]
+    prices = {symbol: round(rng.lognormvariate(4.0, 0.8), 2) for symbol in symbols}
+    return symbols, weights, prices
+
+
+def iso_day(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+def equity_trades(n, rng, closed_fraction=CLOSED_FRACTION):
+    symbols, weights, prices = symbol_pool(rng, 500)
+    for ticker in rng.choices(symbols, weights, k=n):
+        bought = rng.randint(FIRST_DAY, LAST_DAY)
+        price = round(prices[ticker] * rng.uniform(0.7, 1.3), 2)
+        trade = EquityTrade(ticker, iso_day(bought), price, rng.randint(1, 500))
+        if rng.random() < closed_fraction:
+            trade.close(iso_day(min(bought + rng.randint(1, 400), LAST_DAY)), round(price * rng.uniform(0.8, 1.25), 2))
+        yield trade
+
+
+def option_trades(n, rng, closed_fraction=CLOSED_FRACTION):
+    symbols, weights, prices = symbol_pool(rng, 100)
+    today = date.today().toordinal()
+    for underlier in rng.choices(symbols, weights, k=n):
+        opened = rng.randint(FIRST_DAY, LAST_DAY)
+        spot = round(prices[underlier] * rng.uniform(0.7, 1.3), 2)
+        strike = max(5.0, round(spot * rng.uniform(0.8, 1.2) / 5) * 5)
+        quantity = rng.randint(1, 20)
+        premium = round(max(0.05, abs(spot - strike) * 0.3 + spot * rng.uniform(0.01, 0.05)), 2)
+        closed = rng.random() < closed_fraction
+        # Open positions expire in the future so the greeks have something to price
+        expiry = opened + rng.randint(7, 400) if closed else today + rng.randint(7, 400)
+        trade = OptionTrade(
+            underlier, iso_day(opened), iso_day(expiry), rng.choice(("CALL", "PUT")), premium, strike, spot,
+            premium, round(0.65 * quantity, 2), quantity
+        )
+        if closed:
+            close = round(premium * rng.uniform(0.2, 2.0), 2)
+            trade.close(close, close)
+        yield trade
+
+
+def write_book(path, trades, book_format="json"):
+    """Write trades as a snapshot the tables load; returns how many there were."""
+    trades = list(trades)
+    for trade_id, trade in enumerate(trades, 1):
+        trade.id = trade_id
+    if not trades:
+        return 0
+    trade_class = type(trades[0])
+    if book_format == "binary":
+        return write_trades(path, trade_class, trades, 0)
+    fields = trade_class.__slots__
+    write_snapshot_records(path, fields, [tuple(getattr(trade, field) for field in fields) for trade in trades], 0)
+    return len(trades)
+
+
+def percentiles(samples):
+    """Median, p95 and max of a list of seconds, in milliseconds."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50_ms": pick(0.5) * 1000, "p95_ms": pick(0.95) * 1000, "max_ms": ordered[-1] * 1000}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def headless():
+    """Point Kivy at an offscreen window and the mock GL backend before it is imported."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+    os.environ.setdefault("KIVY_GL_BACKEND", "mock")
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_FILELOG", "1")
+    os.environ.setdefault("KCFG_KIVY_LOG_LEVEL", "warning")
+
+
+def book_paths(workdir):
+    """The gui module's file paths, pointed into `workdir`."""
+    return {
+        "EQUITY_SAVE_FILE": os.path.join(workdir, "etrades.json"),
+        "OPTION_SAVE_FILE": os.path.join(workdir, "otrades.json"),
+        "EQUITY_SNAPSHOT_FILE": os.path.join(workdir, "etrades.bin"),
+        "OPTION_SNAPSHOT_FILE": os.path.join(workdir, "otrades.bin"),
+        "EQUITY_JOURNAL_FILE": os.path.join(workdir, "etrades.journal"),
+        "OPTION_JOURNAL_FILE": os.path.join(workdir, "otrades.journal"),
+        "DATABASE_FILE": os.path.join(workdir, "no.db"),
+        "ACCOUNTS_FILE": os.path.join(workdir, "accounts", "accounts.json"),
+    }
+
+
+def generate(size, workdir, book_format="binary", seed=SEED):
+    """Write the seeded books of `size` trades into `workdir`; returns the seconds it took."""
+    rng = random.Random(seed)
+    paths = book_paths(workdir)
+    start = time.perf_counter()
+    suffix = "SNAPSHOT_FILE" if book_format == "binary" else "SAVE_FILE"
+    write_book(paths[f"EQUITY_{suffix}"], equity_trades(size, rng), book_format)
+    write_book(paths[f"OPTION_{suffix}"], option_trades(size, rng), book_format)
+    return time.perf_counter() - start
+
+
+def run_size(size, workdir, operations=OPERATIONS, seed=SEED):
+    """Benchmark the books generate() wrote into `workdir` in this process and return the result dict."""
+    rng = random.Random(seed)
+    paths = book_paths(workdir)
+    headless()
+    import gui
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+
+    for name, path in paths.items():
+        setattr(gui, name, path)
+
+    def frame():
+        EventLoop.idle()
+
+    # Load: until both books are in and their first rows are laid out
+    frames = []
+    start = time.perf_counter()
+    window = gui.MainWindow()
+    Window.add_widget(window)
+    tables = (window.etable, window.otable)
+    while True:
+        tick = time.perf_counter()
+        frame()
+        frames.append(time.perf_counter() - tick)
+        if not any(table.loading for table in tables):
+            break
+    frame()
+    load_seconds = time.perf_counter() - start
+    widgets_loaded = gui.widget_count()
+
+    result = {
+        "size": size,
+        "load_seconds": load_seconds,
+        "load_frames": percentiles(frames),
+        "books": {},
+    }
+
+    new_equities = list(equity_trades(operations, rng, closed_fraction=0))
+    new_options = list(option_trades(operations, rng, closed_fraction=0))
+    for table, new_trades, close_args in (
+        (window.etable, new_equities, ("2025-12-31", 100.0)),
+        (window.otable, new_options, (1.0, 1.0)),
+    ):
+        scrolls = []
+        rv = table.rv
+        step = rv.height / max(rv.children[0].height - rv.height, 1)
+        for _ in range(SCROLL_SCREENS):
+            if rv.scroll_y <= 0:
+                break
+            tick = time.perf_counter()
+            rv.scroll_y = max(rv.scroll_y - step, 0)
+            frame()
+            scrolls.append(time.perf_counter() - tick)
+
+        tick = time.perf_counter()
+        rows = [table.row_class() for _ in range(ROWS_CREATED)]
+        row_create_seconds = (time.perf_counter() - tick) / ROWS_CREATED
+        del rows
+
+        adds = []
+        for trade in new_trades:
+            tick = time.perf_counter()
+            table.add_trade(trade)
+            frame()
+            adds.append(time.perf_counter() - tick)
+
+        open_ids = [trade.id for trade in table.store.open_trades()]
+        closes = []
+        for trade_id in rng.sample(open_ids, min(operations, len(open_ids))):
+            tick = time.perf_counter()
+            table.close_position(trade_id, *close_args)
+            frame()
+            closes.append(time.perf_counter() - tick)
+
+        deletes = []
+        for trade_id in rng.sample(open_ids, min(operations, len(open_ids))):
+            tick = time.perf_counter()
+            table.delete_trade(trade_id)
+            frame()
+            deletes.append(time.perf_counter() - tick)
+
+        # Let any debounced save already under way finish, then time one of our own
+        autosave = table.autosave
+        while autosave.saving:
+            time.sleep(0.01)
+        tick = time.perf_counter()
+        autosave.save()
+        snapshot_seconds = time.perf_counter() - tick
+        while autosave.saving:
+            time.sleep(0.01)
+
+        result["books"][table.kind.lower()] = {
+            "trades": len(table.store),
+            "scroll": percentiles(scrolls),
+            "row_create_ms": row_create_seconds * 1000,
+            "add": percentiles(adds),
+            "close": percentiles(closes),
+            "delete": percentiles(deletes),
+            "save_snapshot_ms": snapshot_seconds * 1000,
+            "save_write_ms": autosave.last_result.seconds * 1000,
+            "save_error": autosave.last_result.error,
+            "row_widgets": len(table.rv.view_adapter.views),
+        }
+
+    result["widgets"] = {"loaded": widgets_loaded, "final": gui.widget_count()}
+    cache = gui.CELL_TEXTURES
+    result["cell_textures"] = {"cached": len(cache), "rendered": cache.misses, "reused": cache.hits}
+    result["peak_rss_mb"] = peak_rss_mb()
+    for table in tables:
+        table.close_book()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, operations=OPERATIONS, book_format="binary"):
+    """Run every size in its own process and collect the results."""
+    results = []
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix="options-bench-")
+        try:
+            generate_seconds = generate(size, workdir, book_format)
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--one", str(size), "--workdir", workdir,
+                 "--operations", str(operations)],
+                capture_output=True, text=True
+            )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if completed.returncode != 0:
+            print(f"{size:,} trades failed:\n{completed.stderr}", file=sys.stderr)
+            results.append({"size": size, "error": completed.stderr.strip().splitlines()[-1:]})
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result.update(format=book_format, generate_seconds=generate_seconds)
+        results.append(result)
+        books = result["books"]
+        print(
+            f"{size:>9,}  load {result['load_seconds']:7.2f} s  "
+            f"add p50 {books['equity']['add']['p50_ms']:6.1f}/{books['option']['add']['p50_ms']:6.1f} ms  "
+            f"close p50 {books['equity']['close']['p50_ms']:6.1f}/{books['option']['close']['p50_ms']:6.1f} ms  "
+            f"scroll p50 {books['equity']['scroll']['p50_ms']:6.1f}/{books['option']['scroll']['p50_ms']:6.1f} ms  "
+            f"save {books['equity']['save_write_ms']:7.0f}/{books['option']['save_write_ms']:7.0f} ms  "
+            f"rss {result['peak_rss_mb']:7.0f} MB  widgets {result['widgets']['final']}"
+        )
+    return {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "operations": operations,
+        "format": book_format,
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """Print each size's load time and peak RSS against an earlier results file."""
+    before = {result["size"]: result for result in old["results"] if "error" not in result}
+    for result in new["results"]:
+        base = before.get(result["size"])
+        if base is None or "error" in result:
+            continue
+        print(
+            f"{result['size']:>9,}  load {base['load_seconds']:.2f} -> {result['load_seconds']:.2f} s  "
+            f"rss {base['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the trade tables on synthetic books.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated trades per book")
+    parser.add_argument("--operations", type=int, default=OPERATIONS, help="adds and closes timed per book")
+    parser.add_argument("--format", choices=FORMATS, default="binary", help="how the books are saved before opening")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.one is not None:
+        print(json.dumps(run_size(args.one, args.workdir, args.operations)))
+        return 0
+
+    results = run([int(size) for size in args.sizes.split(",")], args.operations, args.format)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
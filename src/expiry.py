@@ -0,0 +1,191 @@
+"""Option lifecycle: expiring open positions as their expiry dates pass.
+
+An ExpiryIndex listens to the option store and files every open position
+under the date ordinal of its expiry, with the distinct expiries kept in
+order. A pass for a given day takes the expiries before it off the front and
+looks only at those positions, so checking the book costs the same whatever
+its size. Entries are never removed when a trade is closed, edited or
+deleted; instead a position is checked against the store when its expiry
+comes up and skipped if it has moved on.
+
+A position past expiry whose underlier's feed mark leaves it out of the
+money is closed at 0. One that expired in the money is kept open and
+reported, since whether it was exercised or assigned isn't known here. So
+is one whose underlier has no mark yet: the price recorded when it was
+opened says nothing about where it expired, so it waits, and is judged on
+a later pass once a mark comes in. A mark taken more than EXPIRY_MARK_DAYS
+after expiry says nothing about it either, so a position first judged
+later than that (the app was closed, or no mark came in) is never closed
+automatically; it stays open until the user closes it.
+"""
+from bisect import bisect_right, insort
+from collections import namedtuple
+
+import numpy as np
+
+from store import EquityTrade, date_ordinal
+
+# Open positions expiring within this many days are flagged
+EXPIRY_WARNING_DAYS = 7
+# Days after expiry that the current mark still stands for the underlier's price at expiry
+EXPIRY_MARK_DAYS = 1
+
+# One position taken off the index by expire(); held is days from opening to expiry, or None,
+# priced is False if there was no mark to judge it by, and stale is True if it expired too
+# long ago for the current mark to tell
+Expired = namedtuple("Expired", ["trade_id", "worthless", "held", "priced", "stale"])
+
+
+def opened_on(trade):
+    return trade.buy_date if isinstance(trade, EquityTrade) else trade.date
+
+
+def holding_days(trade, today):
+    """Days a trade was held: to its sell date, or to `today` while open. None without dates.
+
+    Options record no close date, so a closed one has no holding period.
+    """
+    opened = date_ordinal(opened_on(trade) or "")
+    if opened is None:
+        return None
+    if trade.is_open:
+        return today.toordinal() - opened
+    closed = date_ordinal(getattr(trade, "sell_date", None) or "")
+    return None if closed is None else closed - opened
+
+
+def is_worthless(trade, spot):
+    """Whether an option expires out of the money with the underlier at `spot`."""
+    if trade.type == "CALL":
+        return spot <= trade.strike
+    return spot >= trade.strike
+
+
+class ExpiryIndex:
+    """Open option positions by expiry, for expire() and expiring()."""
+
+    def __init__(self):
+        self.store = None
+        # Distinct expiry ordinals, ascending, and the trade ids filed under each
+        self.ordinals = []
+        self.ids = {}
+        # Expired positions still open, in the money or not yet priced: trade id -> expiry ordinal
+        self.unresolved = {}
+        # The ids among them still waiting for a mark, and those left for the user to close
+        self.unpriced = set()
+        self.stale = set()
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.ids.values())
+
+    def watch(self, store):
+        """File the open positions already in `store` and follow its changes."""
+        self.store = store
+        if getattr(store, "columns", None) is not None:
+            self.add_columns(store)
+            trades = store.added.values()
+        else:
+            trades = store.open_trades()
+        for trade in trades:
+            self.trade_added(trade)
+        store.listeners.append(self)
+
+    def add_columns(self, store):
+        """File the open snapshot rows of a MappedTradeStore, grouped by expiry with NumPy."""
+        columns = store.columns
+        rows = np.flatnonzero(store.alive & np.isnan(columns["close_price"]))
+        ordinal_of = np.array(
+            [(date_ordinal(value) if value else None) or -1 for value in store.strings["expiry"]], dtype=np.int64
+        )
+        ordinals = ordinal_of[columns["expiry"][rows]]
+        rows, ordinals = rows[ordinals >= 0], ordinals[ordinals >= 0]
+        order = np.argsort(ordinals, kind="stable")
+        unique, starts = np.unique(ordinals[order], return_index=True)
+        for ordinal, ids in zip(unique.tolist(), np.split(store.ids[rows[order]], starts[1:])):
+            self.file(ordinal, ids.tolist())
+
+    def file(self, ordinal, trade_ids):
+        ids = self.ids.get(ordinal)
+        if ids is None:
+            ids = self.ids[ordinal] = []
+            insort(self.ordinals, ordinal)
+        ids.extend(trade_ids)
+
+    def trade_added(self, trade):
+        if trade.is_open and trade.expiry:
+            ordinal = date_ordinal(trade.expiry)
+            if ordinal is not None:
+                self.file(ordinal, [trade.id])
+
+    def trade_closed(self, trade):
+        self.unresolved.pop(trade.id, None)
+        self.unpriced.discard(trade.id)
+        self.stale.discard(trade.id)
+
+    trade_removed = trade_closed
+
+    def current(self, ordinal, trade_ids):
+        """The trades among `trade_ids` still open and expiring on `ordinal`, once each."""
+        store = self.store
+        for trade_id in dict.fromkeys(trade_ids):
+            if trade_id not in store:
+                continue
+            trade = store.get(trade_id)
+            if trade.is_open and date_ordinal(trade.expiry or "") == ordinal:
+                yield trade
+
+    def expire(self, today, spot_of):
+        """Close the positions that expired before `today` out of the money; returns an Expired per position.
+
+        `spot_of(trade)` is the current underlier price to judge a position
+        by, or None if there is none yet; such a position stays open and is
+        judged again on each pass until it has one, or until it is stale.
+        Positions already reported are only reported again once they are
+        priced or stale.
+        """
+        expired = []
+        for trade_id in list(self.unpriced):
+            trade = self.store.get(trade_id)
+            ordinal = self.unresolved[trade_id]
+            if self.is_stale(ordinal, today) or spot_of(trade) is not None:
+                self.unpriced.discard(trade_id)
+                expired.append(self.judge(trade, self.unresolved.pop(trade_id), spot_of, today))
+        due = bisect_right(self.ordinals, today.toordinal() - 1)
+        for ordinal in self.ordinals[:due]:
+            for trade in self.current(ordinal, self.ids.pop(ordinal)):
+                expired.append(self.judge(trade, ordinal, spot_of, today))
+        del self.ordinals[:due]
+        return expired
+
+    def is_stale(self, ordinal, today):
+        return today.toordinal() - ordinal > EXPIRY_MARK_DAYS
+
+    def judge(self, trade, ordinal, spot_of, today):
+        """Close an expired position if it is out of the money at its mark, else keep it among the unresolved."""
+        opened = date_ordinal(trade.date or "")
+        held = None if opened is None else ordinal - opened
+        stale = self.is_stale(ordinal, today)
+        spot = None if stale else spot_of(trade)
+        worthless = spot is not None and trade.strike is not None and is_worthless(trade, spot)
+        if worthless:
+            self.store.close(trade.id, 0.0, 0.0)
+        else:
+            self.unresolved[trade.id] = ordinal
+            if stale:
+                self.stale.add(trade.id)
+            elif spot is None:
+                self.unpriced.add(trade.id)
+        return Expired(trade.id, worthless, held, spot is not None, stale)
+
+    def expiring(self, today, days=EXPIRY_WARNING_DAYS):
+        """(expiry ordinal, open trades) for each expiry from `today` through `days` ahead, soonest first."""
+        start = bisect_right(self.ordinals, today.toordinal() - 1)
+        stop = bisect_right(self.ordinals, today.toordinal() + days)
+        expiring = []
+        for ordinal in self.ordinals[start:stop]:
+            trades = list(self.current(ordinal, self.ids[ordinal]))
+            # Drop the entries of trades that have since been closed, edited or deleted
+            self.ids[ordinal] = [trade.id for trade in trades]
+            if trades:
+                expiring.append((ordinal, trades))
+        return expiring
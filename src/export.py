@@ -0,0 +1,281 @@
+"""Streaming trade exports: CSV, JSON Lines and the columnar snapshot format.
+
+An Export walks one book a chunk at a time and writes each matching trade
+as it goes, so memory stays flat however long the history is. The rows to
+visit are picked on the calling thread: the trades of an in-memory book,
+the live rows of a binary snapshot (narrowed by symbol and status with
+NumPy first), or nothing at all for SQLite, whose rows are read back on a
+connection of the export's own. The values of those trades are copied then
+too (the chosen snapshot rows as column arrays, other trades as tuples), so
+closes and edits made while the export runs can't reach it half-applied.
+run() can then go on a background thread.
+
+The columnar format is the snapshot format of mapstore.py, so an export
+can be opened as a book or read with NumPy. Its columns are spilled to
+temporary files chunk by chunk and joined once the row count is known.
+Every format is written to a temporary file first and renamed into place,
+so a cancelled or failed export leaves no partial file behind.
+"""
+import contextlib
+import csv
+import json
+import logging
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from mapstore import ALIGN, DTYPES, column_kinds, decode_rows, encode_records, snapshot_header
+from sqlstore import TABLES, SqliteTradeStore
+from store import date_ordinal
+
+log = logging.getLogger(__name__)
+
+# Export format -> file extension
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "columnar": ".bin"}
+# Trades decoded and written per step
+EXPORT_CHUNK = 10000
+
+ExportResult = namedtuple("ExportResult", ["path", "trades", "scanned", "seconds"])
+
+
+class TradeFilter:
+    """Which trades an export keeps: a symbol, open or closed, and a date range on one date field."""
+
+    def __init__(self, symbol=None, status=None, date_field=None, date_from=None, date_to=None):
+        self.symbol = symbol.strip().upper() if symbol else None
+        self.status = status if status in ("open", "closed") else None
+        self.date_field = date_field
+        self.low = date_ordinal(date_from) if date_from else None
+        self.high = date_ordinal(date_to) if date_to else None
+        if (date_from and self.low is None) or (date_to and self.high is None):
+            raise ValueError("Dates must look like YYYY-MM-DD")
+
+    @property
+    def dated(self):
+        return self.low is not None or self.high is not None
+
+    def field_for(self, spec):
+        """The date field to range over in a book; the book's first if this one isn't among its fields."""
+        return self.date_field if self.date_field in spec.date_fields else spec.date_fields[0]
+
+    def matches(self, trade, date_field):
+        if self.symbol and trade.symbol != self.symbol:
+            return False
+        if self.status and trade.is_open != (self.status == "open"):
+            return False
+        if self.dated:
+            ordinal = date_ordinal(getattr(trade, date_field) or "")
+            if ordinal is None or (self.low is not None and ordinal < self.low):
+                return False
+            if self.high is not None and ordinal > self.high:
+                return False
+        return True
+
+
+class Writer:
+    """Writes chunks of trades to an open file; finish() completes the file, discard() drops any scratch files."""
+
+    def write(self, trades):
+        raise NotImplementedError
+
+    def finish(self, f):
+        pass
+
+    def discard(self):
+        pass
+
+
+class CsvWriter(Writer):
+    """One row per trade: the id, the stored fields and the realized P/L; blank for missing values."""
+
+    def __init__(self, f, trade_class):
+        self.fields = trade_class.__slots__
+        self.writer = csv.writer(f)
+        self.writer.writerow(self.fields + ("pl",))
+
+    def write(self, trades):
+        fields = self.fields
+        self.writer.writerows(
+            ["" if value is None else value for value in [getattr(trade, field) for field in fields] + [trade.pl]]
+            for trade in trades
+        )
+
+
+class JsonLinesWriter(Writer):
+    """One JSON object per line, as in the JSON snapshots."""
+
+    def __init__(self, f, trade_class):
+        self.f = f
+
+    def write(self, trades):
+        self.f.writelines(json.dumps(trade.to_dict(), separators=(",", ":")) + "\n" for trade in trades)
+
+
+class ColumnarWriter(Writer):
+    """A mapstore snapshot, its columns spilled to one temporary file each until the header can be written."""
+
+    def __init__(self, f, trade_class):
+        self.trade_class = trade_class
+        self.fields = trade_class.__slots__
+        self.kinds = column_kinds(trade_class)
+        self.spill_paths = {field: f"{f.name}.{field}" for field in self.kinds}
+        self.spills = {field: open(path, "wb") for field, path in self.spill_paths.items()}
+        self.tables = {}
+        self.strings = {field: [None] for field, kind in self.kinds.items() if kind == "TEXT"}
+        self.count = 0
+        self.last_id = 0
+
+    def write(self, trades):
+        if not trades:
+            return
+        fields = self.fields
+        columns, self.strings = encode_records(
+            self.trade_class, [tuple(getattr(trade, field) for field in fields) for trade in trades], self.tables
+        )
+        for field, column in columns.items():
+            self.spills[field].write(column.tobytes())
+        self.count += len(trades)
+        self.last_id = max(self.last_id, int(columns["id"][-1]))
+
+    def finish(self, f):
+        f.write(snapshot_header(self.trade_class, self.count, self.strings, 0, self.last_id + 1))
+        for field, spill in self.spills.items():
+            spill.close()
+            with open(self.spill_paths[field], "rb") as column:
+                shutil.copyfileobj(column, f)
+            size = self.count * np.dtype(DTYPES[self.kinds[field]]).itemsize
+            f.write(b"\0" * (-size % ALIGN))
+
+    def discard(self):
+        for field, spill in self.spills.items():
+            spill.close()
+            try:
+                os.remove(self.spill_paths[field])
+            except FileNotFoundError:
+                pass
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonLinesWriter, "columnar": ColumnarWriter}
+
+
+class Export:
+    """Export of one book to `path`; construct it on the thread that owns the store, then call run() anywhere."""
+
+    def __init__(self, store, path, fmt="csv", trade_filter=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown export format {fmt!r}")
+        self.trade_class = store.trade_class
+        self.path = path
+        self.fmt = fmt
+        self.filter = trade_filter or TradeFilter()
+        spec = TABLES[store.trade_class]
+        self.date_field = self.filter.field_for(spec)
+        self.database = None
+        # Copies of the snapshot rows to export and their string tables, for a mapped book
+        self.columns = None
+        fields = store.trade_class.__slots__
+        if getattr(store, "columns", None) is not None:
+            rows = self.snapshot_rows(store, spec)
+            self.columns = {field: column[rows] for field, column in store.columns.items()}
+            self.strings = {field: list(table) for field, table in store.strings.items()}
+            self.kinds = store.kinds
+            self.rows = len(rows)
+            trades = store.added.values()
+        elif getattr(store, "connection", None) is not None:
+            # The store's connection belongs to the UI thread; the export opens its own
+            self.database = store.path
+            self.rows = 0
+            trades = ()
+        else:
+            self.rows = 0
+            trades = store.trades.values()
+        # Field values of the in-memory trades, as they are now
+        self.records = [tuple(getattr(trade, field) for field in fields) for trade in trades]
+        self.total = len(store) if self.database is not None else self.rows + len(self.records)
+
+    def snapshot_rows(self, store, spec):
+        """Live snapshot rows, narrowed by symbol and status over the columns; dates are checked per trade."""
+        mask = store.alive.copy()
+        if self.filter.symbol:
+            code = store.lookup(spec.symbol_field, self.filter.symbol)
+            mask &= False if code is None else store.columns[spec.symbol_field] == code
+        if self.filter.status:
+            is_open = np.isnan(store.columns[spec.open_column])
+            mask &= is_open if self.filter.status == "open" else ~is_open
+        return np.flatnonzero(mask)
+
+    def chunks(self):
+        """Lists of up to EXPORT_CHUNK trades, in id order, before filtering."""
+        if self.database is not None:
+            store = SqliteTradeStore(self.trade_class, self.database)
+            try:
+                trades = iter(store)
+                while True:
+                    chunk = [trade for _, trade in zip(range(EXPORT_CHUNK), trades)]
+                    if not chunk:
+                        return
+                    yield chunk
+            finally:
+                store.close_storage()
+        for start in range(0, self.rows, EXPORT_CHUNK):
+            rows = slice(start, start + EXPORT_CHUNK)
+            yield decode_rows(self.trade_class, self.kinds, self.columns, self.strings, rows)
+        make, records = self.trade_class, self.records
+        for start in range(0, len(records), EXPORT_CHUNK):
+            yield [make(*record[1:], id=record[0]) for record in records[start:start + EXPORT_CHUNK]]
+
+    def run(self, progress=None, cancel=None):
+        """Write the export and return an ExportResult, or None if `cancel` (an Event) was set.
+
+        `progress(done, total)` is called after every chunk, from this thread.
+        """
+        started = time.perf_counter()
+        tmp_path = self.path + ".tmp"
+        binary = self.fmt == "columnar"
+        try:
+            with open(tmp_path, "wb" if binary else "w", newline=None if binary else "") as f:
+                writer = WRITERS[self.fmt](f, self.trade_class)
+                try:
+                    counts = self.write(f, writer, progress, cancel)
+                finally:
+                    writer.discard()
+        except BaseException:
+            # open() itself may have failed, leaving nothing to remove
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        if counts is None:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, self.path)
+        seconds = time.perf_counter() - started
+        log.info("Exported %d of %d trades to %s in %.2fs", counts[0], counts[1], self.path, seconds)
+        return ExportResult(self.path, counts[0], counts[1], seconds)
+
+    def write(self, f, writer, progress, cancel):
+        """Filter and write every chunk, returning (trades written, trades scanned) or None if cancelled."""
+        matches, date_field = self.filter.matches, self.date_field
+        written = scanned = 0
+        for chunk in self.chunks():
+            if cancel is not None and cancel.is_set():
+                return None
+            kept = [trade for trade in chunk if matches(trade, date_field)]
+            writer.write(kept)
+            written += len(kept)
+            scanned += len(chunk)
+            if progress is not None:
+                progress(scanned, self.total)
+            time.sleep(0)  # hand the GIL back between chunks
+        writer.finish(f)
+        f.flush()
+        os.fsync(f.fileno())
+        return written, scanned
+
+
+def book_path(path, book):
+    """`path` with the book's name before the extension, for exporting both books at once."""
+    root, ext = os.path.splitext(path)
+    return f"{root}-{book}{ext}"
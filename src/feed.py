@@ -0,0 +1,200 @@
+"""Live underlier prices for marking open positions to market.
+
+A PriceFeed runs an asyncio event loop on a background thread and merges the
+ticks from any number of sources into one dict of latest prices. Consumers
+call drain() to take everything that changed since the last call, so however
+fast ticks arrive, each drain (the GUI does one per frame) sees at most one
+price per symbol.
+
+Sources are async iterators of (symbol, price). ReplaySource plays back a
+file of `SYMBOL,PRICE` lines (the marks format the reports read) at a fixed
+rate; SocketSource reads the same lines from a TCP connection. Running this
+module serves a file over TCP for testing:
+
+    python src/feed.py prices.csv --port 9100 --rate 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+
+log = logging.getLogger(__name__)
+
+# Replay sleeps at most this often, sending the ticks due in between as a burst
+REPLAY_STEP = 0.01
+
+
+def parse_tick(line):
+    """Parse a `SYMBOL,PRICE` line, or return None for blank, comment or malformed lines."""
+    parts = line.strip().split(",")
+    if len(parts) < 2 or not parts[0] or parts[0].startswith("#"):
+        return None
+    try:
+        return parts[0].strip().upper(), float(parts[1])
+    except ValueError:
+        return None
+
+
+def read_ticks(path):
+    with open(path, "r") as f:
+        return [tick for tick in map(parse_tick, f) if tick is not None]
+
+
+class ReplaySource:
+    """Play a ticks file back at `rate` ticks per second, looping if `repeat` is set."""
+
+    def __init__(self, path, rate=100.0, repeat=True):
+        self.path = path
+        self.rate = rate
+        self.repeat = repeat
+
+    def __repr__(self):
+        return f"ReplaySource({self.path!r}, rate={self.rate})"
+
+    async def __aiter__(self):
+        ticks = read_ticks(self.path)
+        if not ticks:
+            return
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        while True:
+            for tick in ticks:
+                yield tick
+                sent += 1
+                ahead = sent / self.rate - (loop.time() - start)
+                if ahead >= REPLAY_STEP:
+                    await asyncio.sleep(ahead)
+            if not self.repeat:
+                return
+
+
+class SocketSource:
+    """Read `SYMBOL,PRICE` lines from a TCP server, reconnecting when the connection drops."""
+
+    def __init__(self, host, port, retry_delay=1.0):
+        self.host = host
+        self.port = port
+        self.retry_delay = retry_delay
+
+    def __repr__(self):
+        return f"SocketSource({self.host!r}, {self.port})"
+
+    async def __aiter__(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                log.warning("Price feed could not connect to %s:%s: %s", self.host, self.port, e)
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                while line := await reader.readline():
+                    tick = parse_tick(line.decode("utf-8", "replace"))
+                    if tick is not None:
+                        yield tick
+            finally:
+                writer.close()
+            await asyncio.sleep(self.retry_delay)
+
+
+def open_source(spec, rate=100.0):
+    """Build a source from a file path or a `host:port` address."""
+    if not os.path.exists(spec) and ":" in spec:
+        host, _, port = spec.rpartition(":")
+        if port.isdigit():
+            return SocketSource(host or "127.0.0.1", int(port))
+    return ReplaySource(spec, rate=rate)
+
+
+class PriceFeed:
+    """Merge ticks from `sources` on a background asyncio loop into a coalesced batch of changes."""
+
+    def __init__(self, sources):
+        self.sources = list(sources)
+        self.prices = {}
+        self.changed = {}
+        self.ticks = 0
+        self.lock = threading.Lock()
+        self.loop = None
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.run())
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.task,),
+                                       name="price-feed", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Cancel the sources and wait for the feed thread to exit."""
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    async def run(self):
+        try:
+            await asyncio.gather(*(self.consume(source) for source in self.sources))
+        except asyncio.CancelledError:
+            pass
+
+    async def consume(self, source):
+        try:
+            async for symbol, price in source:
+                self.update(symbol, price)
+        except OSError as e:
+            log.error("Price feed %r stopped: %s", source, e)
+
+    def update(self, symbol, price):
+        with self.lock:
+            self.ticks += 1
+            if self.prices.get(symbol) != price:
+                self.prices[symbol] = price
+                self.changed[symbol] = price
+
+    def drain(self):
+        """Return {symbol: price} for every symbol whose price changed since the last drain."""
+        with self.lock:
+            changed, self.changed = self.changed, {}
+        return changed
+
+
+async def serve_replay(path, host, port, rate):
+    """Stream a ticks file to every client that connects, at `rate` ticks per second."""
+    async def handle(reader, writer):
+        try:
+            async for symbol, price in ReplaySource(path, rate=rate):
+                writer.write(f"{symbol},{price}\n".encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Replaying {path} on {host}:{port} at {rate:g} ticks/s")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a SYMBOL,PRICE file as a looping TCP price feed.")
+    parser.add_argument("path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--rate", type=float, default=1000.0, help="ticks per second")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_replay(args.path, args.host, args.port, args.rate))
+    except KeyboardInterrupt:
+        pass
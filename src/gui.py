@@ -0,0 +1,2614 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from datetime import date
+from bisect import bisect_left
+from collections import OrderedDict
+from operator import attrgetter, itemgetter
+from kivy.app import App
+from kivy.uix.button import Button
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.popup import Popup
+from kivy.uix.textinput import TextInput
+from kivy.uix.label import Label
+from kivy.uix.spinner import Spinner
+from kivy.uix.slider import Slider
+from kivy.uix.progressbar import ProgressBar
+from kivy.uix.widget import Widget
+from kivy.uix.gridlayout import GridLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recyclelayout import RecycleLayout
+from kivy.clock import Clock
+from kivy.graphics import ClearBuffers, ClearColor, Color, Fbo, Line, Rectangle
+from kivy.core.text import Label as CoreLabel
+from kivy.core.window import Window
+from kivy.metrics import sp
+from kivy.properties import StringProperty
+
+import perf
+import risk
+from accounts import AccountFiles, AccountIndex, BookFiles, describe
+from autosave import Autosave
+from expiry import EXPIRY_MARK_DAYS, EXPIRY_WARNING_DAYS, ExpiryIndex
+from export import FORMATS, Export, TradeFilter, book_path
+from feed import PriceFeed, open_source
+from importer import BookCopy, Deduplicator, existing_keys, import_statement
+from index import TradeIndex
+from journal import set_aside, stream_book
+from lots import LotBook
+from mapstore import MappedIndex, MappedTradeStore
+from paths import (
+    ACCOUNTS_FILE, DATABASE_FILE, EQUITY_JOURNAL_FILE, EQUITY_SAVE_FILE, EQUITY_SNAPSHOT_FILE, EXPORT_DIR, OPTION_JOURNAL_FILE,
+    OPTION_SAVE_FILE, OPTION_SNAPSHOT_FILE, PROFILE_DIR
+)
+from pricing import GreeksBook, scenario_grid
+from report import format_pl
+from rollup import UNDATED, PLRollup
+from sqlstore import SqliteIndex, SqliteTradeStore
+from store import MISSING, EquityTrade, OptionTrade, TradeStore, date_ordinal, format_float, normalize_date
+
+log = logging.getLogger(__name__)
+
+# Snapshot a book once it has been quiet this long, or this long after the first unsaved change
+AUTOSAVE_DELAY = 1.0
+AUTOSAVE_MAX_DELAY = 10.0
+AUTOSAVE_POLL_INTERVAL = 0.25
+
+# Trades turned into rows per frame while a book loads
+LOAD_CHUNK_SIZE = 5000
+
+# Rows fetched per page from the SQLite backend, and how close to the bottom (as scroll_y) to fetch the next
+PAGE_SIZE = 500
+PAGE_AHEAD = 0.1
+
+# Imported batches allowed to wait for the UI thread at once
+IMPORT_BATCHES_AHEAD = 2
+
+# Payoff diagram grid: prices either side of the underlier (as a fraction of it), and grid size
+SCENARIO_RANGE = 0.5
+SCENARIO_PRICES = 200
+SCENARIO_DATES = 60
+EXPIRY_COLOR = (0.4, 0.7, 1, 1)
+VALUE_COLOR = (1, 0.6, 0.2, 1)
+HISTOGRAM_COLOR = (0.5, 0.9, 0.5, 1)
+
+# Accounts kept open, current one included, so switching back to a recent one is instant
+ACCOUNT_CACHE_SIZE = 3
+# Seconds after a book is saved before its account's totals are written to the account index
+ACCOUNT_RECORD_DELAY = 5.0
+
+# How often open option positions are checked for expiry, in seconds, besides after every change
+EXPIRY_CHECK_INTERVAL = 60
+
+# Rows per column of the P/L summary panel, and how long it waits to coalesce updates before redrawing
+SUMMARY_LINES = 6
+SUMMARY_INTERVAL = 0.25
+
+# The performance overlay: its toggle key (F12), refresh interval, and the spans it can profile
+OVERLAY_KEY = 293
+OVERLAY_INTERVAL = 0.5
+PROFILED_SPANS = (
+    "add_trades", "close_position", "apply_view", "open_popup", "refresh_greeks", "apply_prices", "import_batch",
+    "load_chunk", "summary", "chart_redraw", "edit_trade", "delete_trade", "check_expiries", "sell_shares",
+    "switch_account"
+)
+
+class CloseOptionPositionPopup(Popup):
+    def __init__(self, otrade_table, trade_id, **kwargs):
+        super().__init__(title="Close Option Position", size_hint=(0.7, 0.5), **kwargs)
+        self.otrade_table = otrade_table
+        self.trade_id = trade_id
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        fields = ["Close Price", "Close Premium"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Confirm", on_press=self.confirm_close_position)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_close_position(self, instance):
+        """Validate input, update row with sell details, and compute P/L."""
+        try:
+            close_text = self.inputs["Close Price"].text.strip()
+            close_prem_text = self.inputs["Close Premium"].text.strip()
+
+            try:
+                close = float(close_text)
+                close_prem = float(close_prem_text)
+            except ValueError:
+                log.warning("Close Price and Close Premium must be valid numbers.")
+                return
+
+            if close <= 0 or close_prem <= 0:
+                log.warning("Close Price and Close Premium must be greater than 0.")
+                return
+
+            self.otrade_table.close_position(self.trade_id, close, close_prem)
+            self.dismiss()
+
+        except Exception as e:
+            log.exception("Unexpected error: %s", e)
+
+class ClosePositionPopup(Popup):
+    def __init__(self, trade_table, trade_id, **kwargs):
+        super().__init__(title="Close Position", size_hint=(0.7, 0.5), **kwargs)
+        self.trade_table = trade_table
+        self.trade_id = trade_id
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields; Shares starts at the whole lot, and fewer sells only part of it
+        self.inputs = {}
+        fields = ["Sell Date", "Sell Price", "Shares"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            if field == "Shares":
+                text_input.text = str(trade_table.store.get(trade_id).num_shares)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Confirm", on_press=self.confirm_close_position)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_close_position(self, instance):
+        """Validate input, update row with sell details, and compute P/L."""
+        try:
+            sell_date = self.inputs["Sell Date"].text.strip()
+            sell_price_text = self.inputs["Sell Price"].text.strip()
+
+            if not sell_date:
+                log.warning("Sell Date cannot be empty.")
+                return
+
+            try:
+                sell_date = normalize_date(sell_date)
+            except ValueError:
+                log.warning("Sell Date must look like YYYY-MM-DD.")
+                return
+
+            try:
+                sell_price = float(sell_price_text)
+            except ValueError:
+                log.warning("Sell Price must be a valid number.")
+                return
+
+            if sell_price <= 0:
+                log.warning("Sell Price must be greater than 0.")
+                return
+
+            try:
+                shares = int(self.inputs["Shares"].text)
+            except ValueError:
+                log.warning("Shares must be a whole number.")
+                return
+
+            trade = self.trade_table.store.get(self.trade_id)
+            if not trade.is_open:
+                log.warning("Trade %s is already closed.", self.trade_id)
+                return
+            if not 0 < shares <= trade.num_shares:
+                log.warning("Shares must be from 1 to the %s shares in the lot.", trade.num_shares)
+                return
+
+            # Stays open, with the reason logged, if the sell is refused
+            if self.trade_table.close_position(self.trade_id, sell_date, sell_price, shares):
+                self.dismiss()
+
+        except Exception as e:
+            log.exception("Unexpected error: %s", e)
+
+class EditTradePopup(Popup):
+    """Edit any stored column of a trade, prefilled with its current values ("-" for none)."""
+
+    def __init__(self, trade_table, trade_id, **kwargs):
+        super().__init__(title=f"Edit {trade_table.kind} Trade {trade_id}", size_hint=(0.7, 0.9), **kwargs)
+        self.trade_table = trade_table
+        self.trade_id = trade_id
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        cells = trade_table.store.get(trade_id).to_row()
+        for column in trade_table.edit_columns:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{trade_table.headers[column]}:", size_hint_x=0.4)
+            text_input = TextInput(text=cells[column], multiline=False)
+            self.inputs[column] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Save", on_press=self.confirm_edit)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_edit(self, instance):
+        """Parse the fields like a saved row and save whichever of them changed."""
+        table = self.trade_table
+        trade = table.store.get(self.trade_id)
+        cells = trade.to_row()
+        for column, text_input in self.inputs.items():
+            text = text_input.text.strip()
+            cells[column] = text.upper() if column in table.upper_columns else text
+        if not cells[0]:
+            log.warning("%s cannot be empty.", table.headers[0])
+            return
+        try:
+            edited = table.trade_class.from_row(cells, id=self.trade_id)
+            for field in table.date_fields:
+                setattr(edited, field, normalize_date(getattr(edited, field)))
+        except ValueError:
+            log.warning("Invalid Input: Ensure numeric fields contain valid numbers and dates look like YYYY-MM-DD.")
+            return
+
+        changes = {}
+        for field in table.trade_class.__slots__[1:]:
+            if getattr(edited, field) != getattr(trade, field):
+                changes[field] = getattr(edited, field)
+        if changes:
+            table.edit_trade(self.trade_id, changes)
+        self.dismiss()
+
+
+class DeleteTradePopup(Popup):
+    def __init__(self, trade_table, trade_id, **kwargs):
+        super().__init__(title="Delete Trade", size_hint=(0.6, 0.35), **kwargs)
+        self.trade_table = trade_table
+        self.trade_id = trade_id
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        trade = trade_table.store.get(trade_id)
+        summary = "  ".join(cell for cell in trade.to_row()[:4] if cell != MISSING)
+        layout.add_widget(Label(text=f"Delete {trade_table.kind.lower()} trade {trade_id} ({summary})?"))
+
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Delete", on_press=self.confirm_delete)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_delete(self, instance):
+        self.trade_table.delete_trade(self.trade_id)
+        self.dismiss()
+
+ROW_HEIGHT = 40
+DEFAULT_COLOR = (1, 1, 1, 1)
+# Table cell text: Label's default font, and the distinct texts whose rendered textures are kept
+CELL_FONT_NAME = "Roboto"
+CELL_FONT_SIZE = sp(15)
+CELL_PADDING = 10
+TEXTURE_CACHE_SIZE = 512
+# Realized P/L is drawn in full green/red, unrealized (marked to the feed) paler
+GAIN_COLOR, LOSS_COLOR = (0, 1, 0, 1), (1, 0, 0, 1)
+UNREALIZED_GAIN_COLOR, UNREALIZED_LOSS_COLOR = (0.6, 1, 0.6, 1), (1, 0.6, 0.6, 1)
+
+def widget_count():
+    """Widgets currently in the window, popups included."""
+    return sum(1 for root in Window.children for _ in root.walk())
+
+class TextureCache:
+    """Rendered text textures by (text, font, size), least recently used dropped first.
+
+    The tables show the same strings over and over: tickers, dates, option
+    types, "-". Each is rendered once, in white and only as wide as the text,
+    and every cell showing it draws that one texture tinted to the cell's
+    colour, so scrolling or refreshing a row only renders text it hasn't seen
+    lately. A cell keeps its texture alive after it has been dropped from the
+    cache, so the cache only needs to hold about a screenful.
+    """
+
+    def __init__(self, size=TEXTURE_CACHE_SIZE):
+        self.size = size
+        self.textures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.textures)
+
+    def get(self, text, font_name=CELL_FONT_NAME, font_size=CELL_FONT_SIZE, bold=False):
+        key = (text, font_name, font_size, bold)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+            self.hits += 1
+            return texture
+        self.misses += 1
+        perf.count("cell textures rendered")
+        label = CoreLabel(text=text, font_name=font_name, font_size=font_size, bold=bold)
+        label.refresh()
+        texture = self.textures[key] = label.texture
+        if len(self.textures) > self.size:
+            self.textures.popitem(last=False)
+        return texture
+
+
+CELL_TEXTURES = TextureCache()
+
+
+class CellLabel(Widget):
+    """A table cell: one line of text drawn from the shared TextureCache, centred and clipped to the cell.
+
+    Unlike a Label it renders nothing itself and never re-lays its text out
+    when resized; it only moves or clips the rectangle it draws.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.text = None
+        self.texture = None
+        with self.canvas:
+            self.tint = Color(*DEFAULT_COLOR)
+            self.rect = Rectangle(size=(0, 0))
+        self.bind(pos=self.place, size=self.place)
+
+    def show(self, text, color=DEFAULT_COLOR):
+        if text != self.text:
+            self.text = text
+            self.texture = CELL_TEXTURES.get(text) if text else None
+            self.place()
+        self.tint.rgba = color
+
+    def place(self, *args):
+        texture = self.texture
+        if texture is None:
+            self.rect.size = (0, 0)
+            return
+        width, height = texture.size
+        room = max(int(self.width) - 2 * CELL_PADDING, 0)
+        if width > room:
+            texture, width = texture.get_region(0, 0, room, height), room
+        self.rect.texture = texture
+        self.rect.size = (width, height)
+        self.rect.pos = (int(self.center_x - width / 2), int(self.center_y - height / 2))
+
+
+class TableRow(RecycleDataViewBehavior, BoxLayout):
+    """A recycled table row: one CellLabel per cell plus the Close, Edit and Delete buttons.
+
+    Only enough rows to fill the viewport are ever created; RecycleView rebinds
+    them to different entries of the table data while scrolling.
+    """
+    num_cells = 0
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation="horizontal", spacing=5, **kwargs)
+        self.table = None
+        self.trade_id = None
+
+        self.labels = []
+        for _ in range(self.num_cells):
+            label = CellLabel()
+            self.add_widget(label)
+            self.labels.append(label)
+
+        # The action buttons share the last column
+        actions = BoxLayout(orientation="horizontal", spacing=2)
+        close_btn = Button(text="Close", size_hint_y=None, height=ROW_HEIGHT)
+        close_btn.bind(on_press=lambda instance: self.table.open_close_position_popup(self.trade_id))
+        actions.add_widget(close_btn)
+        edit_btn = Button(text="Edit", size_hint_y=None, height=ROW_HEIGHT)
+        edit_btn.bind(on_press=lambda instance: self.table.open_edit_popup(self.trade_id))
+        actions.add_widget(edit_btn)
+        delete_btn = Button(text="Delete", size_hint_y=None, height=ROW_HEIGHT)
+        delete_btn.bind(on_press=lambda instance: self.table.open_delete_popup(self.trade_id))
+        actions.add_widget(delete_btn)
+        self.add_widget(actions)
+
+    def refresh_view_attrs(self, rv, index, data):
+        """Bind this view to the trade at `index` of the table data."""
+        self.table = rv.table
+        self.trade_id = data["trade_id"]
+        self.refresh_cells()
+
+    def refresh_cells(self):
+        """Render the bound trade from the table's store."""
+        trade = self.table.store.get(self.trade_id)
+
+        # Highlight P/L (Green = Gain, Red = Loss)
+        pl = self.table.row_pl(trade)
+        pl_color = DEFAULT_COLOR
+        if pl is not None:
+            if trade.is_open:
+                pl_color = UNREALIZED_GAIN_COLOR if pl > 0 else UNREALIZED_LOSS_COLOR
+            else:
+                pl_color = GAIN_COLOR if pl > 0 else LOSS_COLOR
+
+        pl_column = self.table.pl_column
+        for column, (label, text) in enumerate(zip(self.labels, self.table.row_cells(trade))):
+            label.show(text, pl_color if column == pl_column else DEFAULT_COLOR)
+
+class OptionRow(TableRow):
+    num_cells = 18
+
+class TradeRow(TableRow):
+    num_cells = 8
+
+class UniformRowOpts:
+    """Stand-in for a RecycleLayout's per-row view_opts list when every row is the same size.
+
+    A row's size and position follow from its index and the layout's
+    geometry, so they are worked out when the RecycleView asks for that row
+    instead of being stored per row and rewritten for every row whenever one
+    is added or removed.
+    """
+
+    def __init__(self, layout, count=0):
+        self.layout = layout
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        layout = self.layout
+        padding_left, padding_top, padding_right, padding_bottom = layout.padding
+        row_height = layout.default_size[1]
+        return {
+            'size': [layout.width - padding_left - padding_right, row_height],
+            'size_hint': list(layout.default_size_hint),
+            'size_hint_min': [None, None], 'size_hint_max': [None, None],
+            'pos': (layout.x + padding_left, layout.top - padding_top - row_height - index * (row_height + layout.spacing)),
+            'pos_hint': {}, 'viewclass': layout.viewclass,
+            'width_none': True, 'height_none': False
+        }
+
+
+class UniformRowLayout(RecycleBoxLayout):
+    """Vertical RecycleBoxLayout for rows that all share the default height.
+
+    RecycleBoxLayout reads per-row sizing keys from every data item, keeps a
+    dict of sizing options per row, runs every row through BoxLayout's generic
+    sizing and finds the row under the viewport with a linear scan. With a
+    fixed row height the options are computed per row on demand (see
+    UniformRowOpts) and the rest is plain arithmetic, so adding or removing a
+    row costs the same at any table size.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.view_opts = UniformRowOpts(self)
+
+    def compute_sizes_from_data(self, data, flags):
+        if flags or len(data) != len(self.view_opts):
+            # Rows moved; rebind the visible views to their new entries
+            self.clear_layout()
+        self.view_opts = UniformRowOpts(self, len(data))
+
+    def compute_layout(self, data, flags):
+        RecycleLayout.compute_layout(self, data, flags)
+
+        changed = self._changed_views
+        if changed is None:
+            return
+
+        self.clear_layout()
+        padding_left, padding_top, padding_right, padding_bottom = self.padding
+        row_height = self.default_size[1]
+        n = len(data)
+        if not n:
+            self._rv_positions = None
+            self.minimum_size = padding_left + padding_right, padding_top + padding_bottom
+            return
+
+        self.minimum_size = (
+            padding_left + padding_right,
+            padding_top + padding_bottom + n * row_height + (n - 1) * self.spacing
+        )
+        self._rv_positions = n
+
+    def get_view_index_at(self, pos):
+        if not self._rv_positions:
+            return 0
+        step = self.default_size[1] + self.spacing
+        index = int((self.top - self.padding[1] - pos[1]) // step)
+        return min(max(index, 0), self._rv_positions - 1)
+
+
+class FilterBar(BoxLayout):
+    """Symbol, type, status and date-range filters for one table."""
+    ALL_TYPES = "All Types"
+    ALL_TRADES = "All Trades"
+
+    def __init__(self, table, **kwargs):
+        super().__init__(orientation="horizontal", size_hint_y=None, height=36, spacing=5, **kwargs)
+        self.table = table
+
+        self.symbol_input = TextInput(hint_text="Symbol", multiline=False, on_text_validate=self.apply)
+        self.add_widget(self.symbol_input)
+        self.type_spinner = None
+        if table.type_values:
+            self.type_spinner = Spinner(text=self.ALL_TYPES, values=(self.ALL_TYPES,) + table.type_values)
+            self.add_widget(self.type_spinner)
+        self.status_spinner = Spinner(text=self.ALL_TRADES, values=(self.ALL_TRADES, "Open", "Closed"))
+        self.add_widget(self.status_spinner)
+
+        self.date_names = {table.headers[table.sort_fields.index(field)]: field for field in table.date_fields}
+        self.date_spinner = Spinner(text=next(iter(self.date_names)), values=tuple(self.date_names))
+        self.add_widget(self.date_spinner)
+        self.from_input = TextInput(hint_text="From", multiline=False, on_text_validate=self.apply)
+        self.add_widget(self.from_input)
+        self.to_input = TextInput(hint_text="To", multiline=False, on_text_validate=self.apply)
+        self.add_widget(self.to_input)
+
+        self.add_widget(Button(text="Filter", on_press=self.apply))
+        self.add_widget(Button(text="Clear", on_press=self.clear))
+
+    def apply(self, instance):
+        filters = {}
+        if self.symbol_input.text.strip():
+            filters["symbol"] = self.symbol_input.text.strip()
+        if self.type_spinner is not None and self.type_spinner.text != self.ALL_TYPES:
+            filters["type"] = self.type_spinner.text
+        if self.status_spinner.text != self.ALL_TRADES:
+            filters["status"] = self.status_spinner.text.lower()
+        if self.from_input.text.strip() or self.to_input.text.strip():
+            filters["date_field"] = self.date_names[self.date_spinner.text]
+            filters["date_from"] = self.from_input.text.strip() or None
+            filters["date_to"] = self.to_input.text.strip() or None
+        self.table.set_filters(filters)
+
+    def clear(self, instance):
+        self.symbol_input.text = self.from_input.text = self.to_input.text = ""
+        if self.type_spinner is not None:
+            self.type_spinner.text = self.ALL_TYPES
+        self.status_spinner.text = self.ALL_TRADES
+        self.table.set_filters({})
+
+class TradeTableBase(BoxLayout):
+    """Header row over a RecycleView that only creates widgets for visible rows.
+
+    The rows shown are every trade in insertion order, or, once a filter or
+    sort is set, the result of querying the table's TradeIndex. If the SQLite
+    database exists the book lives there instead of in memory, and the
+    unfiltered view pages rows in as it is scrolled.
+    """
+    active_loads = 0
+    # Last autosave outcome, shown in the main window
+    save_status = StringProperty("")
+    headers = []
+    # Trade attribute each column sorts by ("pl" sorts by row_pl); None if it can't be sorted
+    sort_fields = []
+    date_fields = ()
+    type_values = ()
+    row_class = None
+    trade_class = None
+    pl_column = None
+    # Columns the Edit popup offers (the rest are derived)
+    edit_columns = ()
+    # Columns whose text is upper-cased when edited
+    upper_columns = (0,)
+
+    def __init__(self, files, database_file, **kwargs):
+        super().__init__(orientation="vertical", **kwargs)
+        # The BookFiles of this table's book in its account
+        self.files = files
+        self.store = None
+        if os.path.exists(database_file):
+            self.store = SqliteTradeStore(self.trade_class, database_file)
+            self.index = SqliteIndex(self.store)
+        elif os.path.exists(self.snapshot_file):
+            try:
+                self.store = MappedTradeStore(self.trade_class, self.snapshot_file)
+                self.index = MappedIndex(self.store)
+            except (OSError, ValueError) as e:
+                # The journal only holds what came after this snapshot, and the JSON one is older still:
+                # replaying one over the other would lose trades, and the next save would replace both.
+                # Keep them for recovery and start from the JSON snapshot alone.
+                kept = [set_aside(path) for path in (self.snapshot_file, self.journal_file) if os.path.exists(path)]
+                log.error(
+                    "Can't open %s (%s). Moved it and its journal to %s; loading the older %s instead.",
+                    self.snapshot_file, e, " and ".join(kept), self.save_file
+                )
+        if self.store is None:
+            self.store = TradeStore(self.trade_class)
+            self.index = TradeIndex(self.store, self.date_fields)
+        self.filters = {}
+        self.sort_column = None
+        self.sort_reverse = False
+        self.view_trigger = Clock.create_trigger(self.apply_view)
+        # Latest feed price per symbol, used for the unrealized P/L of open rows
+        self.marks = {}
+        self.loading = False
+        self.autosave = None
+        self.autosave_event = None
+        # Called with no arguments after each save that succeeds
+        self.on_saved = None
+        # The account's PLRollup, told about new marks
+        self.rollup = None
+        self.staged_ids = []
+        self.adjust_scroll_trigger = Clock.create_trigger(self.adjust_scroll)
+
+        self.add_widget(FilterBar(self))
+
+        header_row = GridLayout(cols=len(self.headers), spacing=5, size_hint_y=None, height=ROW_HEIGHT)
+        self.header_labels = []
+        for column, header in enumerate(self.headers):
+            # Sortable columns get a clickable header
+            sortable = column < len(self.sort_fields) and self.sort_fields[column] is not None
+            label = (Button if sortable else Label)(
+                text=header,
+                bold=True,
+                padding_x=10,
+                halign="center",
+                valign="middle"
+            )
+            label.bind(size=label.setter('text_size'))  # Ensure text stays within the label
+            if sortable:
+                label.bind(on_press=lambda instance, column=column: self.sort_by(column))
+            header_row.add_widget(label)
+            self.header_labels.append(label)
+        self.add_widget(header_row)
+
+        self.rv = RecycleView(do_scroll_x=False)
+        self.rv.table = self
+        layout = UniformRowLayout(
+            viewclass=self.row_class,
+            orientation="vertical",
+            default_size=(None, ROW_HEIGHT),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+            spacing=5
+        )
+        layout.bind(minimum_height=layout.setter('height'))
+        self.rv.add_widget(layout)
+        self.add_widget(self.rv)
+
+        if self.store.paged:
+            self.open_pages()
+        else:
+            self.load_trades()
+
+    def add_trade(self, trade):
+        """Store a new trade and add its row to the table."""
+        self.add_trades([trade])
+
+    @perf.timed("add_trades")
+    def add_trades(self, trades):
+        """Store many trades with a single table update."""
+        trade_ids = self.store.add_many(trades)
+        perf.count("trades added", len(trade_ids))
+        self.show_trades(trade_ids)
+
+    def stage_trades(self, trade_ids):
+        """Queue stored trades for display, showing them in batches that double the table.
+
+        Every row update costs a layout pass over the whole table, so bulk loads
+        and imports show rows this way: the first screen appears straight away
+        and the total layout work stays linear.
+        """
+        self.staged_ids.extend(trade_ids)
+        if len(self.staged_ids) >= max(len(self.rv.data), LOAD_CHUNK_SIZE):
+            self.flush_staged()
+
+    def flush_staged(self):
+        """Show any trades still waiting in stage_trades()."""
+        if self.staged_ids:
+            trade_ids, self.staged_ids = self.staged_ids, []
+            self.show_trades(trade_ids)
+
+    def show_trades(self, trade_ids):
+        """Append rows for stored trades in one data update, layout pass and scroll adjustment."""
+        if self.store.paged:
+            self.added_ids.extend(trade_ids)
+        if self.view_active:
+            # New trades may land anywhere in a filtered or sorted view; re-run the query instead
+            self.view_trigger()
+        else:
+            self.rv.data.extend({"trade_id": trade_id} for trade_id in trade_ids)
+
+        # Defer the scroll adjustment until after the rows have been laid out
+        self.adjust_scroll_trigger()
+        if not self.loading:
+            self.trades_changed()
+
+    def trades_changed(self):
+        """Hook run after trades are added or closed."""
+        if self.view_active:
+            self.view_trigger()
+
+    @property
+    def view_active(self):
+        return bool(self.filters) or self.sort_column is not None
+
+    def set_filters(self, filters):
+        self.filters = filters
+        self.apply_view()
+
+    def sort_by(self, column):
+        """Sort by a column; clicking the sorted column again reverses it, a third time restores the original order."""
+        if self.sort_column != column:
+            self.sort_column, self.sort_reverse = column, False
+        elif not self.sort_reverse:
+            self.sort_reverse = True
+        else:
+            self.sort_column = None
+
+        for i, label in enumerate(self.header_labels):
+            label.text = self.headers[i]
+            if i == self.sort_column:
+                label.text += " v" if self.sort_reverse else " ^"
+        self.apply_view()
+
+    @perf.timed("apply_view")
+    def apply_view(self, dt=None):
+        """Rebuild the row list from the current filters and sort."""
+        try:
+            trade_ids = self.index.query(**self.filters)
+        except ValueError as e:
+            log.warning("Invalid filter: %s", e)
+            return
+        if self.sort_column is not None:
+            trade_ids = self.sorted_ids(self.sort_fields[self.sort_column], trade_ids)
+        elif trade_ids is None:
+            trade_ids = self.paged_ids + self.added_ids if self.store.paged else list(self.store.trades)
+
+        self.staged_ids = []
+        self.rv.data = [{"trade_id": trade_id} for trade_id in trade_ids]
+        self.adjust_scroll_trigger()
+
+    def sorted_ids(self, field, trade_ids):
+        """Order trade ids by `field`, with missing values last in either direction."""
+        if field == "pl" and field in self.index.ordered_fields:
+            # A paged book sorts by P/L over its columns rather than decoding every trade
+            return self.index.ordered(field, trade_ids, self.sort_reverse, *self.pl_marks())
+        if field in self.index.ordered_fields:
+            return self.index.ordered(field, trade_ids, self.sort_reverse)
+
+        trades = self.store.trades
+        if trade_ids is None:
+            trade_ids = list(trades)
+        value_of = self.row_pl if field == "pl" else attrgetter(field)
+        values = [value_of(trades[trade_id]) for trade_id in trade_ids]
+        # Sorting positions by a plain value list is much cheaper than comparing (value, id) tuples
+        order = [i for i, value in enumerate(values) if value is not None]
+        order.sort(key=values.__getitem__, reverse=self.sort_reverse)
+        missing = [trade_id for trade_id, value in zip(trade_ids, values) if value is None]
+        return [trade_ids[i] for i in order] + missing
+
+    def row_cells(self, trade):
+        """Return the cell strings shown for a trade; open trades show unrealized P/L once marked."""
+        cells = trade.to_row()
+        if trade.is_open:
+            cells[self.pl_column] = format_float(self.row_pl(trade))
+        return cells
+
+    def row_pl(self, trade):
+        """Realized P/L for a closed trade, unrealized P/L at the current mark for an open one."""
+        if not trade.is_open:
+            return trade.pl
+        mark = self.mark_of(trade)
+        return None if mark is None else trade.unrealized_pl(mark)
+
+    def mark_of(self, trade):
+        """Current price of an open trade, or None if its symbol has no mark yet."""
+        return self.marks.get(trade.symbol)
+
+    def pl_marks(self):
+        """The marks mark_of() uses, as (symbol -> price, trade id -> price) with one of them None."""
+        return self.marks, None
+
+    def apply_marks(self, prices):
+        """Take a batch of new {symbol: price} marks and redraw the on-screen rows they move."""
+        self.marks.update(prices)
+        self.refresh_symbols(prices)
+
+    def refresh_symbols(self, symbols):
+        """Redraw the on-screen rows of trades on any of `symbols`."""
+        trades = self.store.trades
+        for view in self.rv.view_adapter.views.values():
+            if trades[view.trade_id].symbol in symbols:
+                view.refresh_cells()
+
+    @perf.timed("open_popup")
+    def open_edit_popup(self, trade_id):
+        if self.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = EditTradePopup(self, trade_id)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_delete_popup(self, trade_id):
+        if self.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = DeleteTradePopup(self, trade_id)
+        popup.open()
+
+    def edit_trade(self, trade_id, changes):
+        """Change fields of a trade and redraw just its row."""
+        with perf.span("edit_trade"):
+            self.store.update(trade_id, changes)
+            self.refresh_trade(trade_id)
+            self.trades_changed()
+        log.info("%s trade %s edited: %s", self.kind, trade_id, ", ".join(sorted(changes)))
+
+    def delete_trade(self, trade_id):
+        """Delete a trade and remove just its row."""
+        with perf.span("delete_trade"):
+            self.store.delete(trade_id)
+            self.remove_row(trade_id)
+            self.trades_changed()
+        log.info("%s trade %s deleted.", self.kind, trade_id)
+
+    def remove_row(self, trade_id):
+        """Take a deleted trade's row out of the table data.
+
+        Unless the table is sorted its rows are in id order (ids only grow, and
+        filters keep that order), so the row is found by bisection rather than
+        a scan and removed with a single 'removed' update. The views are
+        rebound straight away so none is left showing the deleted trade.
+        """
+        if self.store.paged:
+            for ids in (self.paged_ids, self.added_ids):
+                position = bisect_left(ids, trade_id)
+                if position < len(ids) and ids[position] == trade_id:
+                    del ids[position]
+        if self.sort_column is not None:
+            self.apply_view()
+        else:
+            data = self.rv.data
+            position = bisect_left(data, trade_id, key=itemgetter("trade_id"))
+            if position < len(data) and data[position]["trade_id"] == trade_id:
+                del data[position]
+        self.rv.refresh_views()
+
+    def adjust_scroll(self, dt):
+        """Adjust the scroll position to the top."""
+        self.rv.scroll_y = 1
+
+    def refresh_trade(self, trade_id):
+        """Redraw a trade's row if it is on screen."""
+        # Only the view bound to this trade needs refreshing, not the whole layout
+        for view in self.rv.view_adapter.views.values():
+            if view.trade_id == trade_id:
+                view.refresh_cells()
+
+    def refresh_visible(self):
+        """Redraw every on-screen row from the store."""
+        for view in self.rv.view_adapter.views.values():
+            view.refresh_cells()
+
+    def start_autosave(self, replayed):
+        """Start snapshotting the book in the background once it has loaded."""
+        self.autosave = Autosave(
+            self.store, self.snapshot_file, AUTOSAVE_DELAY, AUTOSAVE_MAX_DELAY,
+            on_saved=lambda result: Clock.schedule_once(lambda dt: self.saved(result))
+        )
+        if replayed:
+            # Fold the replayed journal into a fresh snapshot
+            self.autosave.mark_dirty()
+        self.autosave_event = Clock.schedule_interval(self.poll_autosave, AUTOSAVE_POLL_INTERVAL)
+
+    def poll_autosave(self, dt):
+        if self.autosave.poll():
+            self.save_status = f"{self.kind}: saving..."
+
+    def saved(self, result):
+        """Show the outcome of a background save."""
+        perf.record("save", result.seconds)
+        if result.error is not None:
+            self.save_status = f"{self.kind}: save failed ({result.error})"
+        else:
+            self.save_status = (
+                f"{self.kind}: {result.trades:,} trades saved at {time.strftime('%H:%M:%S')} "
+                f"in {result.seconds * 1000:.0f} ms"
+            )
+            if self.on_saved is not None:
+                self.on_saved()
+
+    def open_pages(self):
+        """Show the first page of a database-backed or mapped book; later pages load as the table scrolls."""
+        if isinstance(self.store, MappedTradeStore):
+            start = time.perf_counter()
+            self.start_autosave(self.store.open_journal(self.journal_file, sync_every=None))
+            perf.record("load", time.perf_counter() - start)
+        self.paged_ids = []
+        self.added_ids = []
+        # Trades added this session have ids from here up and are shown as they are added
+        self.page_stop = self.store.next_id
+        self.page_trigger = Clock.create_trigger(self.load_page)
+        self.rv.bind(scroll_y=self.check_page)
+        self.load_page()
+        self.trades_changed()
+        log.info("%s trades opened from %s (%d trades)", self.kind, self.store.path, len(self.store))
+
+    def check_page(self, rv, scroll_y):
+        if self.page_stop is not None and not self.view_active and scroll_y <= PAGE_AHEAD:
+            self.page_trigger()
+
+    def load_page(self, dt=None):
+        """Fetch the next page of ids and insert their rows ahead of any added this session."""
+        if self.page_stop is None:
+            return
+        after = self.paged_ids[-1] if self.paged_ids else 0
+        page = self.store.page_ids(after, self.page_stop, PAGE_SIZE)
+        if len(page) < PAGE_SIZE:
+            self.page_stop = None
+        if not page:
+            return
+        position = len(self.paged_ids)
+        self.paged_ids.extend(page)
+        if self.view_active:
+            return
+        rows = [{"trade_id": trade_id} for trade_id in page]
+        if position == len(self.rv.data):
+            self.rv.data.extend(rows)
+        else:
+            # A slice insert only reports itself as 'modified', which the layout can't resize from
+            self.rv.data = self.rv.data[:position] + rows + self.rv.data[position:]
+
+    def load_trades(self):
+        """Stream the last snapshot into the table across frames, then replay the journal."""
+        if not os.path.exists(self.save_file) and not os.path.exists(self.journal_file):
+            log.info("No save file found at %s", self.save_file)
+
+        # Loading allocates a record per trade; collecting mid-load would rescan them every frame
+        if not TradeTableBase.active_loads:
+            gc.disable()
+        TradeTableBase.active_loads += 1
+
+        self.loading = True
+        self.load_started = time.perf_counter()
+        # Journal fsyncs happen on the autosave thread, never inline on the UI thread
+        self.loader = stream_book(self.store, self.save_file, self.journal_file, LOAD_CHUNK_SIZE, sync_every=None)
+        self.load_chunk(0)
+        if self.loading:
+            Clock.schedule_interval(self.load_chunk, 0)
+
+    @perf.timed("load_chunk")
+    def load_chunk(self, dt):
+        """Load the next chunk of trades; runs once per frame until the book is in."""
+        try:
+            self.stage_trades(next(self.loader))
+        except StopIteration as done:
+            self.flush_staged()
+            self.loading = False
+            self.loader = None
+            TradeTableBase.active_loads -= 1
+            if not TradeTableBase.active_loads:
+                # The loaded book lives for the whole session, so keep later collections from scanning it
+                gc.freeze()
+                gc.enable()
+
+            # Journal close events may have changed rows that are already on screen
+            self.refresh_visible()
+            self.trades_changed()
+            seconds = time.perf_counter() - self.load_started
+            perf.record("load", seconds)
+            log.info(
+                "%s trades loaded from %s in %.2f s (%d trades, %d journal events replayed)",
+                self.kind, self.save_file, seconds, len(self.store), done.value
+            )
+            # Saving writes the binary snapshot, which is opened instead of the JSON from then on
+            self.start_autosave(done.value or (len(self.store) and not os.path.exists(self.snapshot_file)))
+            return False
+
+    @property
+    def save_file(self):
+        return self.files.save
+
+    @property
+    def snapshot_file(self):
+        return self.files.snapshot
+
+    @property
+    def journal_file(self):
+        return self.files.journal
+
+    def close_book(self):
+        """Wait for any save in progress, then close the journal or database, at shutdown or when the account closes.
+
+        Unsaved changes are already in the journal, so no snapshot is written here.
+        """
+        if self.autosave_event is not None:
+            self.autosave_event.cancel()
+        if self.autosave is not None:
+            self.autosave.stop()
+        self.store.close_storage()
+
+class OptionTable(TradeTableBase):
+    headers = [
+        "Underlier", "Date", "Expiry", "Type", "Open", "Strike",
+        "Underlier Price", "Premium", "Fee", "Quantity", "Close", "Close Premium", "P/L",
+        "IV", "Delta", "Gamma", "Theta", "Vega", "Action"
+    ]
+    sort_fields = [
+        "underlier", "date", "expiry", "type", "open_price", "strike",
+        "underlier_price", "premium", "fee", "quantity", "close_price", "close_premium", "pl"
+    ]
+    date_fields = ("date", "expiry")
+    type_values = ("CALL", "PUT")
+    row_class = OptionRow
+    trade_class = OptionTrade
+    pl_column = 12
+    edit_columns = tuple(range(12))
+    upper_columns = (0, 3)
+    kind = "Option"
+
+    def __init__(self, files, database_file, **kwargs):
+        self.greeks = GreeksBook()
+        self.greeks_trigger = Clock.create_trigger(self.refresh_greeks)
+        self.expiries = ExpiryIndex()
+        self.expiry_trigger = Clock.create_trigger(self.check_expiries)
+        super().__init__(files, database_file, **kwargs)
+        self.expiries.watch(self.store)
+
+        # Per-underlier Greek totals for the open book
+        self.totals_label = Label(size_hint_y=None, height=30, halign="left", valign="middle", shorten=True)
+        self.totals_label.bind(size=self.totals_label.setter('text_size'))
+        self.add_widget(self.totals_label)
+
+        # Positions about to expire, and expired ones left open
+        self.expiry_label = Label(size_hint_y=None, height=24, halign="left", valign="middle", shorten=True)
+        self.expiry_label.bind(size=self.expiry_label.setter('text_size'))
+        self.add_widget(self.expiry_label)
+        self.expiry_event = Clock.schedule_interval(self.check_expiries, EXPIRY_CHECK_INTERVAL)
+
+    def close_book(self):
+        for event in (self.expiry_event, self.expiry_trigger, self.greeks_trigger):
+            event.cancel()
+        super().close_book()
+
+    def trades_changed(self):
+        super().trades_changed()
+        self.greeks_trigger()
+        self.expiry_trigger()
+
+    @perf.timed("check_expiries")
+    def check_expiries(self, dt=None):
+        """Close the positions that expired worthless since the last pass and flag those about to expire."""
+        if self.loading:
+            return
+        today = date.today()
+        expired = self.expiries.expire(today, self.spot_of)
+        for trade_id, worthless, held, priced, stale in expired:
+            held_text = "" if held is None else f" after {held} days"
+            if worthless:
+                self.refresh_trade(trade_id)
+                log.info("Option trade %s expired worthless%s.", trade_id, held_text)
+            elif priced:
+                log.warning("Option trade %s expired in the money%s; close it with its exercise price.", trade_id, held_text)
+            elif stale:
+                log.warning(
+                    "Option trade %s expired%s more than %d day ago, too long for today's price to say where it "
+                    "expired; it stays open until you close it.", trade_id, held_text, EXPIRY_MARK_DAYS
+                )
+            else:
+                log.warning(
+                    "Option trade %s expired%s with no price for its underlier; it stays open until the feed marks it "
+                    "or you close it.", trade_id, held_text
+                )
+        if any(expiry.worthless for expiry in expired):
+            self.trades_changed()
+
+        expiring = self.expiries.expiring(today)
+        text = f"Expiring within {EXPIRY_WARNING_DAYS} days: " + (", ".join(
+            f"{date.fromordinal(ordinal).isoformat()} ({len(trades)})" for ordinal, trades in expiring
+        ) or "none")
+        unpriced, stale = len(self.expiries.unpriced), len(self.expiries.stale)
+        in_the_money = len(self.expiries.unresolved) - unpriced - stale
+        if in_the_money:
+            text += f"  |  {in_the_money} expired in the money, still open"
+        if unpriced:
+            text += f"  |  {unpriced} expired with no price, still open"
+        if stale:
+            text += f"  |  {stale} expired unjudged, close by hand"
+        self.expiry_label.text = text
+
+    def spot_of(self, trade):
+        """Underlier price an expired position is judged by: its feed mark, or None until it has one."""
+        return self.marks.get(trade.underlier)
+
+    @perf.timed("refresh_greeks")
+    def refresh_greeks(self, dt=None):
+        """Reprice every open position in one batch and redraw the Greek columns."""
+        # A mapped book is read straight from its columns; the others are walked for their open trades
+        mapped = isinstance(self.store, MappedTradeStore)
+        self.greeks.load(self.store if mapped else self.store.open_trades(), date.today())
+        for underlier, price in self.marks.items():
+            self.greeks.set_spot(underlier, price)
+        self.greeks.compute()
+        self.mark_rollup(self.greeks.ids_on(self.marks))
+        self.show_totals()
+        self.refresh_visible()
+
+    def show_totals(self):
+        totals = self.greeks.totals()
+        self.totals_label.text = "  |  ".join(
+            f"{underlier}  Δ {delta:,.1f}  Γ {gamma:,.2f}  Θ {theta:,.2f}  V {vega:,.2f}"
+            for underlier, (delta, gamma, theta, vega) in sorted(totals.items())
+        )
+
+    def apply_marks(self, prices):
+        """Move the underliers to their new prices and reprice only their contracts."""
+        self.marks.update(prices)
+        for underlier, price in prices.items():
+            self.greeks.set_spot(underlier, price)
+        repriced = self.greeks.reprice(prices)
+        if repriced:
+            self.mark_rollup(repriced)
+            self.show_totals()
+        if self.expiries.unpriced:
+            self.expiry_trigger()
+        self.refresh_symbols(prices)
+
+    def mark_rollup(self, trade_ids):
+        """Pass the model values of repriced contracts on to the P/L rollups."""
+        if self.rollup is not None and trade_ids:
+            trades = self.store.trades
+            self.rollup.mark_options((trades[trade_id], self.greeks.value(trade_id)) for trade_id in trade_ids)
+
+    def mark_of(self, trade):
+        # An option is marked at its model value, once its underlier has a feed price
+        if trade.underlier not in self.marks:
+            return None
+        return self.greeks.value(trade.id)
+
+    def pl_marks(self):
+        values = ((trade_id, self.greeks.value(trade_id)) for trade_id in self.greeks.ids_on(self.marks))
+        return None, {trade_id: value for trade_id, value in values if value is not None}
+
+    def row_cells(self, trade):
+        cells = super().row_cells(trade)
+        greeks = self.greeks.row(trade.id)
+        if greeks is None or greeks[0] != greeks[0]:  # not priced, or IV didn't solve (NaN)
+            return cells + [MISSING] * 5
+        iv, delta, gamma, theta, vega = greeks
+        return cells + [f"{iv:.1%}", f"{delta:.3f}", f"{gamma:.4f}", f"{theta:.2f}", f"{vega:.2f}"]
+
+    @perf.timed("open_popup")
+    def open_close_position_popup(self, trade_id):
+        """Open the Close Option Position popup."""
+        if self.loading:
+            log.warning("Trades are still loading.")
+            return
+
+        popup = CloseOptionPositionPopup(self, trade_id)
+        popup.open()
+
+    def close_position(self, trade_id, close, close_prem):
+        """Close position, update sell details, and compute P/L."""
+        try:
+            with perf.span("close_position"):
+                self.store.close(trade_id, close, close_prem)
+                self.refresh_trade(trade_id)
+                self.trades_changed()
+            perf.count("trades closed")
+
+            log.info("Option trade %s closed.", trade_id)
+        except Exception as e:
+            log.error("Error closing option position %s: %s", trade_id, e)
+
+class TradeTable(TradeTableBase):
+    headers = ["Ticker", "Buy Date", "Buy Price", "Num Shares", "Notional", "Sell Date", "Sell Price", "P/L", "Action"]
+    sort_fields = ["ticker", "buy_date", "buy_price", "num_shares", "notional", "sell_date", "sell_price", "pl"]
+    date_fields = ("buy_date", "sell_date")
+    row_class = TradeRow
+    trade_class = EquityTrade
+    pl_column = 7
+    edit_columns = (0, 1, 2, 3, 5, 6)
+    kind = "Equity"
+
+    def __init__(self, files, database_file, **kwargs):
+        super().__init__(files, database_file, **kwargs)
+        self.lots = LotBook(self.store, self.index)
+
+    def apply_marks(self, prices):
+        super().apply_marks(prices)
+        if self.rollup is not None:
+            self.rollup.mark_equities(prices)
+
+    @perf.timed("open_popup")
+    def open_close_position_popup(self, trade_id):
+        """Open the Close Position popup."""
+        if self.loading:
+            log.warning("Trades are still loading.")
+            return
+
+        if self.store.get(trade_id).buy_price is None:
+            log.warning("Invalid Operation: Cannot sell before buying.")
+            return
+
+        popup = ClosePositionPopup(self, trade_id)
+        popup.open()
+
+    def close_position(self, trade_id, sell_date, sell_price, shares=None):
+        """Close position, update sell details, and compute P/L; fewer `shares` than the lot sells part of it.
+
+        Returns whether the shares were sold.
+        """
+        trade = self.store.get(trade_id)
+        if shares is not None and shares != trade.num_shares:
+            return self.sell_shares(trade.ticker, shares, sell_date, sell_price, "specific", [trade_id]) is not None
+        try:
+            with perf.span("close_position"):
+                self.store.close(trade_id, sell_date, sell_price)
+                self.refresh_trade(trade_id)
+                self.trades_changed()
+            perf.count("trades closed")
+
+            log.info("Equity trade %s closed.", trade_id)
+        except Exception as e:
+            log.error("Error closing equity position %s: %s", trade_id, e)
+            return False
+        return True
+
+    def sell_shares(self, ticker, shares, sell_date, sell_price, method="fifo", lot_ids=None):
+        """Sell shares of a ticker from its open lots (see lots.py); returns the Sale, or None if it can't be filled."""
+        try:
+            with perf.span("sell_shares"):
+                sale = self.lots.sell(ticker, shares, sell_date, sell_price, method, lot_ids)
+                for lot_id in sale.changed_ids:
+                    self.refresh_trade(lot_id)
+                # The sold parts of split lots are new closed rows
+                self.show_trades(sale.added_ids)
+        except ValueError as e:
+            log.warning("Can't sell %s %s: %s", shares, ticker, e)
+            return None
+        perf.count("trades closed", len(sale.changed_ids))
+        log.info(
+            "Sold %s %s from %d lots (%s): P/L %s", shares, ticker, len(sale.matches), method.upper(),
+            format_pl(sale.proceeds - sale.cost)
+        )
+        if sale.wash_disallowed:
+            log.warning("Wash sale: %s of the loss on %s is disallowed.", format_pl(sale.wash_disallowed), ticker)
+        return sale
+
+
+class AddTradePopup(Popup):
+    def __init__(self, trade_table, **kwargs):
+        super().__init__(title="Add Trade", size_hint=(0.7, 0.7), **kwargs)
+        self.trade_table = trade_table
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        fields = ["Ticker", "Buy Date", "Buy Price", "Num Shares"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Confirm", on_press=self.confirm_trade)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_trade(self, instance):
+        """Validate input, calculate Notional, and add trade to the table."""
+        try:
+            buy_date = normalize_date(self.inputs["Buy Date"].text)
+        except ValueError:
+            log.warning("Buy Date must look like YYYY-MM-DD.")
+            return
+
+        try:
+            ticker = self.inputs["Ticker"].text.strip().upper()
+            buy_price = float(self.inputs["Buy Price"].text)
+            num_shares = int(self.inputs["Num Shares"].text)
+
+            trade = EquityTrade(ticker, buy_date, buy_price, num_shares)
+            self.trade_table.add_trade(trade)
+            self.dismiss()
+
+        except ValueError:
+            log.warning("Invalid Input: Ensure numeric fields contain valid numbers.")
+
+class SellSharesPopup(Popup):
+    """Sell shares of a ticker across its open lots, FIFO, LIFO or from specific lot ids."""
+    METHODS = {"FIFO": "fifo", "LIFO": "lifo", "Specific Lots": "specific"}
+
+    def __init__(self, trade_table, **kwargs):
+        super().__init__(title="Sell Shares", size_hint=(0.7, 0.7), **kwargs)
+        self.trade_table = trade_table
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        fields = ["Ticker", "Shares", "Sell Date", "Sell Price", "Lot IDs"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+        self.inputs["Lot IDs"].hint_text = "for Specific Lots: ids separated by commas, sold in that order"
+
+        box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+        box.add_widget(Label(text="Method:", size_hint_x=0.4))
+        self.method_spinner = Spinner(text="FIFO", values=tuple(self.METHODS))
+        box.add_widget(self.method_spinner)
+        layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Sell", on_press=self.confirm_sell)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_sell(self, instance):
+        ticker = self.inputs["Ticker"].text.strip().upper()
+        if not ticker:
+            log.warning("Ticker cannot be empty.")
+            return
+        try:
+            sell_date = normalize_date(self.inputs["Sell Date"].text)
+        except ValueError:
+            log.warning("Sell Date must look like YYYY-MM-DD.")
+            return
+        if sell_date is None:
+            log.warning("Sell Date cannot be empty.")
+            return
+        try:
+            shares = int(self.inputs["Shares"].text)
+            sell_price = float(self.inputs["Sell Price"].text)
+            lot_ids = [int(text) for text in self.inputs["Lot IDs"].text.replace(",", " ").split()]
+        except ValueError:
+            log.warning("Invalid Input: Ensure numeric fields contain valid numbers.")
+            return
+        if shares <= 0 or sell_price <= 0:
+            log.warning("Shares and Sell Price must be greater than 0.")
+            return
+
+        method = self.METHODS[self.method_spinner.text]
+        if method == "specific" and not lot_ids:
+            log.warning("Specific Lots needs the ids of the lots to sell.")
+            return
+        if self.trade_table.sell_shares(ticker, shares, sell_date, sell_price, method, lot_ids) is not None:
+            self.dismiss()
+
+
+class AddOptionTradePopup(Popup):
+    def __init__(self, otrade_table, **kwargs):
+        super().__init__(title="Add Option Trade", size_hint=(0.7, 0.7), **kwargs)
+        self.otrade_table = otrade_table
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        fields = ["Underlier", "Date", "Expiry", "Type", "Open Price", "Strike Price", "Underlier Price", "Premium", "Fee", "Quantity"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Confirm", on_press=self.confirm_trade)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_trade(self, instance):
+        """Validate input, calculate Notional, and add trade to the options table."""
+        try:
+            date = normalize_date(self.inputs["Date"].text)
+            expiry = normalize_date(self.inputs["Expiry"].text)
+        except ValueError:
+            log.warning("Date and Expiry must look like YYYY-MM-DD.")
+            return
+
+        try:
+            underlier = self.inputs["Underlier"].text.strip().upper()
+            type_ = self.inputs["Type"].text.strip().upper()
+            open_price = float(self.inputs["Open Price"].text)
+            strike_price = float(self.inputs["Strike Price"].text)
+            underlier_price = float(self.inputs["Underlier Price"].text)
+            premium = float(self.inputs["Premium"].text)
+            fee = float(self.inputs["Fee"].text)
+            quantity = int(self.inputs["Quantity"].text)
+
+            trade = OptionTrade(
+                underlier, date, expiry, type_, open_price, strike_price,
+                underlier_price, premium, fee, quantity
+            )
+            self.otrade_table.add_trade(trade)
+            self.dismiss()
+
+        except ValueError:
+            log.warning("Invalid Input: Ensure numeric fields contain valid numbers.")
+
+
+class ImportStatementPopup(Popup):
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="Import Broker Statement", size_hint=(0.7, 0.4), **kwargs)
+        self.main_window = main_window
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+        box.add_widget(Label(text="CSV File:", size_hint_x=0.4))
+        self.path_input = TextInput(multiline=False)
+        box.add_widget(self.path_input)
+        layout.add_widget(box)
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Import", on_press=self.confirm_import)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_import(self, instance):
+        """Check the file exists and start the import."""
+        path = os.path.expanduser(self.path_input.text.strip())
+        if not os.path.isfile(path):
+            log.warning("No file found at %s", path)
+            return
+
+        self.main_window.start_import(path)
+        self.dismiss()
+
+
+class PriceFeedPopup(Popup):
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="Start Price Feed", size_hint=(0.7, 0.5), **kwargs)
+        self.main_window = main_window
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        # Input Fields
+        self.inputs = {}
+        fields = ["Source (file or host:port)", "Replay Ticks/Second"]
+        for field in fields:
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            label = Label(text=f"{field}:", size_hint_x=0.4)
+            text_input = TextInput(multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(label)
+            box.add_widget(text_input)
+            layout.add_widget(box)
+        self.inputs["Replay Ticks/Second"].text = "100"
+
+        # Buttons
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        confirm_button = Button(text="Start", on_press=self.confirm_feed)
+        cancel_button = Button(text="Cancel", on_press=self.dismiss)
+        button_layout.add_widget(confirm_button)
+        button_layout.add_widget(cancel_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_feed(self, instance):
+        """Validate input and start the feed."""
+        spec = self.inputs["Source (file or host:port)"].text.strip()
+        if not spec:
+            log.warning("Source cannot be empty.")
+            return
+        try:
+            rate = float(self.inputs["Replay Ticks/Second"].text)
+        except ValueError:
+            log.warning("Replay Ticks/Second must be a valid number.")
+            return
+        if rate <= 0:
+            log.warning("Replay Ticks/Second must be greater than 0.")
+            return
+
+        self.main_window.start_feed([open_source(os.path.expanduser(spec), rate)])
+        self.dismiss()
+
+
+class PayoffChart(Widget):
+    """Curves against a range of prices or P/L values, drawn into a cached texture.
+
+    The curves are drawn into an Fbo only when they or the chart's size
+    change; every other frame just shows its texture. The price cursor is a
+    separate line on top, so moving it never redraws the curves.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prices = None
+        self.curves = []
+        self.y_range = (-1.0, 1.0)
+        self.cursor_price = None
+        self.fbo = None
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            self.image = Rectangle(pos=self.pos, size=self.size)
+        with self.canvas.after:
+            Color(1, 1, 0, 1)
+            self.cursor = Line(points=[], width=1)
+        self.redraw_trigger = Clock.create_trigger(self.redraw)
+        self.bind(size=self.redraw_trigger, pos=self.place)
+
+    def set_curves(self, prices, curves, y_range):
+        """Show `curves`, a list of (color, values at each of `prices`), with `y_range` as the P/L axis."""
+        self.prices, self.curves, self.y_range = prices, curves, y_range
+        self.redraw()
+
+    def set_cursor(self, price):
+        self.cursor_price = price
+        self.place()
+
+    def x_of(self, prices, width):
+        low, high = self.prices[0], self.prices[-1]
+        return (np.asarray(prices) - low) / (high - low) * width
+
+    def y_of(self, values, height):
+        low, high = self.y_range
+        return (np.asarray(values) - low) / (high - low) * height
+
+    @perf.timed("chart_redraw")
+    def redraw(self, dt=None):
+        width, height = int(self.width), int(self.height)
+        if width < 2 or height < 2:
+            return
+        if self.fbo is None or tuple(self.fbo.size) != (width, height):
+            self.fbo = Fbo(size=(width, height))
+        self.fbo.clear()
+        with self.fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            if self.prices is not None:
+                Color(0.5, 0.5, 0.5, 1)
+                zero = float(self.y_of(0.0, height))
+                Line(points=[0, zero, width, zero])
+                xs = self.x_of(self.prices, width)
+                for color, values in self.curves:
+                    Color(*color)
+                    Line(points=np.column_stack((xs, self.y_of(values, height))).ravel().tolist(), width=1.2)
+        self.fbo.draw()
+        self.image.texture = self.fbo.texture
+        self.place()
+
+    def place(self, *args):
+        self.image.pos = self.pos
+        self.image.size = self.size
+        if self.prices is None or self.cursor_price is None:
+            self.cursor.points = []
+            return
+        x = self.x + float(self.x_of(self.cursor_price, self.width))
+        self.cursor.points = [x, self.y, x, self.top]
+
+
+class PayoffPopup(Popup):
+    """Payoff at expiry and value curves over time for the open contracts on one underlier.
+
+    The scenario grid is computed on a background thread when the underlier
+    changes; the sliders only pick from it and move the cursor.
+    """
+
+    def __init__(self, otrade_table, **kwargs):
+        super().__init__(title="Payoff Diagram", size_hint=(0.9, 0.9), **kwargs)
+        self.otrade_table = otrade_table
+        self.grid = None
+        self.generation = 0
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        top = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=10)
+        top.add_widget(Label(text="Underlier:", size_hint_x=0.15))
+        underliers = sorted(otrade_table.greeks.underliers)
+        self.underlier_spinner = Spinner(text=underliers[0], values=underliers, size_hint_x=0.25)
+        self.underlier_spinner.bind(text=self.compute)
+        top.add_widget(self.underlier_spinner)
+        self.status_label = Label(halign="left", valign="middle", shorten=True)
+        self.status_label.bind(size=self.status_label.setter('text_size'))
+        top.add_widget(self.status_label)
+        layout.add_widget(top)
+
+        self.chart = PayoffChart()
+        layout.add_widget(self.chart)
+
+        self.readout = Label(size_hint_y=None, height=30)
+        layout.add_widget(self.readout)
+
+        self.price_slider = Slider(min=0, max=1, value=0.5)
+        self.price_slider.bind(value=self.move_cursor)
+        self.days_slider = Slider(min=0, max=SCENARIO_DATES - 1, step=1, value=0)
+        self.days_slider.bind(value=self.draw_curves)
+        for text, slider in (("Underlier Price", self.price_slider), ("Days Ahead", self.days_slider)):
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            box.add_widget(Label(text=f"{text}:", size_hint_x=0.2))
+            box.add_widget(slider)
+            layout.add_widget(box)
+
+        close_button = Button(text="Close", size_hint_y=None, height=50, on_press=self.dismiss)
+        layout.add_widget(close_button)
+
+        self.content = layout
+        self.compute()
+
+    def compute(self, *args):
+        """Start computing the scenario grid for the selected underlier."""
+        greeks = self.otrade_table.greeks
+        underlier = self.underlier_spinner.text
+        legs = greeks.legs(underlier)
+        if legs is None:
+            self.status_label.text = f"No priced open contracts on {underlier}."
+            return
+        center = greeks.spot_of(underlier)
+        prices = np.linspace(center * (1 - SCENARIO_RANGE), center * (1 + SCENARIO_RANGE), SCENARIO_PRICES)
+        days = np.linspace(0, max(1.0, float(legs.years.max()) * 365.0), SCENARIO_DATES)
+        self.generation += 1
+        self.status_label.text = f"Computing {len(legs.strike)} contracts..."
+        threading.Thread(
+            target=self.run_grid, args=(self.generation, underlier, center, legs, prices, days),
+            name="scenario-grid", daemon=True
+        ).start()
+
+    def run_grid(self, generation, underlier, center, legs, prices, days):
+        """Worker thread: evaluate the grid and hand it to the UI thread."""
+        start = time.perf_counter()
+        expiry_pl, value_pl = scenario_grid(legs, prices, days)
+        seconds = time.perf_counter() - start
+        Clock.schedule_once(lambda dt: self.show_grid(
+            generation, underlier, center, len(legs.strike), prices, days, expiry_pl, value_pl, seconds
+        ))
+
+    def show_grid(self, generation, underlier, center, contracts, prices, days, expiry_pl, value_pl, seconds):
+        if generation != self.generation:
+            return  # a newer selection is on its way
+        perf.record("scenario_grid", seconds)
+        finite = np.concatenate((expiry_pl, value_pl.ravel()))
+        finite = finite[np.isfinite(finite)]
+        low, high = (float(finite.min()), float(finite.max())) if finite.size else (-1.0, 1.0)
+        pad = max(high - low, 1.0) * 0.05
+        self.grid = (prices, days, expiry_pl, value_pl, (low - pad, high + pad))
+        self.status_label.text = (
+            f"{underlier}: {contracts} contracts, P/L {low:,.0f} to {high:,.0f}, "
+            f"{prices.size} x {days.size} grid in {seconds * 1000:.0f} ms"
+        )
+        self.price_slider.unbind(value=self.move_cursor)
+        self.price_slider.min, self.price_slider.max = float(prices[0]), float(prices[-1])
+        self.price_slider.value = center
+        self.price_slider.bind(value=self.move_cursor)
+        self.draw_curves()
+
+    def draw_curves(self, *args):
+        """Redraw the chart for the selected date: the payoff at expiry and the value that many days out."""
+        if self.grid is None:
+            return
+        prices, days, expiry_pl, value_pl, y_range = self.grid
+        day = int(self.days_slider.value)
+        self.chart.set_curves(prices, [(EXPIRY_COLOR, expiry_pl), (VALUE_COLOR, value_pl[day])], y_range)
+        self.move_cursor()
+
+    def move_cursor(self, *args):
+        if self.grid is None:
+            return
+        prices, days, expiry_pl, value_pl, y_range = self.grid
+        price = self.price_slider.value
+        day = int(self.days_slider.value)
+        self.chart.set_cursor(price)
+        self.readout.text = (
+            f"Underlier at {price:,.2f}:  P/L in {days[day]:.0f} days {np.interp(price, prices, value_pl[day]):,.2f}"
+            f"   at expiry {np.interp(price, prices, expiry_pl):,.2f}"
+        )
+
+
+class RiskPopup(Popup):
+    """Monte Carlo VaR and expected shortfall of the open positions in both books.
+
+    The positions are gathered on the UI thread when a run starts; the
+    simulation itself runs on the risk module's worker processes, driven
+    from a background thread, and can be cancelled at any point.
+    """
+
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="Portfolio Risk", size_hint=(0.9, 0.9), **kwargs)
+        self.main_window = main_window
+        self.cancelled = threading.Event()
+        self.thread = None
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        self.inputs = {}
+        defaults = {
+            "Paths": str(risk.DEFAULT_PATHS),
+            "Horizon (days)": str(risk.DEFAULT_HORIZON_DAYS),
+            "Correlation": str(risk.DEFAULT_CORRELATION),
+        }
+        fields = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=10)
+        for field, default in defaults.items():
+            fields.add_widget(Label(text=f"{field}:"))
+            text_input = TextInput(text=default, multiline=False)
+            self.inputs[field] = text_input
+            fields.add_widget(text_input)
+        layout.add_widget(fields)
+
+        self.progress = ProgressBar(max=1, size_hint_y=None, height=20)
+        layout.add_widget(self.progress)
+
+        self.result_label = Label(size_hint_y=None, height=100, halign="left", valign="top")
+        self.result_label.bind(size=self.result_label.setter('text_size'))
+        layout.add_widget(self.result_label)
+
+        # Distribution of simulated P/L, with the cursor at the 99% VaR
+        self.chart = PayoffChart()
+        layout.add_widget(self.chart)
+
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        self.run_button = Button(text="Run", on_press=self.toggle_run)
+        close_button = Button(text="Close", on_press=self.dismiss)
+        button_layout.add_widget(self.run_button)
+        button_layout.add_widget(close_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def toggle_run(self, instance):
+        if self.thread is not None:
+            self.cancelled.set()
+            self.run_button.text = "Cancelling..."
+            return
+        try:
+            paths = int(self.inputs["Paths"].text)
+            horizon = float(self.inputs["Horizon (days)"].text)
+            correlation = float(self.inputs["Correlation"].text)
+        except ValueError:
+            log.warning("Paths, horizon and correlation must be valid numbers.")
+            return
+        if paths <= 0 or horizon <= 0 or not 0 <= correlation < 1:
+            log.warning("Paths and horizon must be greater than 0, and correlation from 0 up to 1.")
+            return
+
+        etable, otable = self.main_window.etable, self.main_window.otable
+        book = risk.RiskBook(etable.store.open_trades(), etable.marks, otable.greeks)
+        if book.empty:
+            self.result_label.text = "There are no open positions to simulate."
+            return
+        self.cancelled.clear()
+        self.progress.value = 0
+        self.result_label.text = f"Simulating {len(book)} underliers and {book.legs} option contracts..."
+        self.run_button.text = "Cancel"
+        self.thread = threading.Thread(
+            target=self.run_simulation, args=(book, paths, horizon, correlation), name="risk", daemon=True
+        )
+        self.thread.start()
+
+    def run_simulation(self, book, paths, horizon, correlation):
+        """Worker thread: run the simulation and hand the result to the UI thread."""
+        try:
+            result = risk.simulate(
+                book, paths, horizon, correlation, progress=self.report_progress, cancel=self.cancelled
+            )
+            error = None
+        except Exception as e:
+            log.exception("Risk simulation failed")
+            result, error = None, str(e)
+        Clock.schedule_once(lambda dt: self.show_result(result, error))
+
+    def report_progress(self, done, total):
+        Clock.schedule_once(lambda dt: setattr(self.progress, "value", done / total))
+
+    def show_result(self, result, error):
+        self.thread = None
+        self.run_button.text = "Run"
+        if error is not None:
+            self.result_label.text = f"Simulation failed: {error}"
+            return
+        if result is None:
+            self.progress.value = 0
+            self.result_label.text = "Cancelled."
+            return
+        perf.record("risk", result.seconds)
+        self.progress.value = 1
+        self.result_label.text = "\n".join(risk.describe(result))
+        counts, edges = result.histogram
+        centers = (edges[:-1] + edges[1:]) / 2
+        self.chart.set_curves(centers, [(HISTOGRAM_COLOR, counts)], (0.0, float(counts.max()) * 1.05))
+        self.chart.set_cursor(-result.var[max(risk.CONFIDENCES)])
+
+    def on_dismiss(self):
+        self.cancelled.set()
+
+
+class ExportPopup(Popup):
+    """Stream one or both books to a file, filtered, on a background thread.
+
+    What to export is fixed on the UI thread when the export starts (see
+    export.py); the files are then written a chunk at a time by a worker,
+    with progress shown here, and the export can be cancelled at any point.
+    """
+    FORMATS = {"CSV": "csv", "JSON Lines": "jsonl", "Columnar": "columnar"}
+    BOOKS = {"Both": ("equity", "option"), "Equities": ("equity",), "Options": ("option",)}
+    STATUSES = {"All": None, "Open": "open", "Closed": "closed"}
+    # The date a range applies to: opening date, or sell date for equities and expiry for options
+    DATE_FIELDS = {"Opened": 0, "Sold / Expiry": 1}
+
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="Export Trades", size_hint=(0.8, 0.8), **kwargs)
+        self.main_window = main_window
+        self.cancelled = threading.Event()
+        self.thread = None
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+
+        self.inputs = {}
+        for field, default in (("Path", os.path.join(EXPORT_DIR, "trades.csv")), ("Symbol", ""), ("From", ""), ("To", "")):
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            box.add_widget(Label(text=f"{field}:", size_hint_x=0.4))
+            text_input = TextInput(text=default, multiline=False)
+            self.inputs[field] = text_input
+            box.add_widget(text_input)
+            layout.add_widget(box)
+
+        self.spinners = {}
+        for field, choices in (
+            ("Format", self.FORMATS), ("Book", self.BOOKS), ("Status", self.STATUSES), ("Date", self.DATE_FIELDS)
+        ):
+            box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+            box.add_widget(Label(text=f"{field}:", size_hint_x=0.4))
+            spinner = Spinner(text=next(iter(choices)), values=tuple(choices))
+            self.spinners[field] = spinner
+            box.add_widget(spinner)
+            layout.add_widget(box)
+        self.spinners["Format"].bind(text=self.change_format)
+
+        self.progress = ProgressBar(max=1, size_hint_y=None, height=20)
+        layout.add_widget(self.progress)
+        self.result_label = Label(size_hint_y=None, height=60, halign="left", valign="top")
+        self.result_label.bind(size=self.result_label.setter('text_size'))
+        layout.add_widget(self.result_label)
+
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        self.export_button = Button(text="Export", on_press=self.toggle_export)
+        close_button = Button(text="Close", on_press=self.dismiss)
+        button_layout.add_widget(self.export_button)
+        button_layout.add_widget(close_button)
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def change_format(self, spinner, text):
+        """Swap the path's extension for the new format's."""
+        path = self.inputs["Path"]
+        root, ext = os.path.splitext(path.text)
+        if ext in FORMATS.values():
+            path.text = root + FORMATS[self.FORMATS[text]]
+
+    def toggle_export(self, instance):
+        if self.thread is not None:
+            self.cancelled.set()
+            self.export_button.text = "Cancelling..."
+            return
+        path = self.inputs["Path"].text.strip()
+        if not path:
+            log.warning("Path cannot be empty.")
+            return
+        try:
+            date_from = normalize_date(self.inputs["From"].text)
+            date_to = normalize_date(self.inputs["To"].text)
+        except ValueError:
+            log.warning("From and To must look like YYYY-MM-DD.")
+            return
+        books = self.BOOKS[self.spinners["Book"].text]
+        tables = {"equity": self.main_window.etable, "option": self.main_window.otable}
+        date_choice = self.DATE_FIELDS[self.spinners["Date"].text]
+        exports = []
+        for book in books:
+            table = tables[book]
+            trade_filter = TradeFilter(
+                self.inputs["Symbol"].text, self.STATUSES[self.spinners["Status"].text],
+                table.date_fields[date_choice], date_from, date_to,
+            )
+            book_file = book_path(path, book) if len(books) > 1 else path
+            exports.append(Export(table.store, book_file, self.FORMATS[self.spinners["Format"].text], trade_filter))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.cancelled.clear()
+        self.progress.value = 0
+        self.result_label.text = f"Exporting {sum(export.total for export in exports)} trades..."
+        self.export_button.text = "Cancel"
+        self.thread = threading.Thread(target=self.run_exports, args=(exports,), name="export", daemon=True)
+        self.thread.start()
+
+    def run_exports(self, exports):
+        """Worker thread: write each export in turn and hand the results to the UI thread."""
+        total = sum(export.total for export in exports) or 1
+        results, error, offset = [], None, 0
+        try:
+            for export in exports:
+                progress = lambda done, _, offset=offset: self.report_progress(offset + done, total)
+                result = export.run(progress=progress, cancel=self.cancelled)
+                if result is None:
+                    results = None
+                    break
+                results.append(result)
+                offset += export.total
+        except Exception as e:
+            log.exception("Export failed")
+            error = str(e)
+        Clock.schedule_once(lambda dt: self.show_result(results, error))
+
+    def report_progress(self, done, total):
+        Clock.schedule_once(lambda dt: setattr(self.progress, "value", done / total))
+
+    def show_result(self, results, error):
+        self.thread = None
+        self.export_button.text = "Export"
+        if error is not None:
+            self.result_label.text = f"Export failed: {error}"
+            return
+        if results is None:
+            self.progress.value = 0
+            self.result_label.text = "Cancelled."
+            return
+        perf.record("export", sum(result.seconds for result in results))
+        self.progress.value = 1
+        self.result_label.text = "\n".join(
+            f"Wrote {result.trades} of {result.scanned} trades to {result.path} in {result.seconds:.1f}s."
+            for result in results
+        )
+
+    def on_dismiss(self):
+        self.cancelled.set()
+
+
+class PerfOverlay(BoxLayout):
+    """Frame time percentiles, widget count, last saves and the slowest spans, refreshed twice a second."""
+
+    def __init__(self, main_window, **kwargs):
+        super().__init__(orientation="horizontal", size_hint_y=None, height=140, spacing=10, **kwargs)
+        self.main_window = main_window
+
+        self.stats_label = Label(font_name="RobotoMono-Regular", font_size=12, halign="left", valign="top")
+        self.stats_label.bind(size=self.stats_label.setter('text_size'))
+        self.add_widget(self.stats_label)
+
+        # Profile the next run of a chosen interaction to a .prof file
+        controls = BoxLayout(orientation="vertical", size_hint_x=0.25, spacing=5)
+        self.span_spinner = Spinner(text=PROFILED_SPANS[0], values=PROFILED_SPANS)
+        controls.add_widget(self.span_spinner)
+        controls.add_widget(Button(text="Profile Next", on_press=self.profile_next))
+        self.profile_label = Label(font_size=11, shorten=True)
+        controls.add_widget(self.profile_label)
+        self.add_widget(controls)
+
+        self.refresh_event = Clock.schedule_interval(self.refresh, OVERLAY_INTERVAL)
+        self.refresh()
+
+    def refresh(self, dt=None):
+        lines = []
+        frames = perf.percentiles("frame")
+        if frames is not None:
+            p50, p95, p99, worst = (value * 1000 for value in frames)
+            lines.append(f"frame  p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  max {worst:.1f} ms")
+        saves = []
+        for table in (self.main_window.etable, self.main_window.otable):
+            result = table.autosave.last_result if table.autosave is not None else None
+            saves.append(f"{table.kind} {result.seconds * 1000:.0f} ms" if result is not None else f"{table.kind} -")
+        lines.append(f"widgets {widget_count()}   last save: {', '.join(saves)}")
+        looked_up = CELL_TEXTURES.hits + CELL_TEXTURES.misses
+        if looked_up:
+            lines.append(
+                f"cell textures {len(CELL_TEXTURES)}   hit rate {CELL_TEXTURES.hits / looked_up:.1%} of {looked_up}"
+            )
+        lines += [line for line in perf.summary() if not line.startswith("frame:")][:5]
+        self.stats_label.text = "\n".join(lines)
+
+    def profile_next(self, instance):
+        path = perf.profile_next(self.span_spinner.text, PROFILE_DIR)
+        self.profile_label.text = f"next {self.span_spinner.text} -> {os.path.basename(path)}"
+
+    def close(self):
+        self.refresh_event.cancel()
+
+
+class SummaryPanel(BoxLayout):
+    """Portfolio P/L from the rollups: overall and per book, by underlier, by expiry and by month closed.
+
+    A redraw reads a few buckets and sorts the symbols, expiries and months,
+    so it costs the same however many trades the books hold.
+    """
+
+    def __init__(self, rollup, **kwargs):
+        super().__init__(orientation="horizontal", size_hint_y=None, height=SUMMARY_LINES * 16 + 10, spacing=10, **kwargs)
+        self.rollup = rollup
+        self.columns = []
+        for _ in range(4):
+            label = Label(font_name="RobotoMono-Regular", font_size=12, halign="left", valign="top")
+            label.bind(size=label.setter('text_size'))
+            self.add_widget(label)
+            self.columns.append(label)
+        self.refresh_trigger = Clock.create_trigger(self.refresh, SUMMARY_INTERVAL)
+
+    @perf.timed("summary")
+    def refresh(self, dt=None):
+        rollup = self.rollup
+        overall = [
+            f"Portfolio  {rollup.total.trades:,} trades, {rollup.total.open:,} open",
+            f"  realized   {format_pl(rollup.total.realized_pl)}",
+            f"  unrealized {format_pl(rollup.total.unrealized)}",
+        ]
+        for book, bucket in rollup.by_book.items():
+            overall.append(
+                f"{book.title():<7} R {format_pl(bucket.realized_pl)}  U {format_pl(bucket.unrealized)}"
+            )
+
+        lines = SUMMARY_LINES - 1
+        top = sorted(rollup.by_underlier.items(), key=lambda item: -abs(item[1].total_pl))[:lines]
+        underliers = ["By underlier (largest P/L)"] + [
+            f"{symbol:<6} R {format_pl(bucket.realized_pl):>12}  U {format_pl(bucket.unrealized):>10}"
+            for symbol, bucket in top
+        ]
+
+        # Soonest expiries that still have open contracts; past ones are ignored
+        today = date.today().toordinal()
+        upcoming = sorted(
+            (ordinal, expiry, bucket) for expiry, bucket in rollup.by_expiry.items()
+            if bucket.open and (ordinal := date_ordinal(expiry)) is not None and ordinal >= today
+        )[:lines]
+        expiries = ["Open by expiry"] + [
+            f"{expiry}  {bucket.open:>5} open  U {format_pl(bucket.unrealized):>10}"
+            for _, expiry, bucket in upcoming
+        ]
+
+        recent = sorted((month for month in rollup.by_month if month != UNDATED), reverse=True)[:lines]
+        months = ["Realized by month closed"] + [
+            f"{month}  {rollup.by_month[month].trades:>6} closed  {format_pl(rollup.by_month[month].realized_pl):>12}"
+            for month in recent
+        ]
+        for label, text in zip(self.columns, (overall, underliers, expiries, months)):
+            label.text = "\n".join(text)
+
+
+class NewAccountPopup(Popup):
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="New Account", size_hint=(0.6, 0.35), **kwargs)
+        self.main_window = main_window
+
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        box = BoxLayout(orientation="horizontal", size_hint_y=None, height=40)
+        box.add_widget(Label(text="Name:", size_hint_x=0.4))
+        self.name_input = TextInput(multiline=False)
+        box.add_widget(self.name_input)
+        layout.add_widget(box)
+
+        button_layout = BoxLayout(size_hint_y=None, height=50, spacing=20)
+        button_layout.add_widget(Button(text="Create", on_press=self.confirm_create))
+        button_layout.add_widget(Button(text="Cancel", on_press=self.dismiss))
+        layout.add_widget(button_layout)
+
+        self.content = layout
+
+    def confirm_create(self, instance):
+        if self.main_window.create_account(self.name_input.text):
+            self.dismiss()
+
+
+class AccountsPopup(Popup):
+    """Totals per account and across all of them.
+
+    Open accounts show their live rollups; the others show the totals
+    recorded the last time their books were saved, so no book is opened.
+    """
+
+    def __init__(self, main_window, **kwargs):
+        super().__init__(title="All Accounts", size_hint=(0.9, 0.7), **kwargs)
+        layout = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        label = Label(font_name="RobotoMono-Regular", font_size=13, halign="left", valign="top")
+        label.bind(size=label.setter('text_size'))
+        rollups = {name: account.rollup for name, account in main_window.open_accounts.items() if not account.loading}
+        label.text = "\n".join(describe(*main_window.accounts.summaries(rollups)))
+        layout.add_widget(label)
+        layout.add_widget(Button(text="Close", on_press=self.dismiss))
+        self.content = layout
+
+
+class Account:
+    """One account's two tables and their PLRollup, kept while the account is among the recently used."""
+
+    def __init__(self, name, files):
+        self.name = name
+        self.etable = TradeTable(files.equity, files.database, size_hint=(1, 0.9))
+        self.otable = OptionTable(files.option, files.database, size_hint=(1, 0.9))
+        # The rollup follows both books from here on, including the rest of their loading
+        self.rollup = PLRollup()
+        for table in self.tables:
+            self.rollup.watch(table.store)
+            table.rollup = self.rollup
+
+    @property
+    def tables(self):
+        return self.etable, self.otable
+
+    @property
+    def loading(self):
+        return any(table.loading for table in self.tables)
+
+    def close(self):
+        for table in self.tables:
+            table.close_book()
+
+
+class MainWindow(BoxLayout):
+    """The open account's tables under the account switcher and action buttons.
+
+    Only the current account is loaded on startup. Another account's books
+    are opened the first time it is selected, and the ACCOUNT_CACHE_SIZE
+    most recently used accounts stay open (autosaving in the background),
+    so switching back to one is instant; older ones are closed.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation="vertical", **kwargs)
+        self.feed = None
+        self.feed_event = None
+        # Latest feed price per symbol, applied to an account's tables when it is shown
+        self.marks = {}
+        self.import_thread = None
+        self.deduplicator = None
+        self.import_cancelled = threading.Event()
+        # Batches parsed but not yet inserted; caps how far the worker runs ahead of the UI
+        self.import_slots = threading.Semaphore(IMPORT_BATCHES_AHEAD)
+
+        default_files = AccountFiles(
+            BookFiles(EQUITY_SAVE_FILE, EQUITY_SNAPSHOT_FILE, EQUITY_JOURNAL_FILE),
+            BookFiles(OPTION_SAVE_FILE, OPTION_SNAPSHOT_FILE, OPTION_JOURNAL_FILE),
+            DATABASE_FILE,
+        )
+        self.accounts = AccountIndex(ACCOUNTS_FILE, default_files)
+        self.open_accounts = OrderedDict()
+        self.account = None
+        # Accounts saved since their totals were last written to the index, by name
+        self.saved_accounts = {}
+        self.record_trigger = Clock.create_trigger(self.record_saved_accounts, ACCOUNT_RECORD_DELAY)
+
+        account_row = BoxLayout(orientation="horizontal", size_hint_y=None, height=50, spacing=5)
+        account_row.add_widget(Label(text="Account:", size_hint_x=0.15))
+        self.account_spinner = Spinner(text=self.accounts.current, values=self.accounts.names(), size_hint_x=0.4)
+        self.account_spinner.bind(text=self.choose_account)
+        account_row.add_widget(self.account_spinner)
+        account_row.add_widget(Button(text="New Account", size_hint_x=0.3, on_press=self.open_new_account_popup))
+        account_row.add_widget(Button(text="All Accounts", size_hint_x=0.3, on_press=self.open_accounts_popup))
+        self.add_widget(account_row)
+
+        button_row = BoxLayout(orientation="horizontal", size_hint=(1, 0.1))
+        self.add_trade_button = Button(text="Add Equity Trade", on_press=self.open_add_etrade_popup)
+        button_row.add_widget(self.add_trade_button)
+        self.sell_button = Button(text="Sell Shares", size_hint_x=0.3, on_press=self.open_sell_popup)
+        button_row.add_widget(self.sell_button)
+        self.import_button = Button(text="Import Statement", size_hint_x=0.3, on_press=self.open_import_popup)
+        button_row.add_widget(self.import_button)
+        self.feed_button = Button(text="Start Price Feed", size_hint_x=0.3, on_press=self.toggle_feed)
+        button_row.add_widget(self.feed_button)
+        self.payoff_button = Button(text="Payoff Diagram", size_hint_x=0.3, on_press=self.open_payoff_popup)
+        button_row.add_widget(self.payoff_button)
+        self.risk_button = Button(text="Portfolio Risk", size_hint_x=0.3, on_press=self.open_risk_popup)
+        button_row.add_widget(self.risk_button)
+        self.export_button = Button(text="Export", size_hint_x=0.3, on_press=self.open_export_popup)
+        button_row.add_widget(self.export_button)
+        self.add_widget(button_row)
+
+        self.summary = SummaryPanel(None)
+        self.add_widget(self.summary)
+
+        # The current account's equity table, the Add Option Trade button and its option table
+        self.book_area = BoxLayout(orientation="vertical", size_hint=(1, 1.9))
+        self.add_otrade_button = Button(text="Add Option Trade", size_hint=(1, 0.1), on_press=self.open_add_otrade_popup)
+        self.add_widget(self.book_area)
+
+        # Autosave status for both books
+        self.save_label = Label(size_hint_y=None, height=24, halign="left", valign="middle", shorten=True)
+        self.save_label.bind(size=self.save_label.setter('text_size'))
+        self.add_widget(self.save_label)
+
+        self.switch_account(self.accounts.current)
+
+        # F12 toggles the performance overlay; timings are recorded while it is shown, or always with OPTIONS_PERF=1
+        self.overlay = None
+        self.frame_event = None
+        self.always_record = perf.enabled
+        self.set_recording(perf.enabled)
+        Window.bind(on_key_down=self.on_key_down)
+
+    def on_key_down(self, window, key, scancode, codepoint, modifiers):
+        if key == OVERLAY_KEY:
+            self.toggle_overlay()
+            return True
+        return False
+
+    def toggle_overlay(self):
+        if self.overlay is None:
+            self.set_recording(True)
+            self.overlay = PerfOverlay(self)
+            self.add_widget(self.overlay)
+        else:
+            self.overlay.close()
+            self.remove_widget(self.overlay)
+            self.overlay = None
+            self.set_recording(self.always_record)
+
+    def set_recording(self, on):
+        perf.enable(on)
+        if on and self.frame_event is None:
+            self.frame_event = Clock.schedule_interval(self.record_frame, 0)
+        elif not on and self.frame_event is not None:
+            self.frame_event.cancel()
+            self.frame_event = None
+
+    def record_frame(self, dt):
+        perf.record("frame", dt)
+
+    def show_save_status(self, instance=None, value=None):
+        self.save_label.text = "   |   ".join(
+            table.save_status for table in (self.etable, self.otable) if table.save_status
+        )
+
+    @property
+    def etable(self):
+        return self.account.etable
+
+    @property
+    def otable(self):
+        return self.account.otable
+
+    @property
+    def rollup(self):
+        return self.account.rollup
+
+    def choose_account(self, spinner, name):
+        if self.account is None or name == self.account.name:
+            return
+        if self.import_thread is not None:
+            log.warning("Wait for the import to finish before switching accounts.")
+            spinner.text = self.account.name
+            return
+        self.switch_account(name)
+
+    @perf.timed("switch_account")
+    def switch_account(self, name):
+        """Show account `name`, opening its books unless it is one of the recently used accounts."""
+        account = self.open_accounts.get(name)
+        if account is None:
+            account = self.open_accounts[name] = Account(name, self.accounts.files(name))
+            for table in account.tables:
+                table.bind(save_status=self.show_save_status)
+                # Completed saves refresh the totals the cross-account summary reads
+                table.on_saved = lambda account=account: self.account_saved(account)
+        self.open_accounts.move_to_end(name)
+        if self.account is not None:
+            self.account.rollup.on_change = None
+        self.account = account
+        account.rollup.on_change = self.summary.refresh_trigger
+        self.summary.rollup = account.rollup
+        self.summary.refresh()
+
+        self.book_area.clear_widgets()
+        for widget in (account.etable, self.add_otrade_button, account.otable):
+            self.book_area.add_widget(widget)
+        if self.marks:
+            for table in account.tables:
+                table.apply_marks(dict(self.marks))
+        self.accounts.select(name)
+        self.account_spinner.text = name
+        self.show_save_status()
+        self.close_old_accounts()
+
+    def close_old_accounts(self):
+        """Close the least recently used accounts beyond ACCOUNT_CACHE_SIZE, leaving any still loading."""
+        closed = False
+        for name in list(self.open_accounts)[:-1]:
+            if len(self.open_accounts) <= ACCOUNT_CACHE_SIZE:
+                break
+            account = self.open_accounts[name]
+            if account.loading:
+                continue
+            del self.open_accounts[name]
+            self.close_account(account)
+            closed = True
+            log.info("Closed account %s", name)
+        if closed and gc.isenabled() and gc.get_freeze_count():
+            # Loaded books are frozen out of the collector; collect the closed ones' cycles and refreeze the rest
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+
+    def account_saved(self, account):
+        """Write the account's totals to the index shortly, together with those of any other account saved by then."""
+        self.saved_accounts[account.name] = account
+        self.record_trigger()
+
+    def record_saved_accounts(self, dt=None):
+        recorded = [account for account in self.saved_accounts.values() if not account.loading]
+        self.saved_accounts.clear()
+        for account in recorded:
+            self.accounts.record(account.name, account.rollup, save=False)
+        if recorded:
+            self.accounts.save()
+
+    def record_account(self, account):
+        if not account.loading:
+            self.accounts.record(account.name, account.rollup)
+
+    def close_account(self, account):
+        self.saved_accounts.pop(account.name, None)
+        self.record_account(account)
+        account.close()
+
+    def close_accounts(self):
+        """Record the totals of every open account and close its books, at shutdown."""
+        for account in self.open_accounts.values():
+            self.close_account(account)
+        self.open_accounts.clear()
+
+    def create_account(self, name):
+        """Add an empty account and switch to it; returns False (and logs why) if it can't be created."""
+        if self.import_thread is not None:
+            log.warning("Wait for the import to finish before switching accounts.")
+            return False
+        try:
+            self.accounts.create(name)
+        except (OSError, ValueError) as e:
+            log.warning("Can't create the account: %s", e)
+            return False
+        name = " ".join(name.split())
+        self.account_spinner.values = self.accounts.names()
+        self.switch_account(name)
+        return True
+
+    @perf.timed("open_popup")
+    def open_new_account_popup(self, instance):
+        popup = NewAccountPopup(self)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_accounts_popup(self, instance):
+        popup = AccountsPopup(self)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_add_etrade_popup(self, instance):
+        if self.etable.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = AddTradePopup(self.etable)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_sell_popup(self, instance):
+        if self.etable.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = SellSharesPopup(self.etable)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_add_otrade_popup(self, instance):
+        if self.otable.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = AddOptionTradePopup(self.otable)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_payoff_popup(self, instance):
+        if self.otable.loading:
+            log.warning("Trades are still loading.")
+            return
+        if not self.otable.greeks.underliers:
+            log.warning("There are no priced open option positions to chart.")
+            return
+        popup = PayoffPopup(self.otable)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_risk_popup(self, instance):
+        if self.etable.loading or self.otable.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = RiskPopup(self)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def open_export_popup(self, instance):
+        if self.etable.loading or self.otable.loading:
+            log.warning("Trades are still loading.")
+            return
+        popup = ExportPopup(self)
+        popup.open()
+
+    @perf.timed("open_popup")
+    def toggle_feed(self, instance):
+        if self.feed is not None:
+            self.stop_feed()
+            return
+        popup = PriceFeedPopup(self)
+        popup.open()
+
+    def start_feed(self, sources):
+        """Start marking open positions to market from `sources`."""
+        self.feed = PriceFeed(sources)
+        self.feed.start()
+        # Ticks pile up in the feed between frames; each frame applies them as one batch
+        self.feed_event = Clock.schedule_interval(self.apply_prices, 0)
+        self.feed_button.text = "Stop Price Feed"
+        log.info("Price feed started from %s", ", ".join(map(repr, sources)))
+
+    def stop_feed(self):
+        if self.feed is None:
+            return
+        self.feed_event.cancel()
+        self.feed.stop()
+        self.feed = self.feed_event = None
+        self.feed_button.text = "Start Price Feed"
+        log.info("Price feed stopped.")
+
+    @perf.timed("apply_prices")
+    def apply_prices(self, dt):
+        """Apply every price that changed since the last frame, in one batch per table."""
+        prices = self.feed.drain()
+        if prices:
+            self.marks.update(prices)
+            self.etable.apply_marks(prices)
+            self.otable.apply_marks(prices)
+
+    @perf.timed("open_popup")
+    def open_import_popup(self, instance):
+        if self.etable.loading or self.otable.loading:
+            log.warning("Trades are still loading.")
+            return
+        if self.import_thread is not None:
+            log.warning("An import is already running.")
+            return
+        popup = ImportStatementPopup(self)
+        popup.open()
+
+    def start_import(self, path):
+        """Import a broker statement on a background thread, adding each parsed batch on the UI thread."""
+        # The dedupe index lives on the UI thread and follows the books from here on, so trades added
+        # by hand while batches are still arriving count too. The trades already in the books are
+        # copied now and counted on the worker, which can take a while on a large book.
+        stores = (self.etable.store, self.otable.store)
+        copies = [BookCopy(store) for store in stores]
+        self.deduplicator = Deduplicator()
+        self.deduplicator.watch(*stores)
+        self.import_cancelled.clear()
+        self.import_thread = threading.Thread(
+            target=self.run_import, args=(path, copies), name="statement-import", daemon=True
+        )
+        self.import_thread.start()
+        self.import_button.text = "Importing..."
+
+    def run_import(self, path, copies):
+        """Worker thread: count the keys in the books, then stream the statement and hand each batch to the UI thread."""
+        error = None
+        try:
+            keys = existing_keys(*copies)
+            Clock.schedule_once(lambda dt: self.deduplicator.count_existing(keys))
+            batches = import_statement(path, chunk_size=LOAD_CHUNK_SIZE, cancelled=self.import_cancelled)
+            for batch in batches:
+                self.import_slots.acquire()
+                Clock.schedule_once(lambda dt, batch=batch: self.apply_import_batch(batch))
+        except (OSError, ValueError) as e:
+            error = str(e)
+        except Exception as e:
+            log.exception("Statement import failed")
+            error = str(e)
+        finally:
+            for copy in copies:
+                copy.close()
+        if error is not None:
+            Clock.schedule_once(lambda dt: self.finish_import(f"Import of {path} failed: {error}", failed=True))
+        else:
+            Clock.schedule_once(lambda dt: self.finish_import(f"Import of {path} finished."))
+
+    @perf.timed("import_batch")
+    def apply_import_batch(self, batch):
+        """Store one batch of imported trades; rows are shown as the tables double."""
+        self.import_slots.release()
+        batch = self.deduplicator.filter(batch)
+        self.etable.stage_trades(self.etable.store.add_many(batch.equities))
+        self.otable.stage_trades(self.otable.store.add_many(batch.options))
+        for line, message in batch.errors[:10]:
+            log.warning("Import line %d skipped: %s", line, message)
+        if len(batch.errors) > 10:
+            log.warning("... %d more bad lines in this batch", len(batch.errors) - 10)
+        log.info(
+            "Imported %d equity and %d option trades from %d rows (%d duplicates skipped)",
+            len(batch.equities), len(batch.options), batch.rows, batch.duplicates
+        )
+
+    def finish_import(self, message, failed=False):
+        for table in (self.etable, self.otable):
+            table.flush_staged()
+        self.deduplicator.unwatch()
+        self.deduplicator = None
+        self.import_thread = None
+        self.import_button.text = "Import Statement"
+        if failed:
+            log.error(message)
+        else:
+            log.info(message)
+
+
+class TradeApp(App):
+    def build(self):
+        return MainWindow()
+
+    def on_stop(self):
+        """Sync and close the trade journals when the app closes (also fires on window close)."""
+        for line in perf.summary():
+            log.info("perf %s", line)
+        self.root.import_cancelled.set()
+        self.root.stop_feed()
+        self.root.close_accounts()
+        risk.shutdown()
+
+
+
+if __name__ == "__main__":
+    TradeApp().run()
+
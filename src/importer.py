@@ -0,0 +1,325 @@
+"""Bulk import of broker statement CSVs into the equity and option books.
+
+The file is streamed through a generator pipeline: rows are read in chunks,
+each chunk is parsed and validated in a worker process, and the results come
+back in file order as batches of trades. A Deduplicator drops the rows that
+duplicate trades already in the books through a hash index of their keys.
+Nothing here touches Kivy, so the GUI runs the pipeline on a background
+thread and deduplicates and inserts each batch on the UI thread, where the
+index sees every change made to the books while the import runs.
+
+Columns are matched by header name, case-insensitively, with the aliases in
+COLUMN_ALIASES. A row with an expiry, strike or put/call column filled in is
+an option trade; anything else is an equity buy. Dates in any format
+store.parse_date() accepts are stored as YYYY-MM-DD.
+"""
+import csv
+import multiprocessing
+import os
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from store import EquityTrade, OptionTrade, iso_date, normalize_date
+
+CHUNK_SIZE = 20000
+
+COLUMN_ALIASES = {
+    "symbol": ("symbol", "ticker", "underlier", "underlying", "underlying symbol"),
+    "date": ("date", "trade date", "buy date", "open date"),
+    "price": ("price", "buy price", "open price", "open", "trade price", "fill price"),
+    "quantity": ("quantity", "qty", "num shares", "shares", "contracts"),
+    "expiry": ("expiry", "expiration", "expiration date", "exp date"),
+    "strike": ("strike", "strike price"),
+    "type": ("type", "put/call", "call/put", "option type", "right"),
+    "underlier_price": ("underlier price", "underlying price", "underlying last"),
+    "premium": ("premium",),
+    "fee": ("fee", "fees", "commission", "commissions"),
+}
+
+OPTION_TYPES = {"C": "CALL", "CALL": "CALL", "P": "PUT", "PUT": "PUT"}
+
+ImportBatch = namedtuple("ImportBatch", ["equities", "options", "duplicates", "errors", "rows"])
+
+
+def map_columns(header):
+    """Map canonical field names to column positions in a CSV header."""
+    positions = {name.strip().lower(): i for i, name in enumerate(header)}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in positions:
+                columns[field] = positions[alias]
+                break
+    missing = {"symbol", "date", "price", "quantity"} - columns.keys()
+    if missing:
+        raise ValueError(f"Statement is missing required columns: {', '.join(sorted(missing))}")
+    return columns
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield (column map, first line number, rows) for successive chunks of a CSV file."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        columns = map_columns(next(reader))
+        chunk = []
+        first_line = 2
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield columns, first_line, chunk
+                first_line += len(chunk)
+                chunk = []
+        if chunk:
+            yield columns, first_line, chunk
+
+
+def _number(text):
+    return float(text.replace(",", "").replace("$", "").strip())
+
+
+def _optional_number(text):
+    text = text.strip()
+    return _number(text) if text else None
+
+
+def parse_row(row, columns):
+    """Validate one statement row and return (kind, fields), raising ValueError if it is bad."""
+    def cell(field):
+        position = columns.get(field)
+        return row[position].strip() if position is not None and position < len(row) else ""
+
+    symbol = cell("symbol").upper()
+    if not symbol:
+        raise ValueError("missing symbol")
+    trade_date = normalize_date(cell("date"))
+    if not trade_date:
+        raise ValueError("missing date")
+
+    price = _number(cell("price"))
+    quantity = int(_number(cell("quantity")))
+    if price <= 0:
+        raise ValueError("price must be greater than 0")
+    if quantity <= 0:
+        # Sells would need lots matched against the book, which an import doesn't do
+        raise ValueError("quantity must be greater than 0")
+
+    if not (cell("expiry") or cell("strike") or cell("type")):
+        return "equity", (symbol, trade_date, price, quantity)
+
+    option_type = OPTION_TYPES.get(cell("type").upper())
+    if option_type is None:
+        raise ValueError(f"unknown option type {cell('type')!r}")
+    expiry = normalize_date(cell("expiry"))
+    if not expiry:
+        raise ValueError("missing expiry")
+    strike = _number(cell("strike"))
+    premium = _optional_number(cell("premium"))
+    fee = _optional_number(cell("fee"))
+    return "option", (
+        symbol, trade_date, expiry, option_type, price, strike, _optional_number(cell("underlier_price")),
+        price if premium is None else premium, 0.0 if fee is None else fee, quantity
+    )
+
+
+def parse_chunk(columns, first_line, rows):
+    """Parse a chunk of rows; runs in a worker process.
+
+    Returns (parsed, errors) where parsed holds (kind, fields) tuples in file
+    order and errors holds (line number, message) pairs.
+    """
+    parsed = []
+    errors = []
+    for line, row in enumerate(rows, first_line):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            parsed.append(parse_row(row, columns))
+        except (ValueError, IndexError) as e:
+            errors.append((line, str(e)))
+    return parsed, errors
+
+
+def trade_key(kind, fields):
+    """Hashable identity of a trade used for de-duplication."""
+    if kind == "equity":
+        symbol, trade_date, price, quantity = fields
+        return ("equity", symbol, trade_date, round(price, 4), quantity)
+    symbol, trade_date, expiry, option_type, price, strike, _, _, _, quantity = fields
+    return ("option", symbol, trade_date, expiry, option_type, round(price, 4), round(strike, 4), quantity)
+
+
+def book_key(trade):
+    """trade_key() of a stored trade.
+
+    Dates are compared in ISO form, since books saved before dates were
+    normalized may hold them as typed.
+    """
+    if isinstance(trade, EquityTrade):
+        buy_date = iso_date(trade.buy_date) or trade.buy_date
+        return trade_key("equity", (trade.ticker, buy_date, trade.buy_price or 0.0, trade.num_shares))
+    return trade_key("option", (
+        trade.underlier, iso_date(trade.date) or trade.date, iso_date(trade.expiry) or trade.expiry,
+        trade.type, trade.open_price or 0.0,
+        trade.strike or 0.0, None, None, None, trade.quantity
+    ))
+
+
+def existing_keys(equities, options):
+    """Count the trades already in the books (or BookCopy objects) by their de-duplication key."""
+    keys = Counter()
+    for store in (equities, options):
+        for trade in store:
+            keys[book_key(trade)] += 1
+    return keys
+
+
+class BookCopy:
+    """The trades of one book as they are now, to count their keys on another thread.
+
+    Construct it on the thread that owns the store, then iterate it anywhere.
+    In-memory trades have their fields copied and a binary snapshot its live
+    rows, decoded as they are read. A SQLite book gets a connection of its
+    own with a read transaction begun here, so later writes don't show.
+    """
+
+    def __init__(self, store):
+        self.trade_class = store.trade_class
+        fields = store.trade_class.__slots__
+        self.columns = self.connection = None
+        if getattr(store, "columns", None) is not None:
+            rows = store.alive.nonzero()[0]
+            self.columns = {field: column[rows] for field, column in store.columns.items()}
+            self.strings = {field: list(table) for field, table in store.strings.items()}
+            self.kinds = store.kinds
+            trades = store.added.values()
+        elif getattr(store, "connection", None) is not None:
+            from sqlstore import connect
+            self.connection = connect(store.path)
+            self.select = f"{store.spec.select_sql()} ORDER BY id"
+            self.connection.execute("BEGIN")
+            self.connection.execute(f"SELECT id FROM {store.spec.name} LIMIT 1").fetchall()
+            trades = ()
+        else:
+            trades = store.trades.values()
+        self.records = [tuple(getattr(trade, field) for field in fields) for trade in trades]
+
+    def __iter__(self):
+        make = self.trade_class
+        if self.connection is not None:
+            for row in self.connection.execute(self.select):
+                yield make(*row[1:], id=row[0])
+        if self.columns is not None:
+            from mapstore import decode_rows
+            for start in range(0, len(self.columns["id"]), CHUNK_SIZE):
+                rows = slice(start, start + CHUNK_SIZE)
+                yield from decode_rows(make, self.kinds, self.columns, self.strings, rows)
+        for record in self.records:
+            yield make(*record[1:], id=record[0])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Deduplicator:
+    """Drops statement rows that are already in the books.
+
+    A row is a duplicate while the books, leaving out the trades imported
+    from this statement, hold at least as many trades with its key as the
+    statement has had rows with it so far. Once watching the stores it
+    counts every trade added or deleted while the import runs, by hand as
+    well, so use it on the thread that changes them. Started empty, it can
+    be watching while the keys already in the books are counted elsewhere
+    from a BookCopy taken at the same time; count_existing() adds them in.
+    """
+
+    def __init__(self, equities=(), options=()):
+        self.known = existing_keys(equities, options)
+        self.seen = Counter()
+        self.imported = Counter()
+        self.stores = []
+
+    def watch(self, *stores):
+        for store in stores:
+            store.listeners.append(self)
+            self.stores.append(store)
+
+    def unwatch(self):
+        for store in self.stores:
+            store.listeners.remove(self)
+        self.stores = []
+
+    def count_existing(self, keys):
+        """Add the existing_keys() of the books as they were when watching began; `keys` is taken over."""
+        # The changes seen so far are few, so fold them into the large count rather than the other way
+        keys.update(self.known)
+        self.known = keys
+
+    def trade_added(self, trade):
+        self.known[book_key(trade)] += 1
+
+    def trade_closed(self, trade):
+        pass  # closing doesn't change a trade's key
+
+    def trade_removed(self, trade):
+        self.known[book_key(trade)] -= 1
+
+    def is_new(self, trade):
+        key = book_key(trade)
+        self.seen[key] += 1
+        if self.seen[key] <= self.known[key] - self.imported[key]:
+            return False
+        self.imported[key] += 1
+        return True
+
+    def filter(self, batch):
+        """The ImportBatch without the rows already in the books, counted as duplicates."""
+        equities = [trade for trade in batch.equities if self.is_new(trade)]
+        options = [trade for trade in batch.options if self.is_new(trade)]
+        dropped = len(batch.equities) + len(batch.options) - len(equities) - len(options)
+        return batch._replace(equities=equities, options=options, duplicates=batch.duplicates + dropped)
+
+
+def _parsed_chunks(path, workers, chunk_size):
+    """Yield parse_chunk results in file order, keeping a bounded number of chunks in flight."""
+    chunks = read_chunks(path, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            yield (len(chunk[2]),) + parse_chunk(*chunk)
+        return
+
+    # Spawned workers only import this module and the store, never the GUI
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append((len(chunk[2]), pool.submit(parse_chunk, *chunk)))
+            if len(pending) >= workers * 2:
+                rows, future = pending.pop(0)
+                yield (rows,) + future.result()
+        for rows, future in pending:
+            yield (rows,) + future.result()
+
+
+def import_statement(path, deduplicator=None, workers=None, chunk_size=CHUNK_SIZE, cancelled=None):
+    """Stream a broker statement, yielding an ImportBatch of its trades per chunk.
+
+    With a Deduplicator the rows already in the books are left out;
+    without one every row is yielded, for the caller to filter. `cancelled`
+    is an optional threading.Event checked between chunks.
+    """
+    if workers is None:
+        workers = 1 if os.path.getsize(path) < 1_000_000 else (os.cpu_count() or 1)
+
+    for rows, parsed, errors in _parsed_chunks(path, workers, chunk_size):
+        if cancelled is not None and cancelled.is_set():
+            return
+        equities, options = [], []
+        for kind, fields in parsed:
+            if kind == "equity":
+                equities.append(EquityTrade(*fields))
+            else:
+                options.append(OptionTrade(*fields))
+        batch = ImportBatch(equities, options, 0, errors, rows)
+        yield batch if deduplicator is None else deduplicator.filter(batch)
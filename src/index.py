@@ -0,0 +1,178 @@
+"""Secondary indexes over a TradeStore for filtering and sorting the tables.
+
+A TradeIndex listens to its store and keeps, incrementally:
+
+- a hash of trade ids by symbol (ticker or underlier) and by option type,
+- the set of open trade ids,
+- a SortedIndex of ids per date column (ordered by date ordinal).
+
+query() intersects whichever of these a filter uses, smallest first, so
+"open AAPL puts expiring this month" never scans the whole book.
+"""
+from bisect import bisect_left, bisect_right, insort
+
+from store import date_ordinal
+
+# Sort key for a date that doesn't parse: after every real date
+NO_DATE = float("inf")
+
+
+class SortedIndex:
+    """Trade ids ordered by a numeric key.
+
+    Adds go to an unsorted tail that is merged in on the next read, so a
+    bulk load appends in O(1) per trade and pays for one sort (mostly a merge
+    of already-sorted runs) the first time the index is used. A short tail,
+    like the few trades added between two edits, is bisected in instead.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.pending = []
+
+    def __len__(self):
+        return len(self.entries) + len(self.pending)
+
+    def add(self, key, trade_id):
+        self.pending.append((key, trade_id))
+
+    def discard(self, key, trade_id):
+        self._merge()
+        i = bisect_left(self.entries, (key, trade_id))
+        if i < len(self.entries) and self.entries[i] == (key, trade_id):
+            del self.entries[i]
+
+    def _merge(self):
+        if not self.pending:
+            return
+        if len(self.pending) * 64 < len(self.entries):
+            for entry in self.pending:
+                insort(self.entries, entry)
+        else:
+            self.entries.extend(self.pending)
+            self.entries.sort()
+        self.pending = []
+
+    def ids(self, low=None, high=None):
+        """Ids with low <= key <= high (either bound may be None), in key order."""
+        self._merge()
+        entries = self.entries
+        start = 0 if low is None else bisect_left(entries, (low, -1))
+        stop = len(entries) if high is None else bisect_right(entries, (high, float("inf")))
+        return [trade_id for _, trade_id in entries[start:stop]]
+
+
+class TradeIndex:
+    """Incrementally maintained indexes for one store; `date_fields` names the date attributes to order."""
+
+    def __init__(self, store, date_fields):
+        self.store = store
+        self.date_fields = tuple(date_fields)
+        self.by_symbol = {}
+        self.by_type = {}
+        self.open_ids = set()
+        self.by_date = {field: SortedIndex() for field in self.date_fields}
+        # The key each trade is filed under per date column, to find it again when closing changes it
+        self.date_keys = {field: {} for field in self.date_fields}
+        for trade in store:
+            self.trade_added(trade)
+        store.listeners.append(self)
+
+    @property
+    def ordered_fields(self):
+        """Fields ordered() can sort by directly."""
+        return self.date_fields
+
+    def trade_added(self, trade):
+        self.by_symbol.setdefault(trade.symbol, set()).add(trade.id)
+        option_type = getattr(trade, "type", None)
+        if option_type is not None:
+            self.by_type.setdefault(option_type, set()).add(trade.id)
+        if trade.is_open:
+            self.open_ids.add(trade.id)
+        for field, index in self.by_date.items():
+            key = self.date_keys[field][trade.id] = date_key(getattr(trade, field))
+            index.add(key, trade.id)
+
+    def trade_closed(self, trade):
+        self.open_ids.discard(trade.id)
+        for field, index in self.by_date.items():
+            keys = self.date_keys[field]
+            key = date_key(getattr(trade, field))
+            if keys[trade.id] != key:
+                index.discard(keys[trade.id], trade.id)
+                index.add(key, trade.id)
+                keys[trade.id] = key
+
+    def trade_removed(self, trade):
+        trade_id = trade.id
+        self.by_symbol[trade.symbol].discard(trade_id)
+        option_type = getattr(trade, "type", None)
+        if option_type is not None:
+            self.by_type[option_type].discard(trade_id)
+        self.open_ids.discard(trade_id)
+        for field, index in self.by_date.items():
+            index.discard(self.date_keys[field].pop(trade_id), trade_id)
+
+    def query(self, symbol=None, type=None, status=None, date_field=None, date_from=None, date_to=None):
+        """Ids of the trades matching every given filter, in id (insertion) order.
+
+        `symbol` matches exactly (case-insensitive); `status` is "open" or
+        "closed"; `date_from`/`date_to` are date cells bounding `date_field`
+        inclusively. Returns None when no filter is set, meaning every trade.
+        """
+        candidates = []
+        if symbol:
+            candidates.append(self.by_symbol.get(symbol.strip().upper(), set()))
+        if type:
+            candidates.append(self.by_type.get(type, set()))
+        if date_from or date_to:
+            low = date_ordinal(date_from) if date_from else None
+            high = date_ordinal(date_to) if date_to else None
+            if (date_from and low is None) or (date_to and high is None):
+                raise ValueError("Dates must look like YYYY-MM-DD")
+            candidates.append(set(self.by_date[date_field or self.date_fields[0]].ids(low, high)))
+        if status == "open":
+            candidates.append(self.open_ids)
+
+        if not candidates and status != "closed":
+            return None
+        if candidates:
+            candidates.sort(key=len)
+            matched = set(candidates[0])
+            for candidate in candidates[1:]:
+                matched.intersection_update(candidate)
+        else:
+            matched = set(self.store.trades)
+        if status == "closed":
+            matched -= self.open_ids
+        return sorted(matched)
+
+    def ordered(self, date_field, trade_ids=None, reverse=False):
+        """Ids in `date_field` order, restricted to `trade_ids` if given, straight from the sorted index.
+
+        Trades without a date come last in either direction.
+        """
+        index = self.by_date[date_field]
+        if trade_ids is not None and len(trade_ids) * 8 < len(index):
+            # A small filtered set is cheaper to sort by its cached keys than to walk the whole index
+            keys = self.date_keys[date_field]
+            dated = sorted((keys[trade_id], trade_id) for trade_id in trade_ids)
+            ids = [trade_id for key, trade_id in dated if key != NO_DATE]
+            if reverse:
+                ids.reverse()
+            return ids + [trade_id for key, trade_id in dated if key == NO_DATE]
+
+        ids = index.ids()
+        if reverse:
+            undated = index.ids(NO_DATE, NO_DATE)
+            ids = ids[:len(ids) - len(undated)][::-1] + undated
+        if trade_ids is not None:
+            wanted = set(trade_ids)
+            ids = [trade_id for trade_id in ids if trade_id in wanted]
+        return ids
+
+
+def date_key(text):
+    ordinal = date_ordinal(text) if text else None
+    return NO_DATE if ordinal is None else ordinal
@@ -0,0 +1,256 @@
+"""Append-only journal persistence for a TradeStore.
+
+Each book is a snapshot file (the binary .etrades.bin/.otrades.bin of
+mapstore.py, or the JSON .etrades.json/.otrades.json they are imported from
+and exported to) plus a JSON Lines journal of the add/close/edit/delete
+events made since that snapshot. Events are written as they happen and
+fsynced in batches, so saving costs the same no matter how large the
+history is. Autosave folds the journal into a new binary snapshot.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class Journal:
+    """JSON Lines event log, fsynced every `sync_every` events or `sync_interval` seconds.
+
+    With sync_every=None appends never fsync; the owner calls sync() itself,
+    for example from a background thread.
+    """
+
+    def __init__(self, path, seq=0, sync_every=64, sync_interval=1.0):
+        self.path = path
+        self.seq = seq
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.count = 0
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        drop_torn_tail(path)
+        self.file = open(path, "a")
+
+    def __len__(self):
+        """Number of events currently in the journal file."""
+        with self.lock:
+            return self.count
+
+    def append(self, event):
+        """Write one event, stamping it with the next sequence number."""
+        with self.lock:
+            self.seq += 1
+            event = dict(event, seq=self.seq)
+            self.file.write(json.dumps(event, separators=(",", ":")) + "\n")
+            self.file.flush()
+            self.pending += 1
+            self.count += 1
+            self._maybe_sync()
+        return self.seq
+
+    def extend(self, events):
+        """Write a batch of events with a single write, stamping each with the next sequence number."""
+        with self.lock:
+            lines = []
+            for event in events:
+                self.seq += 1
+                lines.append(json.dumps(dict(event, seq=self.seq), separators=(",", ":")) + "\n")
+            self.file.write("".join(lines))
+            self.file.flush()
+            self.pending += len(lines)
+            self.count += len(lines)
+            self._maybe_sync()
+        return self.seq
+
+    def sync(self):
+        """Force any unsynced events to disk."""
+        with self.lock:
+            self._sync()
+
+    def _maybe_sync(self):
+        if self.sync_every is None:
+            return
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        if self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def truncate_through(self, seq):
+        """Drop events already covered by a snapshot taken at `seq`."""
+        with self.lock:
+            self._sync()
+            self.file.close()
+            tail = [event for event in read_journal(self.path) if event["seq"] > seq]
+            write_atomic(self.path, "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in tail))
+            self.file = open(self.path, "a")
+            self.count = len(tail)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
+
+
+def read_journal(path):
+    """Yield the events in a journal file, stopping at a torn final line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write leaves at most one partial line at the end
+                return
+
+
+def drop_torn_tail(path):
+    """Cut a partial last line left by a crash so new events start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def write_atomic(path, text):
+    """Replace `path` with `text` via a synced temp file and rename."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def set_aside(path):
+    """Rename `path` to path.corrupt, or path.corrupt.1 and up if taken, and return the new name."""
+    target = path + ".corrupt"
+    number = 0
+    while os.path.exists(target):
+        number += 1
+        target = f"{path}.corrupt.{number}"
+    os.replace(path, target)
+    return target
+
+
+def read_snapshot(path):
+    """Parse a snapshot file into (seq, records, is_legacy, next_id).
+
+    Legacy snapshots are a bare list of column-string rows and cover seq 0.
+    next_id is None for snapshots written before it was kept.
+    """
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+
+    if isinstance(snapshot, list):
+        return 0, snapshot, True, None
+    return snapshot["seq"], snapshot["trades"], False, snapshot.get("next_id")
+
+
+def write_snapshot(path, trades, seq, next_id=None):
+    """Atomically write a snapshot of `trades` (a list of record dicts) covering `seq`.
+
+    `next_id` is the store's next trade id, kept so the ids of deleted trades
+    are not handed out again after a reload.
+    """
+    snapshot = {"version": SNAPSHOT_VERSION, "seq": seq, "trades": trades}
+    if next_id is not None:
+        snapshot["next_id"] = next_id
+    write_atomic(path, json.dumps(snapshot, separators=(",", ":")))
+
+
+def write_snapshot_records(path, fields, records, seq, chunk_size=2000):
+    """Atomically write a snapshot from tuples of `fields` values, encoding a chunk at a time.
+
+    Produces the same file as write_snapshot(). Encoding in chunks lets other
+    threads run in between, so a background save doesn't stall the UI.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f'{{"version":{SNAPSHOT_VERSION},"seq":{seq},"trades":[')
+        for start in range(0, len(records), chunk_size):
+            chunk = [dict(zip(fields, record)) for record in records[start:start + chunk_size]]
+            if start:
+                f.write(",")
+            f.write(json.dumps(chunk, separators=(",", ":"))[1:-1])
+            time.sleep(0)  # hand the GIL back between chunks
+        f.write("]}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def stream_book(store, snapshot_path, journal_path, chunk_size=5000, attach=True, sync_every=64):
+    """Load a book into `store` in chunks, yielding the ids of the trades each chunk added.
+
+    The snapshot is parsed in one pass, then turned into records `chunk_size`
+    at a time so a caller can spread the work across frames. The journal tail
+    is replayed and attached to the store last, so nothing is journaled until
+    the whole book is in memory. With attach=False the files are only read,
+    for read-only users like the headless reports; sync_every is passed to
+    the attached Journal. Trades the journal goes on to delete are stored
+    (their later events need them) but never yielded. Returns the number of
+    journal events replayed.
+    """
+    seq, records, is_legacy, next_id = 0, [], False, None
+    if os.path.exists(snapshot_path):
+        try:
+            seq, records, is_legacy, next_id = read_snapshot(snapshot_path)
+        except json.JSONDecodeError:
+            log.error("%s contains invalid JSON. Starting from the journal alone.", snapshot_path)
+    if next_id is not None:
+        store.next_id = max(store.next_id, next_id)
+
+    events = [event for event in read_journal(journal_path) if event["seq"] > seq]
+    deleted = {event["id"] for event in events if event["op"] == "delete"}
+
+    make_trade = store.trade_class.from_row if is_legacy else store.trade_class.from_dict
+    for start in range(0, len(records), chunk_size):
+        trade_ids = [store.add(make_trade(record)) for record in records[start:start + chunk_size]]
+        yield [trade_id for trade_id in trade_ids if trade_id not in deleted] if deleted else trade_ids
+    del records
+
+    count = 0
+    added = []
+    for event in events:
+        if event["seq"] > seq:
+            try:
+                store.apply(event)
+            except KeyError:
+                log.warning("Skipping journal event %d for a trade missing from the snapshot.", event["seq"])
+            else:
+                if event["op"] == "add" and event["trade"]["id"] not in deleted:
+                    added.append(event["trade"]["id"])
+            seq = event["seq"]
+            count += 1
+    if added:
+        yield added
+
+    if attach:
+        store.journal = Journal(journal_path, seq=seq, sync_every=sync_every)
+        store.journal.count = count
+    return count
+
+
+def open_book(store, snapshot_path, journal_path, attach=True):
+    """Load the last snapshot, replay the journal tail and attach the journal to `store`."""
+    loader = stream_book(store, snapshot_path, journal_path, attach=attach)
+    while True:
+        try:
+            next(loader)
+        except StopIteration as done:
+            return done.value
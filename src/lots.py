@@ -0,0 +1,267 @@
+"""Tax-lot matching for equity sells, and realized gains by year.
+
+Every equity row is a buy lot. Selling shares of a ticker takes them from
+its open lots first-in-first-out, last-in-first-out, or from specific lots
+by id. A lot sold in full is closed. A lot sold in part keeps its remaining
+shares, and the sold part becomes a new closed row with the same buy date
+and price. Both are ordinary store operations, so they are journaled and
+every listener sees them.
+
+A LotBook keeps, per ticker, a LotQueue of the open lots ordered by buy date
+and the buy dates of all its lots. A sell is matched by walking the front
+(or back) of one queue, and a wash-sale check bisects the buy dates, so
+neither scans the book. The queues are built the first time a ticker is
+sold, from the table's index, and kept up to date as the store changes.
+
+A sale at a loss is a wash sale when shares of the same ticker were bought
+within WASH_SALE_DAYS either side of it. Rows with the same buy date and
+price count as one purchase: the rest of a partly sold lot is not a
+replacement for the part that was sold. The disallowed loss is reported;
+the replacement lots' cost basis is left as entered. The warning given at
+sell time counts every replacement share in the window, whereas
+realized_gains() lets each share replace only one sale.
+"""
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import date
+from operator import itemgetter
+
+from index import date_key
+from store import EquityTrade, date_ordinal
+
+METHODS = ("fifo", "lifo", "specific")
+WASH_SALE_DAYS = 30
+# Held longer than this many days is long-term
+LONG_TERM_DAYS = 365
+
+# The shares a sell takes from one lot
+Match = namedtuple("Match", ["lot_id", "shares"])
+
+# An executed sell: the lots it was matched to, the rows it closed or added, and any wash-sale loss disallowed
+Sale = namedtuple("Sale", ["ticker", "shares", "proceeds", "cost", "matches", "changed_ids", "added_ids", "wash_disallowed"])
+
+# One ticker's (or the total's) realized gains in a report
+Realized = namedtuple(
+    "Realized", ["lots", "shares", "proceeds", "cost", "short_term", "long_term", "wash_disallowed"]
+)
+
+
+def purchase_of(trade):
+    """Rows of one ticker sharing a buy date and price are one purchase, however they were split."""
+    return trade.buy_date, trade.buy_price
+
+
+def replacement_shares(buys, sold_on, sold_purchases, shares, used=None):
+    """Shares bought within the wash-sale window of a sale, up to `shares`.
+
+    `buys` is a sorted list of (buy ordinal, purchase, shares, key). Purchases
+    in `sold_purchases` are skipped. If `used` (key -> shares) is given,
+    shares already counted against an earlier sale are skipped and the ones
+    counted here are added to it.
+    """
+    start = bisect_left(buys, (sold_on - WASH_SALE_DAYS,))
+    stop = bisect_left(buys, (sold_on + WASH_SALE_DAYS + 1,))
+    found = 0
+    for _, purchase, available, key in buys[start:stop]:
+        if found >= shares:
+            break
+        if purchase in sold_purchases:
+            continue
+        if used is not None:
+            available -= used.get(key, 0)
+        taken = min(available, shares - found)
+        if taken > 0:
+            found += taken
+            if used is not None:
+                used[key] = used.get(key, 0) + taken
+    return found
+
+
+class LotQueue:
+    """Open lots of one ticker as (buy date key, id), oldest first; undated lots sort last."""
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, trade):
+        insort(self.entries, (date_key(trade.buy_date), trade.id))
+
+    def discard(self, trade):
+        entry = (date_key(trade.buy_date), trade.id)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def ids(self, newest_first=False):
+        entries = reversed(self.entries) if newest_first else self.entries
+        return (trade_id for _, trade_id in entries)
+
+
+class LotBook:
+    """Lot matching over an equity store, using `index` (any of the table indexes) to find a ticker's lots."""
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        # ticker -> LotQueue of open lots, and sorted (buy ordinal, purchase, shares, id) of every lot
+        self.queues = {}
+        self.buys = {}
+        store.listeners.append(self)
+
+    def load(self, ticker):
+        """Build a ticker's queue and buy dates from the store, the first time it is sold."""
+        queue = self.queues.get(ticker)
+        if queue is not None:
+            return queue
+        queue = self.queues[ticker] = LotQueue()
+        self.buys[ticker] = []
+        for trade_id in self.index.query(symbol=ticker) or ():
+            self.file(self.store.get(trade_id))
+        return queue
+
+    def file(self, trade):
+        if trade.buy_price is None or not trade.num_shares:
+            return
+        if trade.is_open:
+            self.queues[trade.ticker].add(trade)
+        bought = date_ordinal(trade.buy_date or "")
+        if bought is not None:
+            insort(self.buys[trade.ticker], (bought, purchase_of(trade), trade.num_shares, trade.id))
+
+    def unfile(self, trade, was_open):
+        if trade.buy_price is None or not trade.num_shares:
+            return
+        if was_open:
+            self.queues[trade.ticker].discard(trade)
+        bought = date_ordinal(trade.buy_date or "")
+        if bought is not None:
+            buys = self.buys[trade.ticker]
+            entry = (bought, purchase_of(trade), trade.num_shares, trade.id)
+            i = bisect_left(buys, entry)
+            if i < len(buys) and buys[i] == entry:
+                del buys[i]
+
+    # Store listener hooks; tickers that were never sold are left to load() later
+    def trade_added(self, trade):
+        if trade.ticker in self.queues:
+            self.file(trade)
+
+    def trade_closed(self, trade):
+        if trade.ticker in self.queues and trade.buy_price is not None:
+            self.queues[trade.ticker].discard(trade)
+
+    def trade_removed(self, trade):
+        if trade.ticker in self.queues:
+            self.unfile(trade, trade.is_open)
+
+    def match(self, ticker, shares, method="fifo", lot_ids=None):
+        """The (lot id, shares) a sell of `shares` takes, without selling; ValueError if it can't be filled."""
+        if method not in METHODS:
+            raise ValueError(f"unknown lot method {method!r}")
+        if shares <= 0:
+            raise ValueError("shares must be greater than 0")
+        queue = self.load(ticker)
+        if method == "specific":
+            for lot_id in lot_ids or ():
+                lot = self.store.get(lot_id) if lot_id in self.store else None
+                if lot is None or lot.ticker != ticker or not lot.is_open or lot.buy_price is None:
+                    raise ValueError(f"lot {lot_id} is not an open {ticker} lot")
+            candidates = dict.fromkeys(lot_ids or ())
+        else:
+            candidates = queue.ids(newest_first=method == "lifo")
+
+        matches, remaining = [], shares
+        for lot_id in candidates:
+            if not remaining:
+                break
+            taken = min(self.store.get(lot_id).num_shares, remaining)
+            matches.append(Match(lot_id, taken))
+            remaining -= taken
+        if remaining:
+            raise ValueError(f"only {shares - remaining} {ticker} shares are open in the lots given")
+        return matches
+
+    def wash_disallowed(self, ticker, matches, sell_date, sell_price):
+        """Loss disallowed by the wash-sale rule if these lots were sold at `sell_price` on `sell_date`."""
+        sold_on = date_ordinal(sell_date)
+        lots = [self.store.get(lot_id) for lot_id, _ in matches]
+        shares = sum(taken for _, taken in matches)
+        loss = sum((lot.buy_price - sell_price) * taken for lot, (_, taken) in zip(lots, matches))
+        if sold_on is None or loss <= 0:
+            return 0.0
+        replaced = replacement_shares(self.buys[ticker], sold_on, {purchase_of(lot) for lot in lots}, shares)
+        return loss * replaced / shares
+
+    def sell(self, ticker, shares, sell_date, sell_price, method="fifo", lot_ids=None):
+        """Sell `shares` of `ticker` from its open lots and return the Sale."""
+        matches = self.match(ticker, shares, method, lot_ids)
+        wash = self.wash_disallowed(ticker, matches, sell_date, sell_price)
+        changed, added, cost = [], [], 0.0
+        for lot_id, taken in matches:
+            lot = self.store.get(lot_id)
+            cost += lot.buy_price * taken
+            changed.append(lot_id)
+            if taken == lot.num_shares:
+                self.store.close(lot_id, sell_date, sell_price)
+                continue
+            self.store.update(lot_id, {"num_shares": lot.num_shares - taken})
+            sold = EquityTrade(ticker, lot.buy_date, lot.buy_price, taken, sell_date, sell_price)
+            added.append(self.store.add(sold))
+        return Sale(ticker, shares, shares * sell_price, cost, matches, changed, added, wash)
+
+
+def realized_gains(trades, year=None):
+    """Realized gains on equity lots sold in `year` (every year if None): ({ticker: Realized}, total Realized).
+
+    Gains are short- or long-term by holding period. Losses are checked for
+    wash sales in sale order, with each replacement share counted against
+    one sale only; sales in the two windows before the year take part in
+    that, so a December loss uses up a January purchase before a January
+    loss can.
+    """
+    if year is None:
+        first, last = 0, float("inf")
+    else:
+        first, last = date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()
+    # Earlier sales can only use up purchases a sale in the year could also use
+    earliest = first - 2 * WASH_SALE_DAYS
+    buys, sales = {}, []
+    for trade in trades:
+        buy_price, shares = trade.buy_price, trade.num_shares
+        if buy_price is None or not shares:
+            continue
+        bought = date_ordinal(trade.buy_date or "")
+        if bought is not None and earliest - WASH_SALE_DAYS <= bought <= last + WASH_SALE_DAYS:
+            buys.setdefault(trade.ticker, []).append((bought, (trade.buy_date, buy_price), shares, trade.id))
+        if trade.sell_price is not None:
+            sold = date_ordinal(trade.sell_date or "")
+            if sold is not None and earliest <= sold <= last:
+                sales.append((sold, trade.id, trade, bought))
+    for ticker_buys in buys.values():
+        ticker_buys.sort()
+    sales.sort(key=itemgetter(0, 1))
+
+    by_ticker, used = {}, {}
+    for sold, _, trade, bought in sales:
+        shares = trade.num_shares
+        gain = (trade.sell_price - trade.buy_price) * shares
+        disallowed = 0.0
+        if gain < 0:
+            replaced = replacement_shares(buys.get(trade.ticker, ()), sold, {purchase_of(trade)}, shares, used)
+            disallowed = -gain * replaced / shares
+        if sold < first:
+            continue
+        long_term = bought is not None and sold - bought > LONG_TERM_DAYS
+        row = by_ticker.setdefault(trade.ticker, [0, 0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        row[0] += 1
+        row[1] += shares
+        row[2] += trade.sell_price * shares
+        row[3] += trade.buy_price * shares
+        row[5 if long_term else 4] += gain
+        row[6] += disallowed
+
+    total = [sum(column) for column in zip(*by_ticker.values())] or [0, 0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    return {ticker: Realized(*row) for ticker, row in by_ticker.items()}, Realized(*total)
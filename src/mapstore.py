@@ -0,0 +1,608 @@
+"""Compact binary snapshots of a trade book, opened with mmap.
+
+A snapshot file is a short header followed by one fixed-width column per
+trade field, so opening a book never parses it:
+
+    8 bytes   MAGIC
+    4 bytes   header length (little-endian uint32)
+    header    JSON: version, trade class, seq, count, next id, and per column
+              its dtype and offset, plus the string table of each text column
+    columns   8-byte aligned, `count` values each, ordered by trade id
+
+Numbers are float64 (NaN for a missing value) or int64 (INT_MISSING). Text
+columns (tickers, dates, option types) hold uint32 codes into that column's
+string table, where code 0 is a missing value; a book repeats the same few
+hundred tickers and a few thousand dates, so each string is stored once.
+
+MappedTradeStore has the TradeStore interface over such a file. The file is
+mapped copy-on-write: nothing is read until a row is shown, a trade is only
+decoded when it is asked for (and kept in a small LRU cache), and a close or
+edit writes its new values straight into the mapped columns, so only the
+touched pages ever become private memory. Changes are journaled exactly as
+for the JSON books, and Autosave writes a fresh file from the columns.
+MappedIndex answers the table's filter and sort queries with NumPy over the
+columns.
+
+The JSON snapshots remain the import/export format: a book with no binary
+snapshot is loaded from JSON and saved as binary from then on, and
+`python src/main.py export-json` writes JSON back out.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from operator import itemgetter
+
+import numpy as np
+
+from journal import Journal, read_journal
+from sqlstore import TABLES
+from store import EquityTrade, date_ordinal
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"OTBOOK\r\n"
+VERSION = 1
+HEADER_LENGTH = struct.Struct("<I")
+ALIGN = 8
+
+# Column dtype for each SQLite column type; text is coded through a string table
+DTYPES = {"TEXT": "<u4", "REAL": "<f8", "INTEGER": "<i8"}
+INT_MISSING = np.iinfo(np.int64).min
+# Trades decoded per step when iterating a whole book
+DECODE_CHUNK = 10000
+# Decoded trades kept by id; the table only ever shows a screenful
+CACHE_SIZE = 20000
+
+
+def column_kinds(trade_class):
+    """The SQLite type ("TEXT", "REAL" or "INTEGER") of each stored field, id first."""
+    spec = TABLES[trade_class]
+    kinds = {"id": "INTEGER"}
+    kinds.update((field, kind.split()[0]) for field, kind in spec.columns.items())
+    return kinds
+
+
+def encode_records(trade_class, records, tables=None):
+    """Turn tuples of `trade_class.__slots__` values into (columns, strings) ready for write_columns().
+
+    `tables` (field -> {value: code}) carries the string tables over from an
+    earlier call, so a book can be encoded a chunk at a time.
+    """
+    kinds = column_kinds(trade_class)
+    tables = {} if tables is None else tables
+    columns, strings = {}, {}
+    # Rows are looked up by binary search on id; an edit moves its record to the end of Autosave's dict
+    records = sorted(records, key=itemgetter(0))
+    values = list(zip(*records)) if records else [()] * len(kinds)
+    for field, column in zip(trade_class.__slots__, values):
+        kind = kinds[field]
+        if kind == "TEXT":
+            table = tables.setdefault(field, {None: 0})
+            codes = [table.setdefault(value, len(table)) for value in column]
+            columns[field] = np.array(codes, dtype=DTYPES[kind])
+            strings[field] = list(table)
+        elif kind == "REAL":
+            columns[field] = np.array([np.nan if value is None else value for value in column], dtype=DTYPES[kind])
+        else:
+            columns[field] = np.array([INT_MISSING if value is None else value for value in column], dtype=DTYPES[kind])
+    return columns, strings
+
+
+def snapshot_header(trade_class, count, strings, seq, next_id):
+    """MAGIC, header length and header of a snapshot of `count` trades, padded so the columns start aligned."""
+    layout, offset = {}, 0
+    for field, kind in column_kinds(trade_class).items():
+        layout[field] = {"dtype": DTYPES[kind], "offset": offset}
+        if kind == "TEXT":
+            layout[field]["strings"] = strings[field]
+        offset += -(-count * np.dtype(DTYPES[kind]).itemsize // ALIGN) * ALIGN
+    header = json.dumps({
+        "version": VERSION, "kind": trade_class.__name__, "seq": seq, "count": count, "next_id": next_id,
+        "columns": layout,
+    }, separators=(",", ":")).encode()
+    header += b" " * (-(len(MAGIC) + HEADER_LENGTH.size + len(header)) % ALIGN)
+    return MAGIC + HEADER_LENGTH.pack(len(header)) + header
+
+
+def write_columns(path, trade_class, columns, strings, seq, next_id=None):
+    """Atomically write a snapshot from column arrays (ordered by id) and the text columns' string tables."""
+    count = len(columns["id"])
+    if next_id is None:
+        next_id = int(columns["id"][-1]) + 1 if count else 1
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(snapshot_header(trade_class, count, strings, seq, next_id))
+        for field, kind in column_kinds(trade_class).items():
+            data = np.ascontiguousarray(columns[field], dtype=DTYPES[kind]).tobytes()
+            f.write(data + b"\0" * (-len(data) % ALIGN))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def write_trades(path, trade_class, trades, seq, next_id=None):
+    """Write a snapshot of trade objects, for example a book loaded from JSON."""
+    fields = trade_class.__slots__
+    columns, strings = encode_records(trade_class, [tuple(getattr(trade, field) for field in fields) for trade in trades])
+    return write_columns(path, trade_class, columns, strings, seq, next_id)
+
+
+def map_columns(buffer, trade_class):
+    """Parse a snapshot's header and return (header, columns) with the columns as arrays over `buffer`."""
+    start = len(MAGIC) + HEADER_LENGTH.size
+    if len(buffer) < start or buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a trade snapshot")
+    (length,) = HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+    header = json.loads(bytes(buffer[start:start + length]))
+    if header["version"] != VERSION:
+        raise ValueError(f"unsupported snapshot version {header['version']}")
+    if header["kind"] != trade_class.__name__:
+        raise ValueError(f"snapshot holds {header['kind']}, not {trade_class.__name__}")
+    base = start + length
+    columns = {
+        field: np.frombuffer(buffer, dtype=column["dtype"], count=header["count"], offset=base + column["offset"])
+        for field, column in header["columns"].items()
+    }
+    return header, columns
+
+
+class MappedTrades:
+    """Mapping of id -> trade over a MappedTradeStore, caching the most recently decoded trades."""
+
+    def __init__(self, store, size=CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self.cache = OrderedDict()
+
+    def __getitem__(self, trade_id):
+        trade = self.store.added.get(trade_id)
+        if trade is not None:
+            return trade
+        trade = self.cache.get(trade_id)
+        if trade is not None:
+            self.cache.move_to_end(trade_id)
+            return trade
+        row = self.store.row_of(trade_id)
+        if row is None:
+            raise KeyError(trade_id)
+        return self.remember(self.store.decode([row])[0])
+
+    def remember(self, trade):
+        self.cache[trade.id] = trade
+        self.cache.move_to_end(trade.id)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return trade
+
+    def __contains__(self, trade_id):
+        return trade_id in self.store.added or self.store.row_of(trade_id) is not None
+
+    def __iter__(self):
+        yield from self.store.ids[self.store.alive].tolist()
+        yield from self.store.added
+
+    def __len__(self):
+        return len(self.store)
+
+    def values(self):
+        return iter(self.store)
+
+
+def decode_rows(trade_class, kinds, columns, strings, rows):
+    """Trade objects for `rows` of snapshot columns (id included) and their string tables."""
+    values = []
+    for field in TABLES[trade_class].fields:
+        column = columns[field][rows].tolist()
+        kind = kinds[field]
+        if kind == "TEXT":
+            table = strings[field]
+            values.append([table[code] for code in column])
+        elif kind == "REAL":
+            values.append([None if value != value else value for value in column])
+        else:
+            values.append([None if value == INT_MISSING else value for value in column])
+    return [trade_class(*row, id=trade_id) for row, trade_id in zip(zip(*values), columns["id"][rows].tolist())]
+
+
+class MappedTradeStore:
+    """A TradeStore over a binary snapshot; see the module docstring."""
+    paged = True
+
+    def __init__(self, trade_class, path):
+        self.trade_class = trade_class
+        self.spec = TABLES[trade_class]
+        self.path = path
+        with open(path, "rb") as f:
+            # Copy-on-write, so closes and edits can patch the columns without touching the file
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        header, self.columns = map_columns(self.map, trade_class)
+        self.kinds = column_kinds(trade_class)
+        self.strings = {field: column["strings"] for field, column in header["columns"].items() if "strings" in column}
+        # value -> code per text column, built the first time a value is written to it
+        self.codes = {}
+        self.ids = self.columns["id"]
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.count = len(self.ids)
+        self.seq = header["seq"]
+        self.next_id = header["next_id"]
+        # Trades added since the snapshot, by id; they have the highest ids
+        self.added = {}
+        self.trades = MappedTrades(self)
+        self.journal = None
+        self.listeners = []
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        rows = np.flatnonzero(self.alive)
+        for start in range(0, len(rows), DECODE_CHUNK):
+            yield from self.decode(rows[start:start + DECODE_CHUNK])
+        yield from list(self.added.values())
+
+    def __contains__(self, trade_id):
+        return trade_id in self.trades
+
+    def row_of(self, trade_id):
+        """Row of a trade in the snapshot columns, or None if it isn't there or was deleted."""
+        row = int(np.searchsorted(self.ids, trade_id))
+        if row < len(self.ids) and self.ids[row] == trade_id and self.alive[row]:
+            return row
+        return None
+
+    def decode(self, rows):
+        """Build trade objects for snapshot rows, a column at a time."""
+        return decode_rows(self.trade_class, self.kinds, self.columns, self.strings, rows)
+
+    def lookup(self, field, value):
+        """String table code of a text value, or None if no trade has it."""
+        codes = self.codes.get(field)
+        if codes is None:
+            codes = self.codes[field] = {value: code for code, value in enumerate(self.strings[field])}
+        return codes.get(value)
+
+    def code(self, field, value):
+        """String table code of a text value, adding the value to the table if it is new."""
+        code = self.lookup(field, value)
+        if code is None:
+            code = self.codes[field][value] = len(self.strings[field])
+            self.strings[field].append(value)
+        return code
+
+    def encode(self, field, value):
+        kind = self.kinds[field]
+        if kind == "TEXT":
+            return self.code(field, value)
+        if value is None:
+            return np.nan if kind == "REAL" else INT_MISSING
+        return value
+
+    def numbers(self, field):
+        """A numeric column as float64, NaN where the value is missing."""
+        column = self.columns[field]
+        if column.dtype.kind == "f":
+            return column
+        return np.where(column == INT_MISSING, np.nan, column.astype(np.float64))
+
+    def pl_column(self, price=None):
+        """Realized P/L of every snapshot row as in the trade classes' `pl`, NaN for open rows.
+
+        With `price` (a float64 column) the rows are valued at it instead, as in `unrealized_pl`.
+        """
+        columns = self.columns
+        if self.trade_class is EquityTrade:
+            price = columns["sell_price"] if price is None else price
+            return (price - columns["buy_price"]) * self.numbers("num_shares")
+        price = columns["close_price"] if price is None else price
+        return (price - columns["open_price"]) * (self.numbers("quantity") * 100) - columns["fee"]
+
+    def write(self, trade):
+        """Patch a snapshot trade's row with its current values; trades added since need nothing."""
+        row = self.row_of(trade.id)
+        if row is not None:
+            for field in self.spec.fields:
+                self.columns[field][row] = self.encode(field, getattr(trade, field))
+
+    def add(self, trade):
+        """Store a trade, assigning it the next id if it does not have one."""
+        if trade.id is None:
+            trade.id = self.next_id
+        self.next_id = max(self.next_id, trade.id + 1)
+        self.added[trade.id] = trade
+        self.count += 1
+        for listener in self.listeners:
+            listener.trade_added(trade)
+        self.log({"op": "add", "trade": trade.to_dict()})
+        return trade.id
+
+    def add_many(self, trades):
+        """Store a batch of trades, journaling them in one write. Returns their ids."""
+        journal, self.journal = self.journal, None
+        try:
+            trade_ids = [self.add(trade) for trade in trades]
+        finally:
+            self.journal = journal
+        if journal is not None and trade_ids:
+            journal.extend({"op": "add", "trade": self.added[trade_id].to_dict()} for trade_id in trade_ids)
+        return trade_ids
+
+    def get(self, trade_id):
+        return self.trades[trade_id]
+
+    def close(self, trade_id, *args):
+        trade = self._close(trade_id, args)
+        self.log({"op": "close", "id": trade_id, "args": list(args)})
+        return trade
+
+    def _close(self, trade_id, args):
+        trade = self.trades[trade_id]
+        trade.close(*args)
+        self.write(trade)
+        for listener in self.listeners:
+            listener.trade_closed(trade)
+        return trade
+
+    def update(self, trade_id, changes):
+        """Change fields of a trade in place; `changes` maps field names (not the id) to new values."""
+        trade = self._update(trade_id, changes)
+        self.log({"op": "edit", "id": trade_id, "changes": changes})
+        return trade
+
+    def _update(self, trade_id, changes):
+        trade = self.trades[trade_id]
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        for field, value in changes.items():
+            setattr(trade, field, value)
+        self.write(trade)
+        for listener in self.listeners:
+            listener.trade_added(trade)
+        return trade
+
+    def delete(self, trade_id):
+        trade = self._delete(trade_id)
+        self.log({"op": "delete", "id": trade_id})
+        return trade
+
+    def _delete(self, trade_id):
+        trade = self.trades[trade_id]
+        if self.added.pop(trade_id, None) is None:
+            self.alive[self.row_of(trade_id)] = False
+            self.trades.cache.pop(trade_id, None)
+        self.count -= 1
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        return trade
+
+    def log(self, event):
+        if self.journal is not None:
+            self.journal.append(event)
+
+    def apply(self, event):
+        """Replay a journaled event."""
+        op = event["op"]
+        if op == "add":
+            journal, self.journal = self.journal, None
+            try:
+                self.add(self.trade_class.from_dict(event["trade"]))
+            finally:
+                self.journal = journal
+        elif op == "close":
+            self._close(event["id"], event["args"])
+        elif op == "edit":
+            self._update(event["id"], event["changes"])
+        elif op == "delete":
+            self._delete(event["id"])
+        else:
+            raise ValueError(f"Unknown journal event: {op}")
+
+    def open_journal(self, journal_path, attach=True, sync_every=64):
+        """Replay the journal events newer than the snapshot and attach the journal; returns how many were replayed.
+
+        With attach=False the journal is only read, for the headless reports.
+        """
+        count = 0
+        for event in read_journal(journal_path):
+            if event["seq"] <= self.seq:
+                continue
+            try:
+                self.apply(event)
+            except KeyError:
+                log.warning("Skipping journal event %d for a trade missing from the snapshot.", event["seq"])
+            self.seq = event["seq"]
+            count += 1
+        if attach:
+            self.journal = Journal(journal_path, seq=self.seq, sync_every=sync_every)
+            self.journal.count = count
+        return count
+
+    def open_trades(self):
+        """Iterate the open trades, decoding only their rows."""
+        rows = np.flatnonzero(self.alive & np.isnan(self.columns[self.spec.open_column]))
+        cache = self.trades.cache
+        for start in range(0, len(rows), DECODE_CHUNK):
+            for trade in self.decode(rows[start:start + DECODE_CHUNK]):
+                # A cached trade is the live object the table shows, so prefer it to a fresh copy
+                yield cache.get(trade.id) or trade
+        yield from [trade for trade in self.added.values() if trade.is_open]
+
+    def page_ids(self, after_id=0, before_id=None, limit=500):
+        """Up to `limit` ids in id order with after_id < id < before_id; their trades are decoded when shown."""
+        start = int(np.searchsorted(self.ids, after_id, side="right"))
+        stop = len(self.ids) if before_id is None else int(np.searchsorted(self.ids, before_id))
+        ids = []
+        # Widen the window until it holds `limit` live rows, so a run of deletions can't stall paging
+        step = limit
+        while start < stop and len(ids) < limit:
+            end = min(stop, start + step)
+            window = self.ids[start:end][self.alive[start:end]]
+            ids.extend(window[:limit - len(ids)].tolist())
+            start, step = end, step * 2
+        if len(ids) < limit:
+            ids.extend(sorted(
+                trade_id for trade_id in self.added
+                if trade_id > after_id and (before_id is None or trade_id < before_id)
+            )[:limit - len(ids)])
+        return ids
+
+    def snapshot_columns(self):
+        """Copies of the live columns, with the trades added since appended, and the string tables."""
+        rows = np.flatnonzero(self.alive)
+        added = list(self.added.values())
+        columns = {}
+        for field, column in self.columns.items():
+            extra = [trade.id if field == "id" else self.encode(field, getattr(trade, field)) for trade in added]
+            columns[field] = np.concatenate([column[rows], np.array(extra, dtype=column.dtype)])
+        strings = {field: list(table) for field, table in self.strings.items()}
+        return columns, strings
+
+    def close_storage(self):
+        """Sync and close the journal; the map is released along with the columns."""
+        if self.journal is not None:
+            self.journal.close()
+
+
+class MappedIndex:
+    """The TradeIndex query interface, answered with NumPy over a MappedTradeStore's columns."""
+
+    def __init__(self, store):
+        self.store = store
+        self.spec = store.spec
+        self.date_fields = self.spec.date_fields
+        # field -> (table length, ordinal per string table entry)
+        self.ordinal_tables = {}
+
+    @property
+    def ordered_fields(self):
+        return set(self.spec.fields) | set(self.spec.expressions) | {"pl"}
+
+    def ordinals(self, field):
+        """Date ordinal of every snapshot row in a date column, -1 where there is no date."""
+        table = self.store.strings[field]
+        cached = self.ordinal_tables.get(field)
+        if cached is None or cached[0] != len(table):
+            ordinals = np.array([(date_ordinal(value) if value else None) or -1 for value in table], dtype=np.int64)
+            cached = self.ordinal_tables[field] = (len(table), ordinals)
+        return cached[1][self.store.columns[field]]
+
+    def query(self, symbol=None, type=None, status=None, date_field=None, date_from=None, date_to=None):
+        """Ids of the trades matching every given filter, in id order; None when no filter is set."""
+        store, spec = self.store, self.spec
+        low = date_ordinal(date_from) if date_from else None
+        high = date_ordinal(date_to) if date_to else None
+        if (date_from and low is None) or (date_to and high is None):
+            raise ValueError("Dates must look like YYYY-MM-DD")
+        if not (symbol or type or status in ("open", "closed") or date_from or date_to):
+            return None
+        symbol = symbol.strip().upper() if symbol else None
+        date_field = date_field or self.date_fields[0]
+
+        mask = store.alive.copy()
+        for field, value in ((spec.symbol_field, symbol), ("type", type)):
+            if value:
+                code = store.lookup(field, value)
+                mask &= False if code is None else store.columns[field] == code
+        if low is not None or high is not None:
+            ordinals = self.ordinals(date_field)
+            mask &= ordinals >= (1 if low is None else low)
+            if high is not None:
+                mask &= ordinals <= high
+        if status in ("open", "closed"):
+            is_open = np.isnan(store.columns[spec.open_column])
+            mask &= is_open if status == "open" else ~is_open
+
+        def matches(trade):
+            if symbol and trade.symbol != symbol:
+                return False
+            if type and trade.type != type:
+                return False
+            if low is not None or high is not None:
+                ordinal = date_ordinal(getattr(trade, date_field) or "")
+                if ordinal is None or (low is not None and ordinal < low) or (high is not None and ordinal > high):
+                    return False
+            return status not in ("open", "closed") or trade.is_open == (status == "open")
+
+        return store.ids[mask].tolist() + [trade_id for trade_id, trade in store.added.items() if matches(trade)]
+
+    def pl_keys(self, trades, marks=None, trade_marks=None):
+        """P/L sort keys for the snapshot rows and for `trades`.
+
+        Closed trades have their realized P/L, open ones their P/L at `marks`
+        (symbol -> price) or `trade_marks` (id -> price), or NaN unmarked.
+        """
+        store, spec = self.store, self.spec
+        closed = store.columns[spec.open_column]
+        price = np.full(len(closed), np.nan)
+        if marks:
+            table = np.full(len(store.strings[spec.symbol_field]), np.nan)
+            for symbol, mark in marks.items():
+                code = store.lookup(spec.symbol_field, symbol)
+                if code is not None:
+                    table[code] = mark
+            price = table[store.columns[spec.symbol_field]]
+        elif trade_marks and len(store.ids):
+            ids = np.fromiter(trade_marks, dtype=np.int64, count=len(trade_marks))
+            values = np.fromiter(trade_marks.values(), dtype=np.float64, count=len(trade_marks))
+            rows = np.minimum(np.searchsorted(store.ids, ids), len(store.ids) - 1)
+            found = store.ids[rows] == ids
+            price[rows[found]] = values[found]
+        keys = store.pl_column(np.where(np.isnan(closed), price, closed))
+        extra = []
+        for trade in trades:
+            mark = marks.get(trade.symbol) if marks else (trade_marks or {}).get(trade.id)
+            extra.append(trade.pl if not trade.is_open else None if mark is None else trade.unrealized_pl(mark))
+        return keys, extra
+
+    def sort_keys(self, field, trades, marks=None, trade_marks=None):
+        """Numeric sort keys for the snapshot rows and for `trades`, NaN where the value is missing."""
+        store = self.store
+        if field == "pl":
+            keys, extra = self.pl_keys(trades, marks, trade_marks)
+        elif field in self.date_fields:
+            keys = self.ordinals(field).astype(np.float64)
+            keys[keys < 0] = np.nan
+            extra = [date_ordinal(getattr(trade, field) or "") for trade in trades]
+        elif store.kinds.get(field) == "TEXT":
+            for trade in trades:
+                store.code(field, getattr(trade, field))
+            table = store.strings[field]
+            # Rank every table entry by its text; code 0 (missing) has no rank
+            ranks = np.full(len(table), np.nan)
+            order = sorted(range(1, len(table)), key=table.__getitem__)
+            ranks[order] = np.arange(len(order))
+            keys = ranks[store.columns[field]]
+            extra = [ranks[store.code(field, getattr(trade, field))] for trade in trades]
+        elif field in self.spec.expressions:
+            # notional, the only derived sort key
+            keys = store.columns["buy_price"] * store.numbers("num_shares")
+            extra = [trade.notional for trade in trades]
+        else:
+            keys = store.numbers(field)
+            extra = [getattr(trade, field) for trade in trades]
+        extra = np.array([np.nan if value is None else value for value in extra], dtype=np.float64)
+        return keys, extra
+
+    def ordered(self, field, trade_ids=None, reverse=False, marks=None, trade_marks=None):
+        """Ids ordered by a column or derived sort key, missing values last, restricted to `trade_ids` if given.
+
+        "pl" sorts closed trades by their realized P/L and open ones by their
+        P/L at `marks` (symbol -> price) or `trade_marks` (id -> price).
+        """
+        store = self.store
+        added = list(store.added.values())
+        keys, extra = self.sort_keys(field, added, marks, trade_marks)
+        rows = np.flatnonzero(store.alive)
+        keys = np.concatenate([keys[rows], extra])
+        ids = np.concatenate([store.ids[rows], np.array([trade.id for trade in added], dtype=np.int64)])
+        missing = np.isnan(keys)
+        # lexsort's last key is the primary one: present before missing, then the key, then the id
+        order = np.lexsort((ids, -keys if reverse else keys, missing))
+        ids = ids[order]
+        if trade_ids is not None:
+            ids = ids[np.isin(ids, np.asarray(trade_ids, dtype=np.int64))]
+        return ids.tolist()
@@ -0,0 +1,15 @@
+import os
+
+# Set a proper path to save file
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EQUITY_SAVE_FILE = os.path.join(SCRIPT_DIR, "./../.etrades.json")
+OPTION_SAVE_FILE = os.path.join(SCRIPT_DIR, "./../.otrades.json")
+EQUITY_SNAPSHOT_FILE = os.path.join(SCRIPT_DIR, "./../.etrades.bin")
+OPTION_SNAPSHOT_FILE = os.path.join(SCRIPT_DIR, "./../.otrades.bin")
+EQUITY_JOURNAL_FILE = os.path.join(SCRIPT_DIR, "./../.etrades.journal")
+OPTION_JOURNAL_FILE = os.path.join(SCRIPT_DIR, "./../.otrades.journal")
+DATABASE_FILE = os.path.join(SCRIPT_DIR, "./../.trades.db")
+PROFILE_DIR = os.path.join(SCRIPT_DIR, "./../profiles")
+EXPORT_DIR = os.path.join(SCRIPT_DIR, "./../exports")
+# Index of the named accounts; each account other than the default keeps its books in a directory beside it
+ACCOUNTS_FILE = os.path.join(SCRIPT_DIR, "./../accounts/accounts.json")
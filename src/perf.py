@@ -0,0 +1,151 @@
+"""Lightweight timers and counters for the hot paths, plus on-demand profiling.
+
+Code is instrumented with `with perf.span("close_position"):` or by
+decorating a function with `@perf.timed("add_trades")`. While recording is
+off (the default) a span is a shared no-op object and a timed function costs
+one flag check on top of the call, so the hooks stay in place permanently.
+While it is on, the last WINDOW durations of each span are kept and
+percentiles() summarizes them; count() keeps plain counters.
+
+profile_next(name) runs the next `name` span under cProfile and dumps the
+stats to a .prof file, for `python -m pstats` or snakeviz.
+
+Set OPTIONS_PERF=1 in the environment to record from startup.
+"""
+import cProfile
+import logging
+import os
+import time
+from collections import deque
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+# Durations kept per span name
+WINDOW = 1000
+
+enabled = os.environ.get("OPTIONS_PERF", "") not in ("", "0")
+timings = {}
+counters = {}
+# Span name -> .prof path for the next run of that span
+armed = {}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def record(name, seconds):
+    """Add a duration measured elsewhere (a frame, a background save) to `name`."""
+    if not enabled:
+        return
+    samples = timings.get(name)
+    if samples is None:
+        samples = timings[name] = deque(maxlen=WINDOW)
+    samples.append(seconds)
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+class Span:
+    """Times one run of a named section, profiling it if profile_next() armed it."""
+    __slots__ = ("name", "start", "profiler", "path")
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+        self.path = armed.pop(name, None)
+
+    def __enter__(self):
+        if self.path is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
+            log.info("Profile of %s written to %s", self.name, self.path)
+        return False
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    """Context manager timing a section under `name`."""
+    if not (enabled or armed):
+        return NULL_SPAN
+    return Span(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function under `name`."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not (enabled or armed):
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def profile_next(name, directory):
+    """Profile the next run of span `name` into a timestamped .prof file in `directory`; returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    armed[name] = path
+    log.info("Profiling the next %s into %s", name, path)
+    return path
+
+
+def percentiles(name, quantiles=(0.5, 0.95, 0.99)):
+    """The given quantiles and the maximum of span `name`, in seconds, or None if it has no samples."""
+    samples = timings.get(name)
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    picks = [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles]
+    return picks + [ordered[-1]]
+
+
+def last(name):
+    samples = timings.get(name)
+    return samples[-1] if samples else None
+
+
+def summary():
+    """One line per span: count and p50/p95/p99/max in milliseconds, slowest p95 first."""
+    lines = []
+    for name in timings:
+        p50, p95, p99, worst = percentiles(name)
+        lines.append((p95, f"{name}: n={len(timings[name])} p50={p50 * 1000:.1f} p95={p95 * 1000:.1f} "
+                           f"p99={p99 * 1000:.1f} max={worst * 1000:.1f} ms"))
+    lines.sort(reverse=True)
+    lines = [line for _, line in lines]
+    lines += [f"{name}: {value:,}" for name, value in sorted(counters.items())]
+    return lines
+
+
+def reset():
+    timings.clear()
+    counters.clear()
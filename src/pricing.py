@@ -0,0 +1,443 @@
+"""Vectorized Black-Scholes implied volatility and Greeks for the option book.
+
+Every open position is priced in one NumPy batch: implied volatility comes
+from a safeguarded Newton solver run on all contracts at once (falling back to
+bisection inside a per-contract bracket), and delta, gamma, theta and vega are
+computed from the same intermediate arrays.
+
+scenario_grid() values a set of legs over a grid of underlier prices and
+future dates in one broadcast, for payoff diagrams.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from store import date_ordinal
+
+RISK_FREE_RATE = 0.04
+DAYS_PER_YEAR = 365.0
+
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+IV_TOLERANCE = 1e-6
+IV_MAX_ITERATIONS = 50
+
+SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+# Volatility for scenario legs whose implied vol didn't solve, when no other leg on the underlier did either
+DEFAULT_SCENARIO_VOL = 0.3
+# Implied vols are rounded to this before legs on the same contract are merged
+MERGE_VOL_STEP = 0.01
+
+# Arrays of option legs for scenario_grid(); cost is what was paid to open them, fees included
+Legs = namedtuple("Legs", ["strike", "years", "is_call", "iv", "contracts", "cost"])
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x):
+    """Standard normal CDF (Abramowitz & Stegun 26.2.17, |error| < 7.5e-8)."""
+    t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = norm_pdf(x) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def norm_cdf_into(x, out, scratch):
+    """norm_cdf(x) written into `out`, in place, with `scratch` as a same-shaped work buffer."""
+    np.abs(x, out=scratch)
+    scratch *= 0.2316419
+    scratch += 1.0
+    np.reciprocal(scratch, out=scratch)
+    out.fill(1.330274429)
+    for coefficient in (-1.821255978, 1.781477937, -0.356563782, 0.319381530):
+        out *= scratch
+        out += coefficient
+    out *= scratch
+    np.multiply(x, x, out=scratch)
+    scratch *= -0.5
+    np.exp(scratch, out=scratch)
+    scratch /= SQRT_2PI
+    out *= scratch
+    np.subtract(1.0, out, out=scratch)
+    np.copyto(out, scratch, where=x >= 0)
+    return out
+
+
+def _d1_d2(spot, strike, years, vol, rate):
+    vol_sqrt_t = vol * np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * years) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t
+
+
+def bs_price(spot, strike, years, vol, is_call, rate=RISK_FREE_RATE):
+    """Black-Scholes price per share for arrays of contracts."""
+    d1, d2 = _d1_d2(spot, strike, years, vol, rate)
+    discount = np.exp(-rate * years)
+    call = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def implied_vol(price, spot, strike, years, is_call, rate=RISK_FREE_RATE):
+    """Solve for the volatility that reproduces `price`, for every contract at once.
+
+    Contracts whose price is outside the no-arbitrage bounds, or that have
+    already expired, get NaN.
+    """
+    price, spot, strike, years = (np.asarray(a, dtype=float) for a in (price, spot, strike, years))
+    is_call = np.asarray(is_call, dtype=bool)
+
+    discount = np.exp(-rate * np.maximum(years, 0.0))
+    lower = np.where(is_call, np.maximum(spot - strike * discount, 0.0), np.maximum(strike * discount - spot, 0.0))
+    upper = np.where(is_call, spot, strike * discount)
+    valid = (years > 0) & (spot > 0) & (strike > 0) & (price > lower) & (price < upper)
+
+    # Everything that doesn't depend on vol is computed once, outside the solver loop
+    idx = np.flatnonzero(valid)
+    s, k, c, target = spot[idx], strike[idx], is_call[idx], price[idx]
+    t = years[idx]
+    sqrt_t = np.sqrt(t)
+    k_discount = k * discount[idx]
+    log_forward = np.log(s / k) + rate * t
+    # Puts are solved as the call with the same strike, via put-call parity
+    target = np.where(c, target, target + s - k_discount)
+
+    # Corrado-Miller closed-form approximation as the starting point
+    half_moneyness = 0.5 * (s - k_discount)
+    excess = target - half_moneyness
+    with np.errstate(invalid="ignore"):
+        guess = np.sqrt(2.0 * np.pi / t) / (s + k_discount) * (
+            excess + np.sqrt(np.maximum(excess * excess - 4.0 * half_moneyness * half_moneyness / np.pi, 0.0))
+        )
+    vol = np.where(np.isfinite(guess), np.clip(guess, 0.05, 2.0), 0.3)
+    low = np.full(idx.shape, MIN_VOL)
+    high = np.full(idx.shape, MAX_VOL)
+    active = np.arange(idx.size)
+
+    for _ in range(IV_MAX_ITERATIONS):
+        if not active.size:
+            break
+        v = vol[active]
+        st = sqrt_t[active]
+        vol_sqrt_t = v * st
+        d1 = (log_forward[active] + 0.5 * v * v * t[active]) / vol_sqrt_t
+        diff = s[active] * norm_cdf(d1) - k_discount[active] * norm_cdf(d1 - vol_sqrt_t) - target[active]
+        vega = s[active] * norm_pdf(d1) * st
+
+        # Shrink the bracket around the root, then take a Newton step, bisecting
+        # wherever the step would leave the bracket or vega is too flat to trust
+        too_high = diff > 0
+        lo = np.where(too_high, low[active], v)
+        hi = np.where(too_high, v, high[active])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = v - diff / vega
+        bisect = (vega < 1e-10) | ~(step > lo) | ~(step < hi)
+        new_vol = np.where(bisect, 0.5 * (lo + hi), step)
+
+        vol[active] = new_vol
+        low[active] = lo
+        high[active] = hi
+        active = active[(np.abs(new_vol - v) >= IV_TOLERANCE) & (hi - lo >= IV_TOLERANCE)]
+
+    result = np.full(price.shape, np.nan)
+    result[idx] = vol
+    return result
+
+
+def greeks(spot, strike, years, vol, is_call, rate=RISK_FREE_RATE):
+    """Per-share delta, gamma, theta (per day) and vega (per vol point)."""
+    d1, d2 = _d1_d2(spot, strike, years, vol, rate)
+    pdf_d1 = norm_pdf(d1)
+    sqrt_t = np.sqrt(years)
+    discount = np.exp(-rate * years)
+
+    cdf_d1 = norm_cdf(d1)
+    cdf_d2 = norm_cdf(d2)
+
+    delta = np.where(is_call, cdf_d1, cdf_d1 - 1.0)
+    gamma = pdf_d1 / (spot * vol * sqrt_t)
+    decay = -spot * pdf_d1 * vol / (2.0 * sqrt_t)
+    carry = rate * strike * discount
+    theta = (decay - np.where(is_call, carry * cdf_d2, carry * (cdf_d2 - 1.0))) / DAYS_PER_YEAR
+    vega = spot * pdf_d1 * sqrt_t / 100.0
+    return delta, gamma, theta, vega
+
+
+def intrinsic(spot, strike, is_call):
+    return np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+
+
+def merge_legs(legs):
+    """Combine legs on the same contract at (to MERGE_VOL_STEP) the same implied vol into one.
+
+    A book rarely has more than a few dozen distinct contracts per underlier,
+    however many trades it holds, so this shrinks the scenario grid's last
+    axis from trades to contracts. The merged vol is the contract-weighted
+    mean of the legs', so it moves the value by at most half a vol step of vega.
+    """
+    keys = np.stack([legs.strike, legs.years, legs.is_call.astype(float), np.round(legs.iv / MERGE_VOL_STEP)], axis=1)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    weight = np.abs(legs.contracts)
+    weight_sum = np.bincount(inverse, weights=weight, minlength=len(unique))
+    iv = np.bincount(inverse, weights=legs.iv * weight, minlength=len(unique))
+    iv = np.divide(iv, weight_sum, out=unique[:, 3] * MERGE_VOL_STEP, where=weight_sum > 0)
+    return Legs(
+        unique[:, 0], unique[:, 1], unique[:, 2].astype(bool), iv,
+        np.bincount(inverse, weights=legs.contracts, minlength=len(unique)), float(np.sum(legs.cost))
+    )
+
+
+def scenario_grid(legs, prices, days, rate=RISK_FREE_RATE):
+    """P/L of `legs` across underlier `prices`, at expiry and `days` days from now.
+
+    Returns (expiry_pl, value_pl): expiry_pl[p] holds every leg at its own
+    expiry (intrinsic value) with the underlier at prices[p], and
+    value_pl[d, p] the Black-Scholes value days[d] from now, legs that have
+    expired by then counting at intrinsic value.
+
+    Each date is one prices x legs broadcast, worked in place in float32
+    buffers that are reused from date to date: a chart needs nowhere near
+    float64 precision, and the grid stays in cache instead of allocating a
+    fresh temporary for every operation.
+    """
+    prices = np.asarray(prices, dtype=float)
+    days = np.asarray(days, dtype=float)
+    strike, years, is_call, iv, contracts, cost = legs
+    cost = float(np.sum(cost))
+    spot = prices[:, None]
+
+    payoff = intrinsic(spot, strike, is_call)
+    expiry_pl = payoff @ contracts - cost
+
+    value_pl = np.empty((days.size, prices.size))
+    log_moneyness = np.log(spot / strike).astype(np.float32)
+    payoff = payoff.astype(np.float32)
+    spot = spot.astype(np.float32)
+    weights = contracts.astype(np.float32)
+    d1, value, other, scratch = (np.empty(log_moneyness.shape, dtype=np.float32) for _ in range(4))
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for row, day in enumerate(days):
+            left = years - day / DAYS_PER_YEAR
+            live = left > 0
+            t = np.where(live, left, 1.0)
+            vol_sqrt_t = (iv * np.sqrt(t)).astype(np.float32)
+            strike_discount = (strike * np.exp(-rate * t)).astype(np.float32)
+
+            np.add(log_moneyness, ((rate + 0.5 * iv * iv) * t).astype(np.float32), out=d1)
+            d1 /= vol_sqrt_t
+            norm_cdf_into(d1, value, scratch)
+            value *= spot
+            d1 -= vol_sqrt_t
+            norm_cdf_into(d1, other, scratch)
+            other *= strike_discount
+            value -= other  # call
+            # Puts from calls by put-call parity
+            np.subtract(value, spot, out=other)
+            other += strike_discount
+            np.copyto(value, other, where=~is_call)
+            np.copyto(value, payoff, where=~live)
+            value_pl[row] = value @ weights
+    value_pl -= cost
+    return expiry_pl, value_pl
+
+
+def contracts_of(trades, today):
+    """Lists of ids, underliers, spot, strike, years, is_call, price, quantity and cost of the open, priceable trades."""
+    ids, underliers, spot, strike, years, is_call, price, quantity, cost = [], [], [], [], [], [], [], [], []
+    for trade in trades:
+        if not trade.is_open or trade.type not in ("CALL", "PUT"):
+            continue
+        expiry = date_ordinal(trade.expiry) if trade.expiry else None
+        if expiry is None or None in (trade.underlier_price, trade.strike, trade.premium, trade.quantity):
+            continue
+        ids.append(trade.id)
+        underliers.append(trade.underlier)
+        spot.append(trade.underlier_price)
+        strike.append(trade.strike)
+        years.append((expiry - today) / DAYS_PER_YEAR)
+        is_call.append(trade.type == "CALL")
+        price.append(trade.premium)
+        quantity.append(trade.quantity)
+        open_price = trade.premium if trade.open_price is None else trade.open_price
+        cost.append(open_price * trade.quantity * 100.0 + (trade.fee or 0.0))
+    return ids, underliers, spot, strike, years, is_call, price, quantity, cost
+
+
+def snapshot_contracts(store, today):
+    """contracts_of() for the snapshot rows of a MappedTradeStore, read straight from its columns."""
+    columns, strings = store.columns, store.strings
+    types = strings["type"]
+    call_codes = [code for code, value in enumerate(types) if value == "CALL"]
+    put_codes = [code for code, value in enumerate(types) if value == "PUT"]
+    type_code = columns["type"]
+    is_call = np.isin(type_code, call_codes)
+    expiry_of = np.array([-1 if value is None else (date_ordinal(value) or -1) for value in strings["expiry"]],
+                         dtype=np.int64)
+    expiry = expiry_of[columns["expiry"]]
+    quantity = store.numbers("quantity")
+    spot, strike, premium = columns["underlier_price"], columns["strike"], columns["premium"]
+    keep = (store.alive & np.isnan(columns["close_price"]) & (is_call | np.isin(type_code, put_codes))
+            & (expiry >= 0) & ~np.isnan(spot) & ~np.isnan(strike) & ~np.isnan(premium) & ~np.isnan(quantity))
+    rows = np.flatnonzero(keep)
+    open_price = columns["open_price"][rows]
+    open_price = np.where(np.isnan(open_price), premium[rows], open_price)
+    cost = open_price * quantity[rows] * 100.0 + np.nan_to_num(columns["fee"][rows])
+    underliers = np.array(strings["underlier"], dtype=object)[columns["underlier"][rows]]
+    return (store.ids[rows], underliers, spot[rows], strike[rows], (expiry[rows] - today) / DAYS_PER_YEAR,
+            is_call[rows], premium[rows], quantity[rows], cost)
+
+
+class GreeksBook:
+    """Column arrays for the open option positions, priced in one batch.
+
+    load() gathers the static columns once; set_spot() updates the underlier
+    price for every contract on one underlier, so a price refresh only has to
+    reprice, not rebuild the arrays. Implied vol is solved against the
+    underlier price the premium was quoted at; the Greeks and the model value
+    use the current one.
+    """
+    columns = ("iv", "delta", "gamma", "theta", "vega")
+
+    def __init__(self, rate=RISK_FREE_RATE):
+        self.rate = rate
+        self.ids = []
+        self.row_of = {}
+        self.underliers = []
+        self.code_of = {}
+        self.results = {}
+
+    def load(self, trades, today):
+        """Collect the open, priceable contracts from an iterable of OptionTrade.
+
+        A MappedTradeStore is read from its columns instead, so only the trades
+        added since its snapshot are walked one by one.
+        """
+        today = today.toordinal()
+        if getattr(trades, "columns", None) is not None:
+            parts = [snapshot_contracts(trades, today), contracts_of(trades.added.values(), today)]
+        else:
+            parts = [contracts_of(trades, today)]
+        ids, underliers, spot, strike, years, is_call, price, quantity, cost = (
+            np.concatenate([np.asarray(part[field]) for part in parts]) for field in range(9)
+        )
+        ids = ids.astype(np.int64).tolist()
+
+        self.ids = ids
+        self.row_of = {trade_id: row for row, trade_id in enumerate(ids)}
+        underliers = underliers.tolist()
+        self.underliers = sorted(set(underliers))
+        self.code_of = {underlier: code for code, underlier in enumerate(self.underliers)}
+        self.underlier_code = np.array([self.code_of[underlier] for underlier in underliers], dtype=np.intp)
+        # Row numbers of each underlier's contracts, so a price tick only touches its own rows
+        order = np.argsort(self.underlier_code, kind="stable")
+        self.rows_of_code = np.split(order, np.cumsum(np.bincount(self.underlier_code, minlength=len(self.underliers)))[:-1])
+        self.entry_spot = spot.astype(float)
+        self.spot = self.entry_spot.copy()
+        self.strike = strike.astype(float)
+        self.years = years.astype(float)
+        self.is_call = is_call.astype(bool)
+        self.price = price.astype(float)
+        self.contracts = quantity.astype(float) * 100.0
+        self.cost = cost.astype(float)
+        self.results = {}
+
+    def set_spot(self, underlier, price):
+        """Move every contract on `underlier` to a new underlier price."""
+        code = self.code_of.get(underlier)
+        if code is not None:
+            self.spot[self.rows_of_code[code]] = price
+
+    def compute(self):
+        """Reprice the whole book: implied vol first, then the Greeks and model value at that vol."""
+        iv = implied_vol(self.price, self.entry_spot, self.strike, self.years, self.is_call, self.rate)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta, gamma, theta, vega = greeks(self.spot, self.strike, self.years, iv, self.is_call, self.rate)
+            value = bs_price(self.spot, self.strike, self.years, iv, self.is_call, self.rate)
+        self.results = {"iv": iv, "delta": delta, "gamma": gamma, "theta": theta, "vega": vega, "value": value}
+        return self.results
+
+    def rows_on(self, underliers):
+        """Array of the rows of the contracts on `underliers`, or None if there are none."""
+        codes = [self.code_of[u] for u in underliers if u in self.code_of]
+        if not codes:
+            return None
+        return np.concatenate([self.rows_of_code[code] for code in codes])
+
+    def ids_on(self, underliers):
+        """Ids of the contracts on `underliers`."""
+        rows = self.rows_on(underliers)
+        return [] if rows is None else [self.ids[row] for row in rows.tolist()]
+
+    def reprice(self, underliers):
+        """Recompute the Greeks and model value of the contracts on `underliers` at their current spot.
+
+        Implied vol is left as compute() solved it, so this is a handful of array
+        operations over just those rows. Returns the ids of the repriced trades.
+        """
+        rows = self.rows_on(underliers)
+        if rows is None or not self.results:
+            return []
+        spot, strike, years, is_call = self.spot[rows], self.strike[rows], self.years[rows], self.is_call[rows]
+        iv = self.results["iv"][rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            repriced = greeks(spot, strike, years, iv, is_call, self.rate)
+            value = bs_price(spot, strike, years, iv, is_call, self.rate)
+        for column, values in zip(self.columns[1:], repriced):
+            self.results[column][rows] = values
+        self.results["value"][rows] = value
+        return [self.ids[row] for row in rows.tolist()]
+
+    def spot_of(self, underlier):
+        """Current underlier price of `underlier`'s contracts (their average entry price until it is marked)."""
+        rows = self.rows_on([underlier])
+        return None if rows is None else float(np.mean(self.spot[rows]))
+
+    def legs(self, underlier):
+        """Merged Legs of the open contracts on `underlier` for scenario_grid(), or None if it has none.
+
+        Implied vols come from the last compute(); a contract whose vol didn't
+        solve takes the average of the others on its underlier.
+        """
+        rows = self.rows_on([underlier])
+        if rows is None or not self.results:
+            return None
+        iv = self.results["iv"][rows]
+        solved = np.isfinite(iv)
+        fallback = float(np.mean(iv[solved])) if solved.any() else DEFAULT_SCENARIO_VOL
+        return merge_legs(Legs(
+            self.strike[rows], self.years[rows], self.is_call[rows], np.where(solved, iv, fallback),
+            self.contracts[rows], self.cost[rows]
+        ))
+
+    def row(self, trade_id):
+        """Return (iv, delta, gamma, theta, vega) for one contract, or None if it isn't priced."""
+        row = self.row_of.get(trade_id)
+        if row is None or not self.results:
+            return None
+        return tuple(float(self.results[column][row]) for column in self.columns)
+
+    def value(self, trade_id):
+        """Model value per share of one contract at the current underlier price, or None."""
+        row = self.row_of.get(trade_id)
+        if row is None or not self.results:
+            return None
+        value = float(self.results["value"][row])
+        return None if value != value else value
+
+    def totals(self):
+        """Position-weighted delta, gamma, theta and vega summed per underlier."""
+        if not self.results:
+            return {}
+        totals = {}
+        sums = [
+            np.bincount(self.underlier_code, weights=np.nan_to_num(self.results[column]) * self.contracts,
+                        minlength=len(self.underliers))
+            for column in self.columns[1:]
+        ]
+        for code, underlier in enumerate(self.underliers):
+            totals[underlier] = tuple(float(column_sum[code]) for column_sum in sums)
+        return totals
@@ -0,0 +1,474 @@
+"""Headless P/L reports over the saved books, without importing Kivy.
+
+    python src/main.py summary [--marks marks.csv] [--json]
+    python src/main.py export summary.csv [--marks marks.csv]
+    python src/main.py migrate
+    python src/main.py risk [--marks marks.csv] [--paths 100000] [--horizon 10]
+    python src/main.py realized [--year 2024] [--json]
+    python src/main.py import-json
+    python src/main.py export-json
+    python src/main.py accounts [--refresh] [--json]
+    python src/main.py export-trades trades.csv [--format csv|jsonl|columnar] [--book equity|option|both]
+        [--symbol AAPL] [--status open|closed] [--date-field sell_date] [--from 2024-01-01] [--to 2024-12-31]
+
+(Every command takes `--account NAME` to work on a named account's books
+instead of the default ones. `accounts` prints each account's totals and
+the totals across accounts from the account index without opening any
+book; `--refresh` opens every book to bring those totals up to date first.
+`migrate` copies the books into the SQLite database once; from then on
+the app and these reports use the database. `risk` runs the Monte Carlo
+simulation in risk.py over the open positions. `realized` reports the
+equity gains realized in a tax year, short- and long-term, with the losses
+that wash sales disallow (see lots.py). `import-json` writes the
+binary snapshots of mapstore.py from the JSON books, and `export-json`
+writes the JSON books back from the binary snapshots. `export-trades`
+streams the trades themselves, filtered, through export.py; with both
+books each goes to its own file, `trades-equity.csv` and
+`trades-option.csv`.)
+
+(`python -m report ...` from inside src/ works too.) Marks files are
+`SYMBOL,PRICE` lines; with marks, open equity positions are valued at the
+mark and open options at their Black-Scholes value with the underlier at
+the mark, giving unrealized P/L alongside realized.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import sys
+from datetime import date
+
+from accounts import DEFAULT_ACCOUNT, AccountFiles, AccountIndex, BookFiles, describe
+from journal import open_book
+from paths import (
+    ACCOUNTS_FILE, DATABASE_FILE, EQUITY_JOURNAL_FILE, EQUITY_SAVE_FILE, EQUITY_SNAPSHOT_FILE, OPTION_JOURNAL_FILE, OPTION_SAVE_FILE,
+    OPTION_SNAPSHOT_FILE
+)
+from store import EquityTrade, OptionTrade, TradeStore
+
+log = logging.getLogger(__name__)
+
+COMMANDS = ("summary", "export", "migrate", "risk", "realized", "import-json", "export-json", "export-trades", "accounts")
+
+
+def load_store(trade_class, snapshot_path, journal_path, database_path=None, binary_path=None):
+    """Read a book from the database if there is one, else from its binary or JSON snapshot and journal read-only."""
+    if database_path and os.path.exists(database_path):
+        from sqlstore import SqliteTradeStore
+        return SqliteTradeStore(trade_class, database_path)
+    if binary_path and os.path.exists(binary_path):
+        from mapstore import MappedTradeStore
+        store = MappedTradeStore(trade_class, binary_path)
+        store.open_journal(journal_path, attach=False)
+        return store
+    store = TradeStore(trade_class)
+    open_book(store, snapshot_path, journal_path, attach=False)
+    return store
+
+
+def load_books(args, database=True):
+    """The equity and option stores named by the command line; database=False skips the SQLite database."""
+    database_path = args.database if database else None
+    return (
+        load_store(EquityTrade, args.equity_file, args.equity_journal, database_path, args.equity_snapshot),
+        load_store(OptionTrade, args.option_file, args.option_journal, database_path, args.option_snapshot),
+    )
+
+
+def read_marks(path):
+    """Read `SYMBOL,PRICE` lines into a dict."""
+    marks = {}
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip() or row[0].startswith("#"):
+                continue
+            try:
+                marks[row[0].strip().upper()] = float(row[1])
+            except ValueError:
+                continue  # header line
+    return marks
+
+
+def marked_greeks(store, marks, today):
+    """A computed GreeksBook of the open options, with the underliers in `marks` moved to their mark."""
+    # NumPy is only needed once there are options to value
+    from pricing import GreeksBook
+
+    greeks = GreeksBook()
+    greeks.load(store, today)
+    for underlier, price in marks.items():
+        greeks.set_spot(underlier, price)
+    greeks.compute()
+    return greeks
+
+
+def option_marks(store, marks, today):
+    """Model value per share for each open option whose underlier has a mark.
+
+    Contracts on unmarked underliers, and those whose implied vol didn't
+    solve, are left out, as the GUI leaves them unmarked.
+    """
+    greeks = marked_greeks(store, marks, today)
+    values = {trade_id: greeks.value(trade_id) for trade_id in greeks.ids_on(marks)}
+    return {trade_id: value for trade_id, value in values.items() if value is not None and math.isfinite(value)}
+
+
+def summarize(store, marks=None, trade_marks=None):
+    """Realized and unrealized P/L for one book, overall and per symbol.
+
+    `marks` maps symbols to prices for equities; `trade_marks` maps trade ids
+    to option values. Unrealized P/L is None where nothing could be marked.
+    """
+    by_symbol = {}
+    totals = {"trades": 0, "open": 0, "realized_pl": 0.0, "unrealized_pl": None if marks is None else 0.0}
+    for trade in store:
+        symbol = by_symbol.setdefault(trade.symbol, {"trades": 0, "open": 0, "realized_pl": 0.0, "unrealized_pl": None})
+        for bucket in (totals, symbol):
+            bucket["trades"] += 1
+
+        if not trade.is_open:
+            pl = trade.pl or 0.0
+            totals["realized_pl"] += pl
+            symbol["realized_pl"] += pl
+            continue
+
+        totals["open"] += 1
+        symbol["open"] += 1
+        if marks is None:
+            continue
+        mark = trade_marks.get(trade.id) if trade_marks is not None else marks.get(trade.symbol)
+        pl = trade.unrealized_pl(mark) if mark is not None else None
+        if pl is not None:
+            totals["unrealized_pl"] += pl
+            symbol["unrealized_pl"] = (symbol["unrealized_pl"] or 0.0) + pl
+
+    totals["by_symbol"] = by_symbol
+    return totals
+
+
+def build_report(args):
+    equities, options = load_books(args)
+
+    marks = read_marks(args.marks) if args.marks else None
+    trade_marks = option_marks(options, marks, date.today()) if marks else None
+    return {
+        "equity": summarize(equities, marks),
+        "option": summarize(options, marks, trade_marks),
+    }
+
+
+def format_pl(value):
+    return "-" if value is None else f"{value:,.2f}"
+
+
+def print_summary(report, out):
+    for book, summary in report.items():
+        out.write(
+            f"{book.title()} trades: {summary['trades']} ({summary['open']} open)  "
+            f"realized P/L {format_pl(summary['realized_pl'])}  "
+            f"unrealized P/L {format_pl(summary['unrealized_pl'])}\n"
+        )
+        for symbol, row in sorted(summary["by_symbol"].items()):
+            out.write(
+                f"  {symbol:<8} {row['trades']:>7} trades {row['open']:>6} open  "
+                f"realized {format_pl(row['realized_pl']):>14}  unrealized {format_pl(row['unrealized_pl']):>14}\n"
+            )
+
+
+def write_csv(report, out):
+    writer = csv.writer(out)
+    writer.writerow(["book", "symbol", "trades", "open", "realized_pl", "unrealized_pl"])
+    for book, summary in report.items():
+        for symbol, row in sorted(summary["by_symbol"].items()):
+            writer.writerow([
+                book, symbol, row["trades"], row["open"], f"{row['realized_pl']:.2f}",
+                "" if row["unrealized_pl"] is None else f"{row['unrealized_pl']:.2f}"
+            ])
+        writer.writerow([
+            book, "TOTAL", summary["trades"], summary["open"], f"{summary['realized_pl']:.2f}",
+            "" if summary["unrealized_pl"] is None else f"{summary['unrealized_pl']:.2f}"
+        ])
+
+
+def build_parser():
+    books = argparse.ArgumentParser(add_help=False)
+    books.add_argument("--equity-file", default=EQUITY_SAVE_FILE)
+    books.add_argument("--equity-journal", default=EQUITY_JOURNAL_FILE)
+    books.add_argument("--option-file", default=OPTION_SAVE_FILE)
+    books.add_argument("--option-journal", default=OPTION_JOURNAL_FILE)
+    books.add_argument("--equity-snapshot", default=EQUITY_SNAPSHOT_FILE, help="binary snapshot, used instead of the JSON file if it exists")
+    books.add_argument("--option-snapshot", default=OPTION_SNAPSHOT_FILE, help="binary snapshot, used instead of the JSON file if it exists")
+    books.add_argument("--database", default=DATABASE_FILE, help="SQLite database, used instead of the files if it exists")
+    books.add_argument("--account", help="named account whose books to use instead of the default ones")
+    books.add_argument("--accounts-file", default=ACCOUNTS_FILE, help="index of the named accounts")
+    books.add_argument("--log-level", default="WARNING", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    marks = argparse.ArgumentParser(add_help=False)
+    marks.add_argument("--marks", help="CSV of SYMBOL,PRICE used for unrealized P/L")
+
+    parser = argparse.ArgumentParser(prog="report", description="Headless P/L reports over the saved trade books.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary = commands.add_parser("summary", parents=[books, marks], help="print realized/unrealized P/L per book and symbol")
+    summary.add_argument("--json", action="store_true", help="print JSON instead of text")
+
+    export = commands.add_parser("export", parents=[books, marks], help="write the per-symbol summary as CSV")
+    export.add_argument("output", help="CSV file to write, or - for stdout")
+
+    commands.add_parser("migrate", parents=[books], help="copy the books into a new SQLite database")
+    commands.add_parser("import-json", parents=[books], help="write the binary snapshots from the JSON books")
+    commands.add_parser("export-json", parents=[books], help="write the JSON books from the binary snapshots")
+
+    risk = commands.add_parser("risk", parents=[books, marks], help="Monte Carlo VaR and expected shortfall of the open positions")
+    risk.add_argument("--paths", type=int, default=100000)
+    risk.add_argument("--horizon", type=float, default=10, help="days ahead")
+    risk.add_argument("--correlation", type=float, default=0.5, help="correlation between any two underliers")
+    risk.add_argument("--workers", type=int, help="worker processes (default one per core, 0 for none)")
+    risk.add_argument("--seed", type=int)
+    risk.add_argument("--json", action="store_true", help="print JSON instead of text")
+
+    trades = commands.add_parser("export-trades", parents=[books], help="stream the trades to CSV, JSON Lines or columnar")
+    trades.add_argument("output", help="file to write; with --book both, each book's name is added before the extension")
+    trades.add_argument("--format", default="csv", choices=("csv", "jsonl", "columnar"))
+    trades.add_argument("--book", default="both", choices=("equity", "option", "both"))
+    trades.add_argument("--symbol")
+    trades.add_argument("--status", choices=("open", "closed"))
+    trades.add_argument("--date-field", help="date column the range applies to (default each book's opening date)")
+    trades.add_argument("--from", dest="date_from", help="first date, YYYY-MM-DD")
+    trades.add_argument("--to", dest="date_to", help="last date, YYYY-MM-DD")
+
+    accounts = commands.add_parser("accounts", parents=[books], help="totals per account and across accounts")
+    accounts.add_argument("--refresh", action="store_true", help="open every account's books to update the totals first")
+    accounts.add_argument("--json", action="store_true", help="print JSON instead of text")
+
+    realized = commands.add_parser("realized", parents=[books], help="realized equity gains for a tax year, with wash sales")
+    realized.add_argument("--year", type=int, default=date.today().year)
+    realized.add_argument("--json", action="store_true", help="print JSON instead of text")
+    return parser
+
+
+def account_index(args):
+    """The account index, with the default account's books as given on the command line."""
+    return AccountIndex(args.accounts_file, AccountFiles(
+        BookFiles(args.equity_file, args.equity_snapshot, args.equity_journal),
+        BookFiles(args.option_file, args.option_snapshot, args.option_journal),
+        args.database,
+    ))
+
+
+def use_account(args):
+    """Point the book arguments at the files of the account named by --account; False if there is none."""
+    index = account_index(args)
+    if args.account not in index:
+        log.error("There is no account called %s (accounts: %s).", args.account, ", ".join(index.names()))
+        return False
+    files = index.files(args.account)
+    args.equity_file, args.equity_snapshot, args.equity_journal = files.equity
+    args.option_file, args.option_snapshot, args.option_journal = files.option
+    args.database = files.database
+    return True
+
+
+def run_accounts(args):
+    from rollup import PLRollup
+
+    index = account_index(args)
+    if args.refresh:
+        for name in index.names():
+            files = index.files(name)
+            stores = [
+                load_store(trade_class, book.save, book.journal, files.database, book.snapshot)
+                for trade_class, book in ((EquityTrade, files.equity), (OptionTrade, files.option))
+            ]
+            index.record(name, PLRollup(stores))
+            for store in stores:
+                store.close_storage()
+    summaries, by_book, total = index.summaries()
+    if args.json:
+        json.dump({
+            "accounts": [{
+                "name": summary.name, "updated": summary.updated,
+                "books": None if summary.books is None else {book: totals._asdict() for book, totals in summary.books.items()},
+            } for summary in summaries],
+            "by_book": {book: totals._asdict() for book, totals in by_book.items()},
+            "total": total._asdict(),
+        }, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print("\n".join(describe(summaries, by_book, total)))
+    return 0
+
+
+def migrate(args):
+    from sqlstore import migrate as migrate_books
+
+    try:
+        counts = migrate_books(args.database, load_books(args, database=False))
+    except FileExistsError as e:
+        log.error("Not migrating: %s", e)
+        return 1
+    print(
+        f"Migrated {counts[EquityTrade]} equity and {counts[OptionTrade]} option trades into {args.database}. "
+        "The snapshot files are left as they were but are no longer used."
+    )
+    return 0
+
+
+def import_json(args):
+    """Write each book's binary snapshot from its JSON snapshot and journal, refusing to replace one."""
+    from mapstore import write_trades
+
+    books = (
+        (EquityTrade, args.equity_file, args.equity_journal, args.equity_snapshot),
+        (OptionTrade, args.option_file, args.option_journal, args.option_snapshot),
+    )
+    for trade_class, json_path, journal_path, binary_path in books:
+        if os.path.exists(binary_path):
+            log.error("Not importing: %s already exists", binary_path)
+            return 1
+    for trade_class, json_path, journal_path, binary_path in books:
+        if not os.path.exists(json_path) and not os.path.exists(journal_path):
+            log.warning("No book at %s.", json_path)
+            continue
+        store = TradeStore(trade_class)
+        open_book(store, json_path, journal_path)
+        # The binary snapshot covers the whole journal, so later events follow on from it
+        count = write_trades(binary_path, trade_class, store, store.journal.seq, store.next_id)
+        store.close_storage()
+        print(f"Wrote {count} trades from {json_path} to {binary_path}.")
+    return 0
+
+
+def export_json(args):
+    """Write each book's JSON snapshot from its binary snapshot and journal."""
+    from journal import write_snapshot
+    from mapstore import MappedTradeStore
+
+    for trade_class, json_path, journal_path, binary_path in (
+        (EquityTrade, args.equity_file, args.equity_journal, args.equity_snapshot),
+        (OptionTrade, args.option_file, args.option_journal, args.option_snapshot),
+    ):
+        if not os.path.exists(binary_path):
+            log.warning("No binary snapshot at %s; %s is already the book.", binary_path, json_path)
+            continue
+        store = MappedTradeStore(trade_class, binary_path)
+        store.open_journal(journal_path, attach=False)
+        write_snapshot(json_path, [trade.to_dict() for trade in store], store.seq, store.next_id)
+        print(f"Wrote {len(store)} trades from {binary_path} to {json_path}.")
+    return 0
+
+
+def run_risk(args):
+    import risk
+
+    equities, options = load_books(args)
+    marks = read_marks(args.marks) if args.marks else {}
+    book = risk.RiskBook(equities.open_trades(), marks, marked_greeks(options.open_trades(), marks, date.today()))
+    if book.empty:
+        log.error("There are no open positions to simulate.")
+        return 1
+    try:
+        result = risk.simulate(book, args.paths, args.horizon, args.correlation, args.seed, args.workers)
+    finally:
+        risk.shutdown()
+    if args.json:
+        json.dump({
+            "paths": result.paths, "horizon_days": result.horizon_days, "mean": result.mean, "std": result.std,
+            "var": {str(c): v for c, v in result.var.items()}, "es": {str(c): v for c, v in result.es.items()},
+            "seconds": result.seconds,
+        }, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print("\n".join(risk.describe(result)))
+    return 0
+
+
+def run_realized(args):
+    from lots import realized_gains
+
+    equities = load_store(EquityTrade, args.equity_file, args.equity_journal, args.database, args.equity_snapshot)
+    by_ticker, total = realized_gains(equities, args.year)
+    if args.json:
+        json.dump({
+            "year": args.year, "total": total._asdict(),
+            "by_ticker": {ticker: row._asdict() for ticker, row in sorted(by_ticker.items())},
+        }, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+    print(
+        f"Realized {args.year}: {total.lots} lots, {total.shares} shares  proceeds {format_pl(total.proceeds)}  "
+        f"cost {format_pl(total.cost)}  short-term {format_pl(total.short_term)}  "
+        f"long-term {format_pl(total.long_term)}  wash sale disallowed {format_pl(total.wash_disallowed)}"
+    )
+    for ticker, row in sorted(by_ticker.items()):
+        print(
+            f"  {ticker:<8} {row.lots:>6} lots  proceeds {format_pl(row.proceeds):>14}  cost {format_pl(row.cost):>14}  "
+            f"short {format_pl(row.short_term):>12}  long {format_pl(row.long_term):>12}  "
+            f"wash {format_pl(row.wash_disallowed):>10}"
+        )
+    return 0
+
+
+def export_trades(args):
+    from export import Export, TradeFilter, book_path
+
+    try:
+        trade_filter = TradeFilter(args.symbol, args.status, args.date_field, args.date_from, args.date_to)
+    except ValueError as e:
+        log.error("Not exporting: %s", e)
+        return 1
+    books = (
+        ("equity", EquityTrade, args.equity_file, args.equity_journal, args.equity_snapshot),
+        ("option", OptionTrade, args.option_file, args.option_journal, args.option_snapshot),
+    )
+    for book, trade_class, json_path, journal_path, binary_path in books:
+        if args.book not in (book, "both"):
+            continue
+        store = load_store(trade_class, json_path, journal_path, args.database, binary_path)
+        path = book_path(args.output, book) if args.book == "both" else args.output
+        result = Export(store, path, args.format, trade_filter).run()
+        store.close_storage()
+        print(f"Wrote {result.trades} of {result.scanned} {book} trades to {path} in {result.seconds:.2f}s.")
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Warnings from loading the books go to stderr, apart from the report itself
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(levelname)s %(name)s: %(message)s")
+    if args.command == "accounts":
+        return run_accounts(args)
+    if args.account and args.account != DEFAULT_ACCOUNT and not use_account(args):
+        return 1
+    if args.command == "migrate":
+        return migrate(args)
+    if args.command == "risk":
+        return run_risk(args)
+    if args.command == "realized":
+        return run_realized(args)
+    if args.command == "import-json":
+        return import_json(args)
+    if args.command == "export-json":
+        return export_json(args)
+    if args.command == "export-trades":
+        return export_trades(args)
+    report = build_report(args)
+
+    if args.command == "summary":
+        if args.json:
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            print_summary(report, sys.stdout)
+    elif args.command == "export":
+        if args.output == "-":
+            write_csv(report, sys.stdout)
+        else:
+            with open(args.output, "w", newline="") as f:
+                write_csv(report, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""Monte Carlo value at risk for the open equity and option positions.
+
+RiskBook flattens the open positions of both books into arrays: one row per
+underlier (spot, volatility, open shares) and one per option contract,
+merged like the scenario grid's legs. simulate() draws correlated
+lognormal underlier prices at the horizon, revalues every position on each
+path (options at Black-Scholes with their implied vols, or intrinsic value
+if they have expired by then) and summarizes the P/L distribution.
+
+Paths are split into shards run on a pool of worker processes. The book's
+arrays and the P/L of every path live in one shared-memory block, so a
+shard is sent as a few numbers and writes its results in place; nothing
+is pickled per path. Prices are correlated through one market factor: each
+underlier's shock is sqrt(rho) * market + sqrt(1 - rho) * its own.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from pricing import DAYS_PER_YEAR, MERGE_VOL_STEP, RISK_FREE_RATE, bs_price, intrinsic, norm_cdf_into
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PATHS = 100000
+DEFAULT_HORIZON_DAYS = 10
+DEFAULT_CORRELATION = 0.5
+# Volatility of underliers with no implied vol to go by (equities without options, or unsolved IVs)
+DEFAULT_VOL = 0.3
+CONFIDENCES = (0.95, 0.99)
+HISTOGRAM_BINS = 80
+# Paths per task sent to a worker
+SHARD_PATHS = 5000
+# Paths x contracts per vectorized batch within a task, small enough for the buffers to stay in cache
+BATCH_CELLS = 1 << 17
+
+RiskResult = namedtuple("RiskResult", ["paths", "horizon_days", "mean", "std", "var", "es", "histogram", "seconds"])
+
+_pool = None
+_pool_workers = None
+
+
+class RiskBook:
+    """The open positions of both books as flat arrays, ready to simulate.
+
+    Built on the UI thread from the stores and the option table's GreeksBook
+    (for its current spots and implied vols), so the simulation itself never
+    touches a store.
+    """
+
+    def __init__(self, equity_trades, equity_marks, greeks):
+        shares, cost = {}, {}
+        for trade in equity_trades:
+            if not trade.is_open or trade.buy_price is None or trade.num_shares is None:
+                continue
+            shares[trade.symbol] = shares.get(trade.symbol, 0) + trade.num_shares
+            cost[trade.symbol] = cost.get(trade.symbol, 0.0) + trade.buy_price * trade.num_shares
+
+        self.underliers = sorted(set(shares) | set(greeks.underliers))
+        code_of = {underlier: code for code, underlier in enumerate(self.underliers)}
+        self.spot = np.empty(len(self.underliers))
+        self.vol = np.full(len(self.underliers), DEFAULT_VOL)
+        self.shares = np.zeros(len(self.underliers))
+        for code, underlier in enumerate(self.underliers):
+            option_spot = greeks.spot_of(underlier)
+            if underlier in equity_marks:
+                self.spot[code] = equity_marks[underlier]
+            elif option_spot is not None:
+                self.spot[code] = option_spot
+            else:
+                # Unmarked: the average cost, so the position starts the horizon at zero P/L
+                self.spot[code] = cost[underlier] / shares[underlier] if shares[underlier] else 0.0
+            self.shares[code] = shares.get(underlier, 0)
+
+        self.legs = 0
+        self.code = np.empty(0, dtype=np.int64)
+        self.strike = self.years = self.iv = self.contracts = self.value = np.empty(0)
+        self.is_call = np.empty(0, dtype=bool)
+        if greeks.ids and greeks.results:
+            self.add_options(greeks, code_of)
+
+    def add_options(self, greeks, code_of):
+        code = np.array([code_of[underlier] for underlier in greeks.underliers])[greeks.underlier_code]
+        iv = greeks.results["iv"]
+        solved = np.isfinite(iv)
+        # An underlier's vol is the mean of its contracts' implied vols; unsolved contracts take it too
+        counts = np.bincount(code[solved], minlength=len(self.underliers))
+        sums = np.bincount(code[solved], weights=iv[solved], minlength=len(self.underliers))
+        np.divide(sums, counts, out=self.vol, where=counts > 0)
+        iv = np.where(solved, iv, self.vol[code])
+
+        keys = np.stack([code, greeks.strike, greeks.years, greeks.is_call, np.round(iv / MERGE_VOL_STEP)], axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        weight = np.abs(greeks.contracts)
+        weight_sum = np.bincount(inverse, weights=weight, minlength=len(unique))
+        merged_iv = np.bincount(inverse, weights=iv * weight, minlength=len(unique))
+        self.legs = len(unique)
+        self.code = unique[:, 0].astype(np.int64)
+        self.strike, self.years = unique[:, 1], unique[:, 2]
+        self.is_call = unique[:, 3].astype(bool)
+        self.iv = np.divide(merged_iv, weight_sum, out=unique[:, 4] * MERGE_VOL_STEP, where=weight_sum > 0)
+        self.contracts = np.bincount(inverse, weights=greeks.contracts, minlength=len(unique))
+        self.value = value_at(self.spot[self.code], self.strike, self.years, self.iv, self.is_call)
+
+    def __len__(self):
+        return len(self.underliers)
+
+    @property
+    def empty(self):
+        return not (self.shares.any() or self.legs)
+
+    def arrays(self):
+        """The arrays a worker needs, by name."""
+        return {
+            "spot": self.spot, "vol": self.vol, "shares": self.shares, "code": self.code, "strike": self.strike,
+            "years": self.years, "iv": self.iv, "is_call": self.is_call, "contracts": self.contracts,
+            "value": self.value,
+        }
+
+
+def value_at(spot, strike, years, iv, is_call, rate=RISK_FREE_RATE):
+    """Black-Scholes value per share, or intrinsic value where the contract has expired."""
+    live = years > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        model = bs_price(spot, strike, np.where(live, years, 1.0), iv, is_call, rate)
+    return np.where(live, model, intrinsic(spot, strike, is_call))
+
+
+class SharedArrays:
+    """NumPy arrays packed into one shared-memory block, attachable by name from another process."""
+
+    def __init__(self, arrays):
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout[name] = (offset, array.shape, array.dtype.str)
+            offset += -(-array.nbytes // 8) * 8  # keep every array 8-byte aligned
+        self.block = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        self.layout = layout
+        self.arrays = attach_arrays(self.block, layout)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+
+    @property
+    def spec(self):
+        return self.block.name, self.layout
+
+    def close(self):
+        self.arrays = None
+        self.block.close()
+        self.block.unlink()
+
+
+def attach_arrays(block, layout):
+    return {
+        name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        for name, (offset, shape, dtype) in layout.items()
+    }
+
+
+class Revaluer:
+    """Revalues the option legs on a batch of paths, in place in float32 buffers reused from batch to batch.
+
+    Everything that depends only on the leg (discounted strike, vol * sqrt(t),
+    the d1 drift term) is worked out once; a batch is then a few passes over a
+    paths x legs buffer, calls by Black-Scholes and puts from them by put-call
+    parity, as in scenario_grid(). Legs' P/L is taken against today's value
+    per leg before summing, so float32 loses nothing that matters.
+    """
+
+    def __init__(self, arrays, horizon, rate):
+        code, strike, iv, is_call = arrays["code"], arrays["strike"], arrays["iv"], arrays["is_call"]
+        left = arrays["years"] - horizon
+        self.code = code
+        self.live = left > 0
+        self.dead = ~self.live
+        self.puts = ~is_call
+        t = np.where(self.live, left, 1.0)
+        self.log_strike = np.log(strike).astype(np.float32)
+        self.drift = ((rate + 0.5 * iv * iv) * t).astype(np.float32)
+        self.vol_sqrt_t = (iv * np.sqrt(t)).astype(np.float32)
+        self.strike_discount = (strike * np.exp(-rate * t)).astype(np.float32)
+        self.strike = strike.astype(np.float32)
+        self.is_call = is_call
+        self.value_now = arrays["value"].astype(np.float32)
+        self.contracts = arrays["contracts"].astype(np.float32)
+        self.buffers = None
+
+    def pl(self, prices, log_prices):
+        """P/L of all legs on each path, given each path's underlier prices and their logs."""
+        shape = (len(prices), len(self.code))
+        if self.buffers is None or self.buffers[0].shape != shape:
+            self.buffers = [np.empty(shape, dtype=np.float32) for _ in range(5)]
+        spot, d1, value, other, scratch = self.buffers
+        np.take(prices.astype(np.float32), self.code, axis=1, out=spot)
+        np.take(log_prices.astype(np.float32), self.code, axis=1, out=d1)
+        d1 -= self.log_strike
+        d1 += self.drift
+        d1 /= self.vol_sqrt_t
+        norm_cdf_into(d1, value, scratch)
+        value *= spot
+        d1 -= self.vol_sqrt_t
+        norm_cdf_into(d1, other, scratch)
+        other *= self.strike_discount
+        value -= other  # call
+        # Puts from calls by put-call parity
+        np.subtract(value, spot, out=other)
+        other += self.strike_discount
+        np.copyto(value, other, where=self.puts)
+        if self.dead.any():
+            np.subtract(spot, self.strike, out=other)
+            np.negative(other, out=other, where=self.puts)
+            np.maximum(other, 0.0, out=other)
+            np.copyto(value, other, where=self.dead)
+        value -= self.value_now
+        return value @ self.contracts
+
+
+def simulate_shard(spec, first, count, seed, horizon_days, correlation, rate=RISK_FREE_RATE):
+    """Worker: fill pl[first:first + count] with simulated P/L; returns the number of paths done.
+
+    Stops early, between batches, once the shared cancel flag is set.
+    """
+    name, layout = spec
+    block = shared_memory.SharedMemory(name=name)
+    arrays = None
+    try:
+        arrays = attach_arrays(block, layout)
+        rng = np.random.default_rng(seed)
+        horizon = horizon_days / DAYS_PER_YEAR
+        spot, vol, shares = arrays["spot"], arrays["vol"], arrays["shares"]
+        log_spot = np.log(np.where(spot > 0, spot, 1.0)) - 0.5 * vol * vol * horizon
+        shock = vol * np.sqrt(horizon)
+        revaluer = Revaluer(arrays, horizon, rate) if len(arrays["code"]) else None
+        batch_paths = max(1, BATCH_CELLS // max(1, len(arrays["code"]), len(spot)))
+        done = 0
+        while done < count and not arrays["cancel"][0]:
+            n = min(batch_paths, count - done)
+            z = rng.standard_normal((n, len(spot)))
+            z *= np.sqrt(1.0 - correlation)
+            z += np.sqrt(correlation) * rng.standard_normal((n, 1))
+            log_prices = z
+            log_prices *= shock
+            log_prices += log_spot
+            prices = np.exp(log_prices)
+            batch = (prices - spot) @ shares
+            if revaluer is not None:
+                batch += revaluer.pl(prices, log_prices)
+            arrays["pl"][first + done:first + done + n] = batch
+            done += n
+        return done
+    finally:
+        # The views have to go before the block can close
+        arrays = spot = vol = shares = None
+        block.close()
+
+
+def pool(workers):
+    """The shared worker pool, (re)created with `workers` processes."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown()
+        # Spawned rather than forked, so workers don't inherit the GUI's window and threads
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def simulate(book, paths=DEFAULT_PATHS, horizon_days=DEFAULT_HORIZON_DAYS, correlation=DEFAULT_CORRELATION,
+             seed=None, workers=None, progress=None, cancel=None):
+    """Simulate `paths` scenarios of `book` over `horizon_days` and return a RiskResult.
+
+    `workers` processes share the paths (default: one per core; 0 runs them
+    in this process). `progress(done, total)` is called as shards finish,
+    from this thread. If the `cancel` Event is set, the workers stop after
+    their current batch and None is returned.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    cancel = cancel or threading.Event()
+    start = time.perf_counter()
+    arrays = book.arrays()
+    arrays["pl"] = np.zeros(paths)
+    arrays["cancel"] = np.zeros(1, dtype=np.uint8)
+    shared = SharedArrays(arrays)
+    shards = [(first, min(SHARD_PATHS, paths - first)) for first in range(0, paths, SHARD_PATHS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    done = 0
+    try:
+        if workers == 0:
+            for (first, count), shard_seed in zip(shards, seeds):
+                if cancel.is_set():
+                    return None
+                done += simulate_shard(shared.spec, first, count, shard_seed, horizon_days, correlation)
+                if progress is not None:
+                    progress(done, paths)
+        else:
+            executor = pool(workers)
+            pending = {
+                executor.submit(simulate_shard, shared.spec, first, count, shard_seed, horizon_days, correlation)
+                for (first, count), shard_seed in zip(shards, seeds)
+            }
+            while pending:
+                finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                if cancel.is_set():
+                    shared.arrays["cancel"][0] = 1
+                    for future in pending:
+                        future.cancel()
+                    # Shards already running stop after their batch; let them let go of the block first
+                    wait(pending)
+                    return None
+                for future in finished:
+                    done += future.result()
+                if finished and progress is not None:
+                    progress(done, paths)
+        if cancel.is_set():
+            return None
+        return summarize(shared.arrays["pl"].copy(), horizon_days, time.perf_counter() - start)
+    finally:
+        shared.close()
+
+
+def summarize(pl, horizon_days, seconds):
+    """VaR and expected shortfall (as positive losses) at each of CONFIDENCES, and a histogram of `pl`."""
+    pl.sort()
+    var, es = {}, {}
+    for confidence in CONFIDENCES:
+        tail = pl[:max(1, int(len(pl) * (1.0 - confidence)))]
+        var[confidence] = -float(tail[-1])
+        es[confidence] = -float(tail.mean())
+    histogram = np.histogram(pl, bins=HISTOGRAM_BINS)
+    return RiskResult(len(pl), horizon_days, float(pl.mean()), float(pl.std()), var, es, histogram, seconds)
+
+
+def describe(result):
+    """Text lines summarizing a RiskResult."""
+    lines = [
+        f"{result.paths:,} paths over {result.horizon_days:g} days in {result.seconds:.1f} s",
+        f"Mean P/L {result.mean:,.0f}   std dev {result.std:,.0f}",
+    ]
+    for confidence in CONFIDENCES:
+        lines.append(
+            f"{confidence:.0%} VaR {result.var[confidence]:,.0f}   expected shortfall {result.es[confidence]:,.0f}"
+        )
+    return lines
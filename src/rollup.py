@@ -0,0 +1,286 @@
+"""Incrementally maintained P/L rollups across the equity and option books.
+
+A PLRollup listens to both stores and keeps a Bucket of trade counts,
+realized P/L and unrealized P/L for:
+
+- the whole portfolio and each book,
+- each underlier (equities and options on it together),
+- each option expiry,
+- each month trades were closed in.
+
+Every add, close, edit or delete touches a fixed handful of buckets, so keeping the
+rollups costs O(1) per event and reading them never scans the books. A book
+opened from a binary snapshot is rolled up from its columns in one NumPy pass
+per grouping rather than trade by trade.
+Unrealized P/L follows the marks: an equity symbol's open P/L is
+mark * open shares - open cost, kept per symbol so a new price is one
+update, and each marked option contributes its own model P/L, replaced
+whenever it is repriced.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from store import EquityTrade, OptionTrade, parse_date
+
+BOOKS = {EquityTrade: "equity", OptionTrade: "option"}
+# Month bucket for closed trades without a close date (options only record their close price)
+UNDATED = "-"
+
+
+@lru_cache(maxsize=4096)
+def month_of(text):
+    """`YYYY-MM` of a date cell, or UNDATED."""
+    parsed = parse_date(text)
+    return UNDATED if parsed is None else f"{parsed.year}-{parsed.month:02d}"
+
+
+def closed_on(trade):
+    return getattr(trade, "sell_date", None)
+
+
+class Bucket:
+    """Counts and P/L totals for one group of trades."""
+    __slots__ = ("trades", "open", "realized_pl", "unrealized_pl", "marked")
+
+    def __init__(self):
+        self.trades = 0
+        self.open = 0
+        self.realized_pl = 0.0
+        self.unrealized_pl = 0.0
+        # Marked contributions in unrealized_pl; with none, unrealized P/L is unknown rather than 0
+        self.marked = 0
+
+    @property
+    def unrealized(self):
+        return self.unrealized_pl if self.marked else None
+
+    @property
+    def total_pl(self):
+        return self.realized_pl + self.unrealized_pl
+
+
+class PLRollup:
+    """Rollups over any number of stores; `on_change` is called (with no arguments) after every update."""
+
+    def __init__(self, stores=(), on_change=None):
+        self.total = Bucket()
+        self.by_book = {book: Bucket() for book in BOOKS.values()}
+        self.by_underlier = {}
+        self.by_expiry = {}
+        self.by_month = {}
+        self.on_change = on_change
+        # Open equity shares and cost per symbol, and the unrealized P/L each marked symbol contributes
+        self.equity_open = {}
+        self.equity_marks = {}
+        self.equity_unrealized = {}
+        # Unrealized P/L each marked option contributes, by trade id
+        self.option_unrealized = {}
+        for store in stores:
+            self.watch(store)
+
+    def watch(self, store):
+        """Roll up the trades already in `store` and follow its adds and closes."""
+        if getattr(store, "columns", None) is not None:
+            self.add_columns(store)
+            trades = store.added.values()
+        else:
+            trades = store
+        for trade in trades:
+            self.trade_added(trade, notify=False)
+        store.listeners.append(self)
+        self.changed()
+
+    def add_columns(self, store):
+        """Roll up the snapshot rows of a MappedTradeStore, grouping with bincount over its string codes."""
+        rows = np.flatnonzero(store.alive)
+        columns, strings = store.columns, store.strings
+        is_open = np.isnan(columns[store.spec.open_column][rows])
+        pl = np.nan_to_num(store.pl_column()[rows])
+        book = self.by_book[BOOKS[store.trade_class]]
+        for bucket in (self.total, book):
+            bucket.trades += len(rows)
+            bucket.open += int(is_open.sum())
+            bucket.realized_pl += float(pl.sum())
+
+        def tally(field, groups):
+            """Add counts and P/L per string code of `field` to the buckets named by groups(value)."""
+            codes = columns[field][rows]
+            size = len(strings[field])
+            totals = zip(
+                np.bincount(codes, minlength=size).tolist(),
+                np.bincount(codes, weights=is_open, minlength=size).tolist(),
+                np.bincount(codes, weights=pl, minlength=size).tolist(),
+            )
+            for value, (trades, opened, realized) in zip(strings[field], totals):
+                if trades:
+                    group = groups(value)
+                    if group is not None:
+                        bucket = group[0].get(group[1])
+                        if bucket is None:
+                            bucket = group[0][group[1]] = Bucket()
+                        bucket.trades += trades
+                        bucket.open += int(opened)
+                        bucket.realized_pl += realized
+
+        tally(store.spec.symbol_field, lambda symbol: (self.by_underlier, symbol))
+        if "expiry" in columns:
+            tally("expiry", lambda expiry: (self.by_expiry, expiry) if expiry else None)
+
+        closed = rows[~is_open]
+        realized = pl[~is_open]
+        if "sell_date" in columns:
+            months = [month_of(value) for value in strings["sell_date"]]
+            by_code = np.bincount(columns["sell_date"][closed], minlength=len(months)).tolist()
+            pl_by_code = np.bincount(columns["sell_date"][closed], weights=realized, minlength=len(months)).tolist()
+            grouped = zip(months, by_code, pl_by_code)
+        else:
+            grouped = [(UNDATED, len(closed), float(realized.sum()))]
+        for month, trades, month_pl in grouped:
+            if trades:
+                bucket = self.by_month.get(month)
+                if bucket is None:
+                    bucket = self.by_month[month] = Bucket()
+                bucket.trades += trades
+                bucket.realized_pl += month_pl
+
+        if store.trade_class is EquityTrade:
+            lots = rows[is_open]
+            shares = store.numbers("num_shares")[lots]
+            cost = columns["buy_price"][lots] * shares
+            priced = ~np.isnan(cost)
+            codes = columns["ticker"][lots][priced]
+            size = len(strings["ticker"])
+            open_shares = np.bincount(codes, weights=shares[priced], minlength=size).tolist()
+            open_cost = np.bincount(codes, weights=cost[priced], minlength=size).tolist()
+            for symbol, count, total in zip(strings["ticker"], open_shares, open_cost):
+                if count or total:
+                    position = self.equity_open.setdefault(symbol, [0, 0.0])
+                    position[0] += int(count)
+                    position[1] += total
+                    if symbol in self.equity_marks:
+                        self.mark_equity(symbol, self.equity_marks[symbol])
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def buckets(self, trade):
+        """The buckets a trade counts towards, apart from its close month."""
+        symbol = trade.symbol
+        buckets = [self.total, self.by_book[BOOKS[type(trade)]]]
+        bucket = self.by_underlier.get(symbol)
+        if bucket is None:
+            bucket = self.by_underlier[symbol] = Bucket()
+        buckets.append(bucket)
+        expiry = getattr(trade, "expiry", None)
+        if expiry:
+            bucket = self.by_expiry.get(expiry)
+            if bucket is None:
+                bucket = self.by_expiry[expiry] = Bucket()
+            buckets.append(bucket)
+        return buckets
+
+    def month_bucket(self, trade):
+        month = month_of(closed_on(trade))
+        bucket = self.by_month.get(month)
+        if bucket is None:
+            bucket = self.by_month[month] = Bucket()
+        return bucket
+
+    def trade_added(self, trade, notify=True):
+        buckets = self.buckets(trade)
+        for bucket in buckets:
+            bucket.trades += 1
+        if trade.is_open:
+            for bucket in buckets:
+                bucket.open += 1
+            if type(trade) is EquityTrade:
+                self.move_equity(trade, 1)
+        else:
+            self.realize(trade, buckets)
+        if notify:
+            self.changed()
+
+    def trade_closed(self, trade):
+        buckets = self.buckets(trade)
+        for bucket in buckets:
+            bucket.open -= 1
+        if type(trade) is EquityTrade:
+            self.move_equity(trade, -1)
+        else:
+            self.set_unrealized(buckets, self.option_unrealized.pop(trade.id, None), None)
+        self.realize(trade, buckets)
+        self.changed()
+
+    def trade_removed(self, trade):
+        """Take a trade back out of every bucket it counts towards (deleted, or about to be re-added after an edit)."""
+        buckets = self.buckets(trade)
+        for bucket in buckets:
+            bucket.trades -= 1
+        if trade.is_open:
+            for bucket in buckets:
+                bucket.open -= 1
+            if type(trade) is EquityTrade:
+                self.move_equity(trade, -1)
+            else:
+                self.set_unrealized(buckets, self.option_unrealized.pop(trade.id, None), None)
+        else:
+            self.realize(trade, buckets, -1)
+        self.changed()
+
+    def realize(self, trade, buckets, sign=1):
+        """Add (sign 1) or take back (sign -1) a closed trade's realized P/L."""
+        pl = (trade.pl or 0.0) * sign
+        month = self.month_bucket(trade)
+        month.trades += sign
+        for bucket in buckets + [month]:
+            bucket.realized_pl += pl
+
+    def set_unrealized(self, buckets, old, new):
+        """Replace one contribution `old` with `new` (either may be None, meaning unmarked)."""
+        delta = (new or 0.0) - (old or 0.0)
+        marked = (new is not None) - (old is not None)
+        for bucket in buckets:
+            bucket.unrealized_pl += delta
+            bucket.marked += marked
+
+    def equity_buckets(self, symbol):
+        return [self.total, self.by_book["equity"], self.by_underlier[symbol]]
+
+    def move_equity(self, trade, sign):
+        """Add (sign 1) or remove (sign -1) an open equity lot from its symbol's open shares and cost."""
+        if trade.buy_price is None or trade.num_shares is None:
+            return
+        position = self.equity_open.setdefault(trade.symbol, [0, 0.0])
+        position[0] += sign * trade.num_shares
+        position[1] += sign * trade.buy_price * trade.num_shares
+        if trade.symbol in self.equity_marks:
+            self.mark_equity(trade.symbol, self.equity_marks[trade.symbol])
+
+    def mark_equity(self, symbol, price):
+        self.equity_marks[symbol] = price
+        shares, cost = self.equity_open.get(symbol, (0, 0.0))
+        new = price * shares - cost
+        self.set_unrealized(self.equity_buckets(symbol), self.equity_unrealized.get(symbol), new)
+        self.equity_unrealized[symbol] = new
+
+    def mark_equities(self, prices):
+        """Revalue the open equity positions of each symbol in {symbol: price}, one update per symbol."""
+        for symbol, price in prices.items():
+            if symbol in self.equity_open:
+                self.mark_equity(symbol, price)
+        self.changed()
+
+    def mark_options(self, marks):
+        """Set the unrealized P/L of open options from (trade, model value) pairs; a None value unmarks."""
+        for trade, value in marks:
+            if not trade.is_open:
+                continue
+            new = None if value is None or value != value else trade.unrealized_pl(value)
+            old = self.option_unrealized.pop(trade.id, None)
+            if new is not None:
+                self.option_unrealized[trade.id] = new
+            if old != new:
+                self.set_unrealized(self.buckets(trade), old, new)
+        self.changed()
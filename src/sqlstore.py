@@ -0,0 +1,391 @@
+"""Optional SQLite storage for the trade books.
+
+Once `python src/main.py migrate` has copied the books into
+.trades.db, the app and the reports read and write the database instead.
+Each book is a table with typed columns; date columns get an integer ordinal
+column next to them so ranges and sorts use an index, and there are indexes
+on the symbol, the dates and a partial index on the open positions. A
+small meta table keeps each book's next trade id, so deleting the newest
+trade never frees its id for reuse.
+
+SqliteTradeStore has the same interface as TradeStore, but nothing is loaded
+up front: trades are fetched by id through a small LRU cache, the table pages
+ids in as it scrolls, and every add or close is its own transaction, so
+startup costs the same however long the history is. SqliteIndex answers the
+table's filter and sort queries with SQL instead of in-memory indexes.
+"""
+import os
+import sqlite3
+from collections import OrderedDict
+
+from store import EquityTrade, OptionTrade, date_ordinal
+
+# Trades kept in memory by id; the table only ever shows a screenful
+CACHE_SIZE = 20000
+
+
+class TableSpec:
+    """How one trade class maps onto a table."""
+
+    def __init__(self, name, trade_class, columns, date_fields, symbol_field, open_column, pl, expressions=None):
+        self.name = name
+        self.trade_class = trade_class
+        self.columns = columns
+        self.fields = tuple(columns)
+        self.date_fields = date_fields
+        self.symbol_field = symbol_field
+        self.open_column = open_column
+        # P/L of a row closed at {price}, as in the trade classes' `pl` and `unrealized_pl`
+        self.pl = pl
+        # Sort keys that are derived from columns rather than stored
+        self.expressions = expressions or {}
+
+    def schema(self):
+        columns = ["id INTEGER PRIMARY KEY"]
+        columns += [f"{field} {kind}" for field, kind in self.columns.items()]
+        columns += [f"{field}_ord INTEGER" for field in self.date_fields]
+        statements = [f"CREATE TABLE IF NOT EXISTS {self.name} ({', '.join(columns)})"]
+        statements.append(f"CREATE INDEX IF NOT EXISTS {self.name}_symbol ON {self.name} ({self.symbol_field})")
+        for field in self.date_fields:
+            statements.append(f"CREATE INDEX IF NOT EXISTS {self.name}_{field} ON {self.name} ({field}_ord)")
+        statements.append(
+            f"CREATE INDEX IF NOT EXISTS {self.name}_open ON {self.name} (id) WHERE {self.open_column} IS NULL"
+        )
+        return statements
+
+    def row_values(self, trade):
+        values = [trade.id] + [getattr(trade, field) for field in self.fields]
+        values += [date_ordinal(getattr(trade, field)) if getattr(trade, field) else None for field in self.date_fields]
+        return values
+
+    def insert_sql(self):
+        names = ("id",) + self.fields + tuple(f"{field}_ord" for field in self.date_fields)
+        return f"INSERT INTO {self.name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+    def select_sql(self):
+        return f"SELECT id, {', '.join(self.fields)} FROM {self.name}"
+
+    def sort_expression(self, field):
+        if field in self.date_fields:
+            return f"{field}_ord"
+        if field in self.columns:
+            return field
+        return self.expressions.get(field)
+
+
+EQUITY_TABLE = TableSpec(
+    "equity_trades", EquityTrade,
+    {
+        "ticker": "TEXT NOT NULL", "buy_date": "TEXT", "buy_price": "REAL", "num_shares": "INTEGER",
+        "sell_date": "TEXT", "sell_price": "REAL",
+    },
+    date_fields=("buy_date", "sell_date"), symbol_field="ticker", open_column="sell_price",
+    pl="({price} - buy_price) * num_shares", expressions={"notional": "buy_price * num_shares"},
+)
+
+OPTION_TABLE = TableSpec(
+    "option_trades", OptionTrade,
+    {
+        "underlier": "TEXT NOT NULL", "date": "TEXT", "expiry": "TEXT", "type": "TEXT", "open_price": "REAL",
+        "strike": "REAL", "underlier_price": "REAL", "premium": "REAL", "fee": "REAL", "quantity": "INTEGER",
+        "close_price": "REAL", "close_premium": "REAL",
+    },
+    date_fields=("date", "expiry"), symbol_field="underlier", open_column="close_price",
+    pl="({price} - open_price) * (quantity * 100) - fee",
+)
+
+TABLES = {EquityTrade: EQUITY_TABLE, OptionTrade: OPTION_TABLE}
+
+
+def connect(path):
+    """Open the database in WAL mode, creating the schema if needed."""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        for spec in TABLES.values():
+            for statement in spec.schema():
+                connection.execute(statement)
+    return connection
+
+
+class TradeCache:
+    """Read-only mapping of id -> trade over a table, caching the most recently used trades."""
+
+    def __init__(self, store, size=CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self.cache = OrderedDict()
+
+    def __getitem__(self, trade_id):
+        trade = self.cache.get(trade_id)
+        if trade is not None:
+            self.cache.move_to_end(trade_id)
+            return trade
+        row = self.store.connection.execute(f"{self.store.spec.select_sql()} WHERE id = ?", (trade_id,)).fetchone()
+        if row is None:
+            raise KeyError(trade_id)
+        return self.remember(self.store.make_trade(row))
+
+    def remember(self, trade):
+        self.cache[trade.id] = trade
+        self.cache.move_to_end(trade.id)
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return trade
+
+    def __contains__(self, trade_id):
+        if trade_id in self.cache:
+            return True
+        return self.store.connection.execute(
+            f"SELECT 1 FROM {self.store.spec.name} WHERE id = ?", (trade_id,)
+        ).fetchone() is not None
+
+    def __iter__(self):
+        for (trade_id,) in self.store.connection.execute(f"SELECT id FROM {self.store.spec.name} ORDER BY id"):
+            yield trade_id
+
+    def __len__(self):
+        return len(self.store)
+
+    def values(self):
+        return iter(self.store)
+
+
+class SqliteTradeStore:
+    """A TradeStore kept in SQLite rather than in memory."""
+    paged = True
+
+    def __init__(self, trade_class, path):
+        self.trade_class = trade_class
+        self.spec = TABLES[trade_class]
+        self.path = path
+        self.connection = connect(path)
+        self.trades = TradeCache(self)
+        self.journal = None
+        self.listeners = []
+        self.count = self.connection.execute(f"SELECT count(*) FROM {self.spec.name}").fetchone()[0]
+        # The stored next id, unless the table was written without it (databases migrated before it was kept)
+        stored = self.connection.execute("SELECT value FROM meta WHERE key = ?", (self.next_id_key,)).fetchone()
+        highest = self.connection.execute(f"SELECT max(id) FROM {self.spec.name}").fetchone()[0] or 0
+        self.next_id = max(stored[0] if stored else 1, highest + 1)
+
+    @property
+    def next_id_key(self):
+        return f"{self.spec.name}.next_id"
+
+    def reserve_ids(self, next_id):
+        """Never hand out ids below `next_id`, for example those of trades deleted before a migration."""
+        self.next_id = max(self.next_id, next_id)
+        with self.connection:
+            self.save_next_id()
+
+    def save_next_id(self):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self.next_id_key, self.next_id)
+        )
+
+    def make_trade(self, row):
+        return self.trade_class(*row[1:], id=row[0])
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in self.connection.execute(f"{self.spec.select_sql()} ORDER BY id"):
+            yield self.make_trade(row)
+
+    def __contains__(self, trade_id):
+        return trade_id in self.trades
+
+    def add(self, trade):
+        """Insert a trade in its own transaction, assigning the next id if it does not have one."""
+        return self.add_many([trade])[0]
+
+    def add_many(self, trades):
+        """Insert a batch of trades in one transaction. Returns their ids."""
+        trades = list(trades)
+        for trade in trades:
+            if trade.id is None:
+                trade.id = self.next_id
+            self.next_id = max(self.next_id, trade.id + 1)
+        with self.connection:
+            self.connection.executemany(self.spec.insert_sql(), [self.spec.row_values(trade) for trade in trades])
+            self.save_next_id()
+        self.count += len(trades)
+        for trade in trades:
+            self.trades.remember(trade)
+            for listener in self.listeners:
+                listener.trade_added(trade)
+        return [trade.id for trade in trades]
+
+    def get(self, trade_id):
+        return self.trades[trade_id]
+
+    def close(self, trade_id, *args):
+        """Close a trade, updating its row in a single transaction."""
+        trade = self.trades[trade_id]
+        trade.close(*args)
+        self.write(trade)
+        for listener in self.listeners:
+            listener.trade_closed(trade)
+        return trade
+
+    def update(self, trade_id, changes):
+        """Change fields of a trade, updating its row in a single transaction."""
+        trade = self.trades[trade_id]
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        for field, value in changes.items():
+            setattr(trade, field, value)
+        self.write(trade)
+        for listener in self.listeners:
+            listener.trade_added(trade)
+        return trade
+
+    def write(self, trade):
+        spec = self.spec
+        assignments = ", ".join(f"{field} = ?" for field in spec.fields)
+        ordinals = "".join(f", {field}_ord = ?" for field in spec.date_fields)
+        with self.connection:
+            self.connection.execute(
+                f"UPDATE {spec.name} SET {assignments}{ordinals} WHERE id = ?",
+                spec.row_values(trade)[1:] + [trade.id]
+            )
+
+    def delete(self, trade_id):
+        trade = self.trades[trade_id]
+        with self.connection:
+            self.connection.execute(f"DELETE FROM {self.spec.name} WHERE id = ?", (trade_id,))
+        self.trades.cache.pop(trade_id, None)
+        self.count -= 1
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        return trade
+
+    def open_trades(self):
+        """Iterate the open trades only, through the partial index."""
+        query = f"{self.spec.select_sql()} WHERE {self.spec.open_column} IS NULL ORDER BY id"
+        for row in self.connection.execute(query):
+            # A cached trade is the live object the table shows, so prefer it to a fresh copy
+            yield self.trades.cache.get(row[0]) or self.trades.remember(self.make_trade(row))
+
+    def page_ids(self, after_id=0, before_id=None, limit=500):
+        """Up to `limit` ids in id order with after_id < id < before_id, fetching their trades into the cache."""
+        query = f"{self.spec.select_sql()} WHERE id > ?"
+        params = [after_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        ids = []
+        for row in self.connection.execute(query, params):
+            if row[0] not in self.trades.cache:
+                self.trades.remember(self.make_trade(row))
+            ids.append(row[0])
+        return ids
+
+    def close_storage(self):
+        self.connection.close()
+
+
+class SqliteIndex:
+    """The TradeIndex query interface, answered by SQL over the table's indexes."""
+
+    def __init__(self, store):
+        self.store = store
+        self.spec = store.spec
+        self.date_fields = self.spec.date_fields
+
+    def query(self, symbol=None, type=None, status=None, date_field=None, date_from=None, date_to=None):
+        """Ids of the trades matching every given filter, in id order; None when no filter is set."""
+        spec = self.spec
+        conditions, params = [], []
+        if symbol:
+            conditions.append(f"{spec.symbol_field} = ?")
+            params.append(symbol.strip().upper())
+        if type:
+            conditions.append("type = ?")
+            params.append(type)
+        if date_from or date_to:
+            low = date_ordinal(date_from) if date_from else None
+            high = date_ordinal(date_to) if date_to else None
+            if (date_from and low is None) or (date_to and high is None):
+                raise ValueError("Dates must look like YYYY-MM-DD")
+            column = f"{date_field or self.date_fields[0]}_ord"
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        if status == "open":
+            conditions.append(f"{spec.open_column} IS NULL")
+        elif status == "closed":
+            conditions.append(f"{spec.open_column} IS NOT NULL")
+        if not conditions:
+            return None
+        query = f"SELECT id FROM {spec.name} WHERE {' AND '.join(conditions)} ORDER BY id"
+        return [trade_id for (trade_id,) in self.store.connection.execute(query, params)]
+
+    @property
+    def ordered_fields(self):
+        spec = self.spec
+        return set(spec.fields) | set(spec.expressions) | {"pl"}
+
+    def ordered(self, field, trade_ids=None, reverse=False, marks=None, trade_marks=None):
+        """Ids ordered by a column or derived sort key, missing values last, restricted to `trade_ids` if given.
+
+        "pl" sorts closed trades by their realized P/L and open ones by their
+        P/L at `marks` (symbol -> price) or `trade_marks` (id -> price).
+        """
+        spec, connection = self.spec, self.store.connection
+        source = spec.name
+        if field == "pl":
+            price = spec.open_column
+            if marks or trade_marks:
+                # The marks go in a temporary table, joined to the open rows by symbol or by id
+                with connection:
+                    connection.execute("CREATE TEMP TABLE IF NOT EXISTS pl_marks (key PRIMARY KEY, price REAL)")
+                    connection.execute("DELETE FROM pl_marks")
+                    connection.executemany("INSERT INTO pl_marks VALUES (?, ?)", (marks or trade_marks).items())
+                key = spec.symbol_field if marks else "id"
+                source += f" LEFT JOIN pl_marks ON pl_marks.key = {spec.name}.{key}"
+                price = f"coalesce({spec.open_column}, pl_marks.price)"
+            expression = spec.pl.format(price=price)
+        else:
+            expression = spec.sort_expression(field)
+        direction = "DESC" if reverse else "ASC"
+        query = f"SELECT {spec.name}.id FROM {source} ORDER BY {expression} IS NULL, {expression} {direction}, {spec.name}.id"
+        ids = [trade_id for (trade_id,) in connection.execute(query)]
+        if trade_ids is not None:
+            wanted = set(trade_ids)
+            ids = [trade_id for trade_id in ids if trade_id in wanted]
+        return ids
+
+
+def migrate(database_path, books):
+    """Copy books into a new database, keeping their trade ids.
+
+    `books` are the stores to copy, already loaded from their snapshots and
+    journals. Refuses to touch an existing database so the migration can only
+    run once.
+    """
+    if os.path.exists(database_path):
+        raise FileExistsError(f"{database_path} already exists")
+    counts = {}
+    try:
+        for book in books:
+            store = SqliteTradeStore(book.trade_class, database_path)
+            store.add_many(book)
+            store.reserve_ids(book.next_id)
+            store.close_storage()
+            counts[book.trade_class] = len(book)
+    except BaseException:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(database_path + suffix):
+                os.remove(database_path + suffix)
+        raise
+    return counts
@@ -0,0 +1,370 @@
+"""Typed in-memory trade records, kept separate from the table widgets.
+
+The tables render from a TradeStore instead of holding the only copy of each
+trade as Label text, so P/L is computed from floats/ints that were parsed once
+and saving no longer walks the widget tree.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+MISSING = "-"
+
+# Formats accepted for the free-form date columns, tried in order
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d", "%Y%m%d")
+
+
+def parse_float(text):
+    """Parse a saved numeric cell, treating "-" as a missing value."""
+    text = str(text).strip()
+    if text in (MISSING, ""):
+        return None
+    return float(text)
+
+
+def parse_int(text):
+    """Parse a saved integer cell, treating "-" as a missing value."""
+    text = str(text).strip()
+    if text in (MISSING, ""):
+        return None
+    return int(text)
+
+
+def parse_text(text):
+    """Parse a saved text cell, treating "-" as a missing value."""
+    text = str(text).strip()
+    if text in (MISSING, ""):
+        return None
+    return text
+
+
+def parse_date(text):
+    """Parse a date cell into a datetime.date, or None if it isn't a recognised date."""
+    if not text:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=65536)
+def iso_date(text):
+    """A date cell as YYYY-MM-DD, or None if it isn't a recognised date."""
+    parsed = parse_date(text)
+    return None if parsed is None else parsed.isoformat()
+
+
+def normalize_date(text):
+    """ISO form of a date typed in or imported; blank or "-" is None, anything else unrecognised a ValueError."""
+    text = parse_text(text) if text is not None else None
+    if text is None:
+        return None
+    normalized = iso_date(text)
+    if normalized is None:
+        raise ValueError(f"unrecognised date {text!r}")
+    return normalized
+
+
+@lru_cache(maxsize=65536)
+def date_ordinal(text):
+    """Proleptic ordinal of a date cell, or None; cached since books repeat the same few dates."""
+    parsed = parse_date(text)
+    return None if parsed is None else parsed.toordinal()
+
+
+def format_float(value):
+    return MISSING if value is None else f"{value:.2f}"
+
+
+def format_int(value):
+    return MISSING if value is None else str(value)
+
+
+def format_text(value):
+    return MISSING if value is None else value
+
+
+class EquityTrade:
+    """One equity trade: a buy lot and, once closed, its sale."""
+    __slots__ = ("id", "ticker", "buy_date", "buy_price", "num_shares", "sell_date", "sell_price")
+
+    def __init__(self, ticker, buy_date, buy_price, num_shares, sell_date=None, sell_price=None, id=None):
+        self.id = id
+        self.ticker = ticker
+        self.buy_date = buy_date
+        self.buy_price = buy_price
+        self.num_shares = num_shares
+        self.sell_date = sell_date
+        self.sell_price = sell_price
+
+    @property
+    def symbol(self):
+        return self.ticker
+
+    @property
+    def is_open(self):
+        return self.sell_price is None
+
+    @property
+    def notional(self):
+        if self.buy_price is None or self.num_shares is None:
+            return None
+        return round(self.buy_price * self.num_shares, 2)
+
+    @property
+    def pl(self):
+        """Realized P/L, or None while the position is open."""
+        if self.is_open or self.buy_price is None:
+            return None
+        return (self.sell_price - self.buy_price) * self.num_shares
+
+    def unrealized_pl(self, mark):
+        """P/L if the open position were sold at `mark`."""
+        if not self.is_open or self.buy_price is None:
+            return None
+        return (mark - self.buy_price) * self.num_shares
+
+    def close(self, sell_date, sell_price):
+        self.sell_date = sell_date
+        self.sell_price = sell_price
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_row(self):
+        """Return the trade as the table's column strings."""
+        return [
+            self.ticker, format_text(self.buy_date), format_float(self.buy_price),
+            format_int(self.num_shares), format_float(self.notional),
+            format_text(self.sell_date), format_float(self.sell_price), format_float(self.pl)
+        ]
+
+    @classmethod
+    def from_row(cls, row, id=None):
+        """Build a trade from the table's column strings (Notional and P/L are derived)."""
+        return cls(
+            ticker=row[0],
+            buy_date=parse_text(row[1]),
+            buy_price=parse_float(row[2]),
+            num_shares=parse_int(row[3]),
+            sell_date=parse_text(row[5]),
+            sell_price=parse_float(row[6]),
+            id=id
+        )
+
+
+class OptionTrade:
+    """One option trade: the opening leg and, once closed, its close."""
+    __slots__ = (
+        "id", "underlier", "date", "expiry", "type", "open_price", "strike", "underlier_price",
+        "premium", "fee", "quantity", "close_price", "close_premium"
+    )
+
+    def __init__(self, underlier, date, expiry, type, open_price, strike, underlier_price, premium, fee,
+                 quantity, close_price=None, close_premium=None, id=None):
+        self.id = id
+        self.underlier = underlier
+        self.date = date
+        self.expiry = expiry
+        self.type = type
+        self.open_price = open_price
+        self.strike = strike
+        self.underlier_price = underlier_price
+        self.premium = premium
+        self.fee = fee
+        self.quantity = quantity
+        self.close_price = close_price
+        self.close_premium = close_premium
+
+    @property
+    def symbol(self):
+        return self.underlier
+
+    @property
+    def is_open(self):
+        return self.close_price is None
+
+    @property
+    def pl(self):
+        """Realized P/L, or None while the position is open."""
+        if self.is_open or self.open_price is None:
+            return None
+        return (self.close_price - self.open_price) * (self.quantity * 100) - self.fee
+
+    def unrealized_pl(self, mark):
+        """P/L if the open position were closed at an option price of `mark`."""
+        if not self.is_open or self.open_price is None:
+            return None
+        return (mark - self.open_price) * (self.quantity * 100) - self.fee
+
+    def close(self, close_price, close_premium):
+        self.close_price = close_price
+        self.close_premium = close_premium
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_row(self):
+        """Return the trade as the table's column strings."""
+        return [
+            self.underlier, format_text(self.date), format_text(self.expiry), self.type,
+            format_float(self.open_price), format_float(self.strike), format_float(self.underlier_price),
+            format_float(self.premium), format_float(self.fee), format_int(self.quantity),
+            format_float(self.close_price), format_float(self.close_premium), format_float(self.pl)
+        ]
+
+    @classmethod
+    def from_row(cls, row, id=None):
+        """Build a trade from the table's column strings (P/L is derived)."""
+        return cls(
+            underlier=row[0],
+            date=parse_text(row[1]),
+            expiry=parse_text(row[2]),
+            type=row[3],
+            open_price=parse_float(row[4]),
+            strike=parse_float(row[5]),
+            underlier_price=parse_float(row[6]),
+            premium=parse_float(row[7]),
+            fee=parse_float(row[8]),
+            quantity=parse_int(row[9]),
+            close_price=parse_float(row[10]),
+            close_premium=parse_float(row[11]),
+            id=id
+        )
+
+
+class TradeStore:
+    """Trades of one kind keyed by a stable id, in insertion order.
+
+    If a journal is attached, every add/close/edit/delete is appended to it as
+    an event; apply() replays such an event without journaling it again.
+    Listeners (for example a TradeIndex) are told about every change, replayed
+    or not, through their trade_added(trade), trade_closed(trade) and
+    trade_removed(trade) methods. An edit is a removal of the trade as it was
+    followed by an add of it as it is now, so listeners can file it afresh.
+
+    Ids are never reused, so a deleted trade's id stays unique in the journal.
+    """
+    # Everything is in memory; sqlstore.SqliteTradeStore pages trades in instead
+    paged = False
+
+    def __init__(self, trade_class):
+        self.trade_class = trade_class
+        self.trades = {}
+        self.next_id = 1
+        self.journal = None
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __iter__(self):
+        return iter(self.trades.values())
+
+    def __contains__(self, trade_id):
+        return trade_id in self.trades
+
+    def add(self, trade):
+        """Store a trade, assigning it the next id if it does not have one."""
+        if trade.id is None:
+            trade.id = self.next_id
+        self.next_id = max(self.next_id, trade.id + 1)
+        self.trades[trade.id] = trade
+        for listener in self.listeners:
+            listener.trade_added(trade)
+        if self.journal is not None:
+            self.log({"op": "add", "trade": trade.to_dict()})
+        return trade.id
+
+    def add_many(self, trades):
+        """Store a batch of trades, journaling them in one write. Returns their ids."""
+        journal, self.journal = self.journal, None
+        try:
+            trade_ids = [self.add(trade) for trade in trades]
+        finally:
+            self.journal = journal
+        if journal is not None and trade_ids:
+            journal.extend({"op": "add", "trade": self.trades[trade_id].to_dict()} for trade_id in trade_ids)
+        return trade_ids
+
+    def get(self, trade_id):
+        return self.trades[trade_id]
+
+    def close(self, trade_id, *args):
+        trade = self.trades[trade_id]
+        trade.close(*args)
+        for listener in self.listeners:
+            listener.trade_closed(trade)
+        self.log({"op": "close", "id": trade_id, "args": list(args)})
+        return trade
+
+    def update(self, trade_id, changes):
+        """Change fields of a trade in place; `changes` maps field names (not the id) to new values."""
+        trade = self._update(trade_id, changes)
+        self.log({"op": "edit", "id": trade_id, "changes": changes})
+        return trade
+
+    def _update(self, trade_id, changes):
+        trade = self.trades[trade_id]
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        for field, value in changes.items():
+            setattr(trade, field, value)
+        for listener in self.listeners:
+            listener.trade_added(trade)
+        return trade
+
+    def delete(self, trade_id):
+        trade = self._delete(trade_id)
+        self.log({"op": "delete", "id": trade_id})
+        return trade
+
+    def _delete(self, trade_id):
+        trade = self.trades.pop(trade_id)
+        for listener in self.listeners:
+            listener.trade_removed(trade)
+        return trade
+
+    def log(self, event):
+        if self.journal is not None:
+            self.journal.append(event)
+
+    def apply(self, event):
+        """Replay a journaled event."""
+        op = event["op"]
+        if op == "add":
+            trade = self.trade_class.from_dict(event["trade"])
+            self.trades[trade.id] = trade
+            self.next_id = max(self.next_id, trade.id + 1)
+            for listener in self.listeners:
+                listener.trade_added(trade)
+        elif op == "close":
+            trade = self.trades[event["id"]]
+            trade.close(*event["args"])
+            for listener in self.listeners:
+                listener.trade_closed(trade)
+        elif op == "edit":
+            self._update(event["id"], event["changes"])
+        elif op == "delete":
+            self._delete(event["id"])
+        else:
+            raise ValueError(f"Unknown journal event: {op}")
+
+    def open_trades(self):
+        return (trade for trade in self.trades.values() if trade.is_open)
+
+    def close_storage(self):
+        """Sync and close the journal, if one is attached."""
+        if self.journal is not None:
+            self.journal.close()
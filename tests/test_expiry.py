@@ -0,0 +1,123 @@
+"""Expiring option positions."""
+from datetime import date
+
+import pytest
+
+from expiry import ExpiryIndex
+from store import OptionTrade, TradeStore
+
+TODAY = date(2024, 3, 1)
+
+
+def option(kind="CALL", strike=150.0, expiry="2024-02-29", underlier="AAPL", spot=140.0):
+    return OptionTrade(underlier, "2024-01-02", expiry, kind, 2.0, strike, spot, 2.0, 1.0, 1)
+
+
+@pytest.fixture
+def book():
+    store = TradeStore(OptionTrade)
+    expiries = ExpiryIndex()
+    expiries.watch(store)
+    return store, expiries
+
+
+def test_out_of_the_money_positions_close_at_zero(book):
+    store, expiries = book
+    call = store.add(option("CALL", 150.0))
+    put = store.add(option("PUT", 100.0))
+    marks = {"AAPL": 120.0}
+    expired = expiries.expire(TODAY, lambda trade: marks.get(trade.underlier))
+    assert [(item.trade_id, item.worthless, item.priced) for item in expired] == [(call, True, True), (put, True, True)]
+    assert expired[0].held == 58
+    assert store.get(call).close_price == 0.0
+    assert not store.get(put).is_open
+    assert not expiries.unresolved
+
+
+def test_in_the_money_positions_stay_open(book):
+    store, expiries = book
+    call = store.add(option("CALL", 100.0))
+    (expired,) = expiries.expire(TODAY, lambda trade: 120.0)
+    assert not expired.worthless and expired.priced
+    assert store.get(call).is_open
+    assert expiries.unresolved == {call: date(2024, 2, 29).toordinal()}
+    store.close(call, 20.0, 20.0)
+    assert not expiries.unresolved
+
+
+def test_without_a_mark_the_recorded_price_is_not_used(book):
+    store, expiries = book
+    # Recorded at 140 when opened, which would make the 150 call worthless
+    call = store.add(option("CALL", 150.0, spot=140.0))
+    (expired,) = expiries.expire(TODAY, lambda trade: None)
+    assert not expired.worthless and not expired.priced
+    assert store.get(call).is_open
+    assert expiries.unpriced == {call}
+    # Still waiting: nothing is reported again until there is a mark
+    assert expiries.expire(TODAY, lambda trade: None) == []
+
+    (expired,) = expiries.expire(TODAY, lambda trade: 200.0)
+    assert expired.priced and not expired.worthless
+    assert store.get(call).is_open
+    assert not expiries.unpriced and call in expiries.unresolved
+
+
+def test_an_unpriced_position_closes_once_marked_out_of_the_money(book):
+    store, expiries = book
+    call = store.add(option("CALL", 150.0))
+    expiries.expire(TODAY, lambda trade: None)
+    (expired,) = expiries.expire(TODAY, lambda trade: 120.0)
+    assert expired.worthless
+    assert not store.get(call).is_open
+    assert not expiries.unresolved and not expiries.unpriced
+
+
+def test_a_position_judged_long_after_expiry_is_left_to_the_user(book):
+    store, expiries = book
+    call = store.add(option("CALL", 150.0, expiry="2024-02-16"))
+    (expired,) = expiries.expire(TODAY, lambda trade: 120.0)
+    assert expired.stale and not expired.worthless and not expired.priced
+    assert store.get(call).is_open
+    assert expiries.stale == {call} and call in expiries.unresolved
+    assert expiries.expire(TODAY, lambda trade: 120.0) == []
+    store.close(call, 0.0, 0.0)
+    assert not expiries.unresolved and not expiries.stale
+
+
+def test_an_unpriced_position_goes_stale_without_closing(book):
+    store, expiries = book
+    call = store.add(option("CALL", 150.0))
+    expiries.expire(TODAY, lambda trade: None)
+    (expired,) = expiries.expire(date(2024, 3, 2), lambda trade: 120.0)
+    assert expired.stale and not expired.worthless
+    assert store.get(call).is_open
+    assert not expiries.unpriced and expiries.stale == {call}
+
+
+def test_only_past_expiries_are_taken(book):
+    store, expiries = book
+    store.add(option(expiry="2024-03-01"))
+    store.add(option(expiry="2024-03-05"))
+    assert expiries.expire(TODAY, lambda trade: 120.0) == []
+    assert len(expiries) == 2
+
+
+def test_closed_and_edited_positions_are_skipped(book):
+    store, expiries = book
+    closed = store.add(option())
+    moved = store.add(option())
+    store.close(closed, 1.0, 1.0)
+    store.update(moved, {"expiry": "2024-06-21"})
+    assert expiries.expire(TODAY, lambda trade: 120.0) == []
+    assert store.get(moved).is_open
+
+
+def test_expiring_lists_the_coming_week(book):
+    store, expiries = book
+    soon = store.add(option(expiry="2024-03-04"))
+    store.add(option(expiry="2024-03-20"))
+    closed = store.add(option(expiry="2024-03-06"))
+    store.close(closed, 1.0, 1.0)
+    ((ordinal, trades),) = expiries.expiring(TODAY)
+    assert ordinal == date(2024, 3, 4).toordinal()
+    assert [trade.id for trade in trades] == [soon]
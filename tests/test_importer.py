@@ -0,0 +1,111 @@
+"""Broker statement parsing and de-duplication."""
+import csv
+from collections import Counter
+
+import pytest
+
+from importer import BookCopy, Deduplicator, existing_keys, import_statement
+from mapstore import MappedTradeStore, write_trades
+from sqlstore import SqliteTradeStore
+from store import EquityTrade, OptionTrade, TradeStore
+
+HEADER = ["Symbol", "Date", "Price", "Quantity", "Expiration", "Strike", "Put/Call", "Commission"]
+
+
+@pytest.fixture
+def statement(tmp_path):
+    path = tmp_path / "statement.csv"
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows([
+            HEADER,
+            ["AAPL", "01/02/2024", "100", "10", "", "", "", ""],
+            ["AAPL", "2024-01-02", "100", "10", "", "", "", ""],
+            ["MSFT", "20240103", "300", "5", "", "", "", ""],
+            ["SPY", "2024-01-04", "4.5", "1", "2024-06-21", "450", "P", "1.3"],
+            ["IBM", "not a date", "100", "1", "", "", "", ""],
+            ["IBM", "2024-01-05", "100", "-1", "", "", "", ""],
+        ])
+    return str(path)
+
+
+def books():
+    return TradeStore(EquityTrade), TradeStore(OptionTrade)
+
+
+def test_rows_are_parsed_with_normalized_dates(statement):
+    (batch,) = import_statement(statement, workers=1)
+    assert [(trade.ticker, trade.buy_date) for trade in batch.equities] == [
+        ("AAPL", "2024-01-02"), ("AAPL", "2024-01-02"), ("MSFT", "2024-01-03")
+    ]
+    (put,) = batch.options
+    assert (put.type, put.expiry, put.strike, put.fee) == ("PUT", "2024-06-21", 450.0, 1.3)
+    # A bad date and a sell
+    assert [line for line, _ in batch.errors] == [6, 7]
+    assert batch.rows == 6
+
+
+def test_rows_already_in_the_books_are_skipped(statement):
+    equities, options = books()
+    equities.add(EquityTrade("AAPL", "01/02/2024", 100.0, 10))
+    (batch,) = import_statement(statement, Deduplicator(equities, options), workers=1)
+    # The statement has the AAPL buy twice and the book once, so one copy is new
+    assert [trade.ticker for trade in batch.equities] == ["AAPL", "MSFT"]
+    assert batch.duplicates == 1
+
+
+def test_reimporting_a_statement_adds_nothing(statement):
+    equities, options = books()
+    (batch,) = import_statement(statement, Deduplicator(equities, options), workers=1)
+    equities.add_many(batch.equities)
+    options.add_many(batch.options)
+    (batch,) = import_statement(statement, Deduplicator(equities, options), workers=1)
+    assert not batch.equities and not batch.options
+    assert batch.duplicates == 4
+
+
+def test_trades_added_during_the_import_count(statement):
+    equities, options = books()
+    deduplicator = Deduplicator(equities, options)
+    deduplicator.watch(equities, options)
+    (batch,) = import_statement(statement, workers=1)
+    # Entered by hand after the statement was read but before its batch is added
+    options.add(OptionTrade("SPY", "2024-01-04", "2024-06-21", "PUT", 4.5, 450.0, None, None, 1.3, 1))
+    batch = deduplicator.filter(batch)
+    equities.add_many(batch.equities)
+    assert not batch.options
+    assert len(batch.equities) == 3
+    deduplicator.unwatch()
+    assert deduplicator not in equities.listeners
+
+
+def test_book_copies_count_the_books_as_they_were(tmp_path):
+    memory = TradeStore(EquityTrade)
+    memory.add(EquityTrade("AAPL", "01/02/2024", 100.0, 10))
+    path = str(tmp_path / "e.bin")
+    write_trades(path, EquityTrade, memory, 0, next_id=2)
+    mapped = MappedTradeStore(EquityTrade, path)
+    database = SqliteTradeStore(EquityTrade, str(tmp_path / "t.db"))
+    database.add(EquityTrade("AAPL", "2024-01-02", 100.0, 10))
+
+    copies = [BookCopy(store) for store in (memory, mapped, database)]
+    for store in (memory, mapped, database):
+        store.add(EquityTrade("MSFT", "2024-01-03", 300.0, 5))
+    for copy in copies:
+        # The MSFT buys came after the copies
+        assert existing_keys(copy, ()) == Counter({("equity", "AAPL", "2024-01-02", 100.0, 10): 1})
+        copy.close()
+    database.close_storage()
+
+
+def test_existing_keys_counted_later_add_to_the_changes_seen(statement):
+    equities, options = books()
+    equities.add(EquityTrade("AAPL", "2024-01-02", 100.0, 10))
+    copies = [BookCopy(store) for store in (equities, options)]
+    deduplicator = Deduplicator()
+    deduplicator.watch(equities, options)
+    equities.add(EquityTrade("MSFT", "2024-01-03", 300.0, 5))
+    deduplicator.count_existing(existing_keys(*copies))
+    (batch,) = import_statement(statement, deduplicator, workers=1)
+    # The MSFT buy was added after the copies but while watching
+    assert [trade.ticker for trade in batch.equities] == ["AAPL"]
+    assert batch.duplicates == 2
@@ -0,0 +1,180 @@
+"""Journal replay, snapshots and trade id allocation across reloads."""
+from autosave import Autosave
+from journal import Journal, open_book, read_journal, set_aside, write_snapshot
+from mapstore import MappedTradeStore, write_trades
+from sqlstore import SqliteTradeStore, migrate
+from store import EquityTrade, TradeStore
+
+
+def equity(ticker="AAPL", price=100.0, shares=10):
+    return EquityTrade(ticker, "2024-01-02", price, shares)
+
+
+def open_equities(tmp_path):
+    store = TradeStore(EquityTrade)
+    open_book(store, str(tmp_path / "e.json"), str(tmp_path / "e.journal"))
+    return store
+
+
+def reopen(store, tmp_path):
+    store.close_storage()
+    return open_equities(tmp_path)
+
+
+def save_binary(store, tmp_path):
+    """Fold the journal into a binary snapshot, as the GUI's autosave does."""
+    autosave = Autosave(store, str(tmp_path / "e.bin"))
+    autosave.save()
+    autosave.stop()
+    assert autosave.last_result.error is None
+
+
+def reopen_binary(store, tmp_path):
+    store.close_storage()
+    store = MappedTradeStore(EquityTrade, str(tmp_path / "e.bin"))
+    store.open_journal(str(tmp_path / "e.journal"))
+    return store
+
+
+def test_replay_restores_adds_closes_edits_and_deletes(tmp_path):
+    store = open_equities(tmp_path)
+    first = store.add(equity("AAPL"))
+    second = store.add(equity("MSFT", 300.0, 5))
+    third = store.add(equity("IBM", 150.0, 2))
+    store.close(first, "2024-02-01", 110.0)
+    store.update(second, {"num_shares": 7})
+    store.delete(third)
+
+    store = reopen(store, tmp_path)
+    assert sorted(store.trades) == [first, second]
+    assert store.get(first).sell_price == 110.0
+    assert store.get(first).pl == 100.0
+    assert store.get(second).num_shares == 7
+
+
+def test_replay_stops_at_a_torn_last_line(tmp_path):
+    store = open_equities(tmp_path)
+    store.add(equity("AAPL"))
+    store.add(equity("MSFT"))
+    store.close_storage()
+    path = tmp_path / "e.journal"
+    path.write_text(path.read_text() + '{"op":"add","trade":{"id":3')
+
+    store = open_equities(tmp_path)
+    assert len(store) == 2
+    # The partial line is cut before new events are appended
+    store.add(equity("IBM"))
+    assert [event["op"] for event in read_journal(str(path))] == ["add"] * 3
+
+
+def test_saving_folds_the_journal_into_the_snapshot(tmp_path):
+    store = open_equities(tmp_path)
+    for _ in range(3):
+        store.add(equity())
+    store.close(2, "2024-03-01", 90.0)
+    save_binary(store, tmp_path)
+    assert len(store.journal) == 0
+
+    store = reopen_binary(store, tmp_path)
+    assert len(store) == 3
+    assert store.get(2).sell_price == 90.0
+    store.close_storage()
+
+
+def test_snapshot_events_are_not_replayed_twice(tmp_path):
+    store = open_equities(tmp_path)
+    store.add(equity())
+    save_binary(store, tmp_path)
+    store.add(equity("MSFT"))
+    store = reopen_binary(store, tmp_path)
+    assert [trade.ticker for trade in store] == ["AAPL", "MSFT"]
+    store.close_storage()
+
+
+def test_deleted_newest_id_is_not_reused_after_saving(tmp_path):
+    store = open_equities(tmp_path)
+    for _ in range(3):
+        store.add(equity())
+    store.delete(3)
+    save_binary(store, tmp_path)
+
+    store = reopen_binary(store, tmp_path)
+    assert store.add(equity()) == 4
+    store.close_storage()
+
+
+def test_deleted_newest_id_is_not_reused_from_the_journal(tmp_path):
+    store = open_equities(tmp_path)
+    store.add(equity())
+    store.add(equity())
+    store.delete(2)
+    store = reopen(store, tmp_path)
+    assert store.add(equity()) == 3
+
+
+def test_json_snapshot_keeps_next_id(tmp_path):
+    trades = [equity(), equity("MSFT")]
+    for trade_id, trade in enumerate(trades, 1):
+        trade.id = trade_id
+    write_snapshot(str(tmp_path / "e.json"), [trade.to_dict() for trade in trades], 0, next_id=5)
+    store = open_equities(tmp_path)
+    assert store.add(equity("IBM")) == 5
+    store.close_storage()
+
+
+def test_binary_snapshot_keeps_next_id(tmp_path):
+    path = str(tmp_path / "e.bin")
+    trades = [equity(), equity("MSFT")]
+    for trade_id, trade in enumerate(trades, 1):
+        trade.id = trade_id
+    write_trades(path, EquityTrade, trades, 0, next_id=5)
+    store = MappedTradeStore(EquityTrade, path)
+    store.open_journal(str(tmp_path / "e.journal"))
+    assert store.add(equity("IBM")) == 5
+    store.close_storage()
+
+
+def test_sqlite_keeps_next_id_after_deleting_the_newest_trade(tmp_path):
+    path = str(tmp_path / "t.db")
+    store = SqliteTradeStore(EquityTrade, path)
+    store.add(equity())
+    store.add(equity())
+    store.delete(2)
+    store.close_storage()
+
+    store = SqliteTradeStore(EquityTrade, path)
+    assert store.add(equity()) == 3
+    store.close_storage()
+
+
+def test_migrate_carries_next_id_over(tmp_path):
+    book = open_equities(tmp_path)
+    for _ in range(3):
+        book.add(equity())
+    book.delete(3)
+    path = str(tmp_path / "t.db")
+    migrate(path, [book])
+
+    store = SqliteTradeStore(EquityTrade, path)
+    assert len(store) == 2
+    assert store.add(equity()) == 4
+    store.close_storage()
+
+
+def test_journal_numbers_events_in_order(tmp_path):
+    journal = Journal(str(tmp_path / "j"), sync_every=None)
+    assert journal.append({"op": "delete", "id": 1}) == 1
+    assert journal.extend([{"op": "delete", "id": 2}, {"op": "delete", "id": 3}]) == 3
+    journal.truncate_through(2)
+    journal.close()
+    assert [event["seq"] for event in read_journal(str(tmp_path / "j"))] == [3]
+
+
+def test_set_aside_never_replaces_an_earlier_copy(tmp_path):
+    path = tmp_path / "e.bin"
+    for text in ("first", "second"):
+        path.write_text(text)
+        set_aside(str(path))
+    assert not path.exists()
+    assert (tmp_path / "e.bin.corrupt").read_text() == "first"
+    assert (tmp_path / "e.bin.corrupt.1").read_text() == "second"
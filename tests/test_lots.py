@@ -0,0 +1,99 @@
+"""Lot matching for equity sells, wash sales and realized gains."""
+import pytest
+
+from index import TradeIndex
+from lots import LotBook, realized_gains
+from store import EquityTrade, TradeStore
+
+
+@pytest.fixture
+def book():
+    store = TradeStore(EquityTrade)
+    lots = LotBook(store, TradeIndex(store, ("buy_date", "sell_date")))
+    for buy_date, price, shares in (("2024-01-02", 100.0, 10), ("2024-02-01", 110.0, 10), ("2024-03-01", 120.0, 10)):
+        store.add(EquityTrade("AAPL", buy_date, price, shares))
+    store.add(EquityTrade("MSFT", "2024-01-05", 300.0, 5))
+    return lots
+
+
+def test_fifo_takes_the_oldest_lots(book):
+    assert book.match("AAPL", 15) == [(1, 10), (2, 5)]
+
+
+def test_lifo_takes_the_newest_lots(book):
+    assert book.match("AAPL", 15, "lifo") == [(3, 10), (2, 5)]
+
+
+def test_specific_takes_the_lots_given(book):
+    assert book.match("AAPL", 12, "specific", [3, 1]) == [(3, 10), (1, 2)]
+
+
+@pytest.mark.parametrize("args", [
+    ("AAPL", 31),
+    ("AAPL", 0),
+    ("AAPL", 5, "specific", [4]),
+    ("AAPL", 5, "average"),
+])
+def test_unfillable_sells_are_refused(book, args):
+    with pytest.raises(ValueError):
+        book.match(*args)
+
+
+def test_partial_sell_splits_the_lot(book):
+    store = book.store
+    sale = book.sell("AAPL", 15, "2024-06-03", 130.0)
+    assert sale.changed_ids == [1, 2]
+    assert store.get(1).sell_price == 130.0
+    # The rest of lot 2 stays open and the sold shares become a closed row of their own
+    assert store.get(2).is_open and store.get(2).num_shares == 5
+    (added,) = sale.added_ids
+    sold = store.get(added)
+    assert (sold.buy_date, sold.buy_price, sold.num_shares, sold.sell_price) == ("2024-02-01", 110.0, 5, 130.0)
+    assert sale.cost == 100.0 * 10 + 110.0 * 5
+    assert sale.proceeds == 130.0 * 15
+    # The queue followed the store: the next FIFO sell starts with what is left of lot 2
+    assert book.match("AAPL", 6) == [(2, 5), (3, 1)]
+
+
+def test_loss_with_a_purchase_in_the_window_is_a_wash_sale(book):
+    # Sold at a loss on 2024-02-15; lot 2 was bought 14 days earlier
+    sale = book.sell("AAPL", 10, "2024-02-15", 90.0)
+    assert sale.wash_disallowed == pytest.approx(100.0)
+
+
+def test_gain_and_distant_purchases_are_not_wash_sales(book):
+    assert book.sell("MSFT", 5, "2024-06-03", 250.0).wash_disallowed == 0.0
+    assert book.sell("AAPL", 10, "2024-01-10", 105.0).wash_disallowed == 0.0
+
+
+def test_the_rest_of_a_split_lot_is_not_a_replacement(book):
+    store = book.store
+    store.add(EquityTrade("IBM", "2024-01-02", 100.0, 10))
+    sale = book.sell("IBM", 5, "2024-01-20", 80.0)
+    assert sale.wash_disallowed == 0.0
+
+
+def test_realized_gains_split_short_and_long_term():
+    trades = [
+        EquityTrade("AAPL", "2023-01-03", 100.0, 10, "2024-03-01", 150.0, id=1),
+        EquityTrade("AAPL", "2024-01-02", 100.0, 10, "2024-03-01", 120.0, id=2),
+        EquityTrade("MSFT", "2024-01-02", 300.0, 5, "2023-12-01", 310.0, id=3),
+        EquityTrade("IBM", "2024-01-02", 100.0, 10, id=4),
+    ]
+    by_ticker, total = realized_gains(trades, 2024)
+    assert set(by_ticker) == {"AAPL"}
+    assert by_ticker["AAPL"].long_term == 500.0
+    assert by_ticker["AAPL"].short_term == 200.0
+    assert total.lots == 2 and total.shares == 20
+
+
+def test_each_replacement_share_washes_one_sale_only():
+    trades = [
+        EquityTrade("AAPL", "2024-01-02", 100.0, 10, "2024-03-01", 90.0, id=1),
+        EquityTrade("AAPL", "2024-01-03", 100.0, 10, "2024-03-02", 90.0, id=2),
+        # Bought within 30 days of both losses, enough to replace one of them
+        EquityTrade("AAPL", "2024-03-10", 95.0, 10, id=3),
+    ]
+    by_ticker, total = realized_gains(trades, 2024)
+    assert total.short_term == -200.0
+    assert total.wash_disallowed == pytest.approx(100.0)
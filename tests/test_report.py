@@ -0,0 +1,42 @@
+"""Headless P/L summaries."""
+from datetime import date
+
+import pytest
+
+from report import option_marks, summarize
+from store import EquityTrade, OptionTrade, TradeStore
+
+TODAY = date(2024, 3, 1)
+
+
+def test_summary_totals_and_per_symbol():
+    store = TradeStore(EquityTrade)
+    store.add(EquityTrade("AAPL", "2024-01-02", 100.0, 10, "2024-02-01", 110.0))
+    store.add(EquityTrade("AAPL", "2024-01-03", 100.0, 10))
+    store.add(EquityTrade("MSFT", "2024-01-04", 300.0, 5))
+
+    report = summarize(store)
+    assert (report["trades"], report["open"], report["realized_pl"]) == (3, 2, 100.0)
+    assert report["unrealized_pl"] is None
+
+    report = summarize(store, {"AAPL": 120.0})
+    assert report["unrealized_pl"] == 200.0
+    assert report["by_symbol"]["AAPL"]["unrealized_pl"] == 200.0
+    # MSFT has no mark, so it has no unrealized P/L rather than 0
+    assert report["by_symbol"]["MSFT"]["unrealized_pl"] is None
+
+
+def test_only_marked_options_are_valued():
+    pytest.importorskip("numpy")
+    store = TradeStore(OptionTrade)
+    marked = store.add(OptionTrade("AAPL", "2024-01-02", "2024-06-21", "CALL", 5.0, 150.0, 150.0, 5.0, 1.0, 1))
+    store.add(OptionTrade("MSFT", "2024-01-02", "2024-06-21", "CALL", 5.0, 300.0, 300.0, 5.0, 1.0, 1))
+    # A premium below intrinsic value has no implied vol
+    store.add(OptionTrade("SPY", "2024-01-02", "2024-06-21", "CALL", 1.0, 100.0, 500.0, 1.0, 1.0, 1))
+
+    values = option_marks(store, {"AAPL": 160.0, "SPY": 500.0}, TODAY)
+    assert list(values) == [marked]
+    assert values[marked] > 5.0
+
+    report = summarize(store, {"AAPL": 160.0, "SPY": 500.0}, values)
+    assert report["unrealized_pl"] == pytest.approx((values[marked] - 5.0) * 100 - 1.0)
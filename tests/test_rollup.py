@@ -0,0 +1,90 @@
+"""P/L rollups kept up to date from store events."""
+import pytest
+
+from mapstore import MappedTradeStore, write_trades
+from rollup import PLRollup
+from store import EquityTrade, OptionTrade, TradeStore
+
+
+def books():
+    equities, options = TradeStore(EquityTrade), TradeStore(OptionTrade)
+    equities.add(EquityTrade("AAPL", "2024-01-02", 100.0, 10, "2024-02-05", 110.0))
+    equities.add(EquityTrade("AAPL", "2024-01-03", 105.0, 10))
+    equities.add(EquityTrade("MSFT", "2024-01-04", 300.0, 5))
+    options.add(OptionTrade("AAPL", "2024-01-02", "2024-06-21", "CALL", 3.0, 120.0, 100.0, 3.0, 1.0, 2, 5.0, 5.0))
+    options.add(OptionTrade("SPY", "2024-01-02", "2024-06-21", "PUT", 4.0, 450.0, 470.0, 4.0, 1.0, 1))
+    return equities, options
+
+
+def test_totals_per_book_underlier_expiry_and_month():
+    rollup = PLRollup(books())
+    assert (rollup.total.trades, rollup.total.open) == (5, 3)
+    assert rollup.by_book["equity"].realized_pl == 100.0
+    # (5 - 3) * 2 contracts * 100 - 1 fee
+    assert rollup.by_book["option"].realized_pl == 399.0
+    assert rollup.by_underlier["AAPL"].trades == 3
+    assert rollup.by_underlier["AAPL"].realized_pl == 499.0
+    assert rollup.by_expiry["2024-06-21"].trades == 2
+    assert rollup.by_month["2024-02"].realized_pl == 100.0
+    assert rollup.total.unrealized is None
+
+
+def test_closes_edits_and_deletes_move_the_totals():
+    equities, options = books()
+    rollup = PLRollup([equities, options])
+    changes = []
+    rollup.on_change = lambda: changes.append(1)
+    equities.close(2, "2024-03-01", 95.0)
+    assert rollup.by_book["equity"].realized_pl == 0.0
+    assert rollup.by_month["2024-03"].realized_pl == -100.0
+    equities.update(1, {"sell_price": 120.0})
+    assert rollup.by_book["equity"].realized_pl == 100.0
+    equities.delete(1)
+    assert rollup.by_book["equity"].realized_pl == -100.0
+    assert (rollup.total.trades, rollup.total.open) == (4, 2)
+    assert len(changes) >= 3
+
+
+def test_equity_marks_value_open_shares():
+    equities, options = books()
+    rollup = PLRollup([equities, options])
+    rollup.mark_equities({"AAPL": 110.0, "MSFT": 290.0})
+    assert rollup.by_underlier["AAPL"].unrealized == 50.0
+    assert rollup.by_book["equity"].unrealized == 0.0
+    # A new lot is valued at the last mark straight away
+    equities.add(EquityTrade("AAPL", "2024-03-01", 100.0, 1))
+    assert rollup.by_underlier["AAPL"].unrealized == 60.0
+    equities.close(2, "2024-03-01", 110.0)
+    assert rollup.by_underlier["AAPL"].unrealized == 10.0
+
+
+def test_option_marks_are_replaced_and_dropped_on_close():
+    equities, options = books()
+    rollup = PLRollup([equities, options])
+    put = options.get(2)
+    rollup.mark_options([(put, 6.0)])
+    assert rollup.by_book["option"].unrealized == 199.0
+    rollup.mark_options([(put, 2.0)])
+    assert rollup.by_book["option"].unrealized == -201.0
+    rollup.mark_options([(put, float("nan"))])
+    assert rollup.by_book["option"].unrealized is None
+    rollup.mark_options([(put, 5.0)])
+    options.close(2, 5.0, 5.0)
+    assert rollup.by_book["option"].unrealized is None
+    assert rollup.by_book["option"].realized_pl == 399.0 + 99.0
+
+
+@pytest.mark.parametrize("trade_class", [EquityTrade, OptionTrade])
+def test_snapshot_columns_roll_up_like_trades(tmp_path, trade_class):
+    store = books()[0 if trade_class is EquityTrade else 1]
+    path = str(tmp_path / "book.bin")
+    write_trades(path, trade_class, store, 0)
+    mapped = MappedTradeStore(trade_class, path)
+    expected, actual = PLRollup([store]), PLRollup([mapped])
+    for name in ("total", "by_book", "by_underlier", "by_expiry", "by_month"):
+        want, got = getattr(expected, name), getattr(actual, name)
+        if name == "total":
+            want, got = {None: want}, {None: got}
+        assert {key: (bucket.trades, bucket.open, bucket.realized_pl) for key, bucket in got.items() if bucket.trades} == \
+            {key: (bucket.trades, bucket.open, bucket.realized_pl) for key, bucket in want.items() if bucket.trades}
+    assert actual.equity_open == expected.equity_open
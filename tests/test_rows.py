@@ -0,0 +1,120 @@
+"""UniformRowLayout in a real, offscreen RecycleView.
+
+The layout leans on RecycleBoxLayout internals (_changed_views,
+_rv_positions, clear_layout and view_opts), so these drive it through the
+public RecycleView API and check the rows shown after scrolling, adding
+and deleting.
+"""
+import os
+
+import pytest
+
+# An offscreen window and the mock GL backend, set before Kivy is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("KIVY_GL_BACKEND", "mock")
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_FILELOG", "1")
+pytest.importorskip("kivy")
+
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from kivy.uix.label import Label  # noqa: E402
+from kivy.uix.recycleview import RecycleView  # noqa: E402
+
+from gui import UniformRowLayout  # noqa: E402
+
+ROW_HEIGHT = 30
+SPACING = 5
+
+
+def frames(count=3):
+    for _ in range(count):
+        EventLoop.idle()
+
+
+@pytest.fixture
+def rv():
+    EventLoop.ensure_window()
+    Window.size = (400, 300)
+    rv = RecycleView(do_scroll_x=False, size_hint=(None, None), size=(400, 300))
+    layout = UniformRowLayout(
+        viewclass="Label", orientation="vertical", default_size=(None, ROW_HEIGHT),
+        default_size_hint=(1, None), size_hint_y=None, spacing=SPACING,
+    )
+    layout.bind(minimum_height=layout.setter("height"))
+    rv.add_widget(layout)
+    Window.add_widget(rv)
+    yield rv
+    Window.remove_widget(rv)
+
+
+def set_rows(rv, names):
+    rv.data = [{"text": name} for name in names]
+    frames()
+
+
+def shown(rv):
+    """(index, text) of each row widget on screen, checked against where its index says it belongs."""
+    layout = rv.layout_manager
+    rows = []
+    for view in layout.children:
+        if not isinstance(view, Label) or not view.text:
+            continue
+        index = int(view.text.split()[-1])
+        assert view.height == ROW_HEIGHT
+        assert view.top == pytest.approx(layout.top - index * (ROW_HEIGHT + SPACING))
+        rows.append((index, view.text))
+    return sorted(rows)
+
+
+def test_rows_fill_the_viewport(rv):
+    set_rows(rv, [f"row {i}" for i in range(1000)])
+    layout = rv.layout_manager
+    assert layout.height == 1000 * ROW_HEIGHT + 999 * SPACING
+    rows = shown(rv)
+    assert rows[0] == (0, "row 0")
+    assert [index for index, _ in rows] == list(range(len(rows)))
+    assert len(rows) * (ROW_HEIGHT + SPACING) >= rv.height
+
+
+def test_scrolling_shows_the_rows_under_the_viewport(rv):
+    set_rows(rv, [f"row {i}" for i in range(1000)])
+    rv.scroll_y = 0.5
+    frames()
+    rows = shown(rv)
+    middle = 500
+    assert rows[0][0] < middle < rows[-1][0]
+    assert len(rows) < 20
+    rv.scroll_y = 0
+    frames()
+    assert shown(rv)[-1] == (999, "row 999")
+
+
+def test_adding_and_deleting_rows_rebinds_the_views(rv):
+    names = [f"row {i}" for i in range(100)]
+    set_rows(rv, names)
+    set_rows(rv, ["new 0"] + [f"row {i + 1}" for i in range(100)])
+    assert shown(rv)[:2] == [(0, "new 0"), (1, "row 1")]
+
+    set_rows(rv, [f"row {i}" for i in range(50)])
+    assert rv.layout_manager.height == 50 * ROW_HEIGHT + 49 * SPACING
+    assert shown(rv)[0] == (0, "row 0")
+
+    set_rows(rv, [])
+    assert shown(rv) == []
+    assert rv.layout_manager.height == 0
+
+
+def test_removing_and_editing_one_row_in_place(rv):
+    set_rows(rv, [f"row {i}" for i in range(100)])
+    # A single delete and an edit reach the layout as 'removed' and 'modified' updates
+    del rv.data[0]
+    frames()
+    rv.data[0] = {"text": "edited"}
+    frames()
+    layout = rv.layout_manager
+    assert layout.height == 99 * ROW_HEIGHT + 98 * SPACING
+    views = sorted((layout.top - view.top, view.text) for view in layout.children if view.text)
+    assert [text for _, text in views[:3]] == ["edited", "row 2", "row 3"]
+    for offset, text in views:
+        assert rv.data[round(offset / (ROW_HEIGHT + SPACING))]["text"] == text